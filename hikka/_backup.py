@@ -0,0 +1,178 @@
+"""Builds full and incremental database backups and replays them."""
+
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import gzip
+import hashlib
+import io
+import json
+import logging
+import time
+import typing
+
+from . import utils
+from .database import Database
+
+logger = logging.getLogger(__name__)
+
+BACKUP_FORMAT = 2
+
+
+class BackupEngine:
+    """
+    Builds gzip-compressed database backups. Full backup contains all owners,
+    incremental one contains only owners, changed since the full backup,
+    which it is based on
+    """
+
+    def __init__(self, db: Database):
+        self._db = db
+        self._chunks: typing.Dict[str, str] = {}
+        self._dirty: typing.Set[str] = set()
+        self._all_dirty = True
+        db.on_any_change(self._mark_dirty)
+
+    def close(self):
+        self._db.remove_change_listener(self._mark_dirty)
+
+    def _mark_dirty(self, owner: typing.Optional[str]):
+        if owner is None:
+            self._all_dirty = True
+        else:
+            self._dirty.add(owner)
+
+    def _snapshot(self) -> typing.Tuple[typing.Dict[str, str], typing.Set[str]]:
+        """
+        Serializes owners, changed since the previous snapshot, and reuses
+        chunks of other ones. Runs in event loop, so the database is not
+        changed meanwhile. Chunks are immutable, so the result can be safely
+        processed in another thread
+        :return: Chunks and lazy owners, which must be read from storage
+        """
+        loaded = set(self._db.keys())
+        lazy = self._db.lazy_owners
+        dirty = (
+            loaded | lazy
+            if self._all_dirty
+            else self._dirty | (loaded - self._chunks.keys())
+        )
+        self._all_dirty = False
+        self._dirty = set()
+
+        for owner in self._chunks.keys() - loaded - lazy:
+            del self._chunks[owner]
+
+        for owner in dirty & loaded:
+            try:
+                self._chunks[owner] = json.dumps(dict.__getitem__(self._db, owner))
+            except (TypeError, ValueError):
+                logger.debug("Owner %s is not serializable, skipping it", owner)
+
+        # Lazy owners are not changed since they were stored, so they are
+        # read straight from storage instead of being loaded into memory
+        return dict(self._chunks), {
+            owner for owner in lazy if owner in dirty or owner not in self._chunks
+        }
+
+    async def _read_stored(
+        self,
+        chunks: typing.Dict[str, str],
+        owners: typing.Set[str],
+    ):
+        """Adds chunks of lazy owners, read from storage in worker thread"""
+        for owner, chunk in (
+            await utils.run_sync(self._db.dump_stored, owners)
+        ).items():
+            chunks[owner] = chunk
+            # Owner could be changed while storage was read
+            if not self._all_dirty and owner not in self._dirty:
+                self._chunks[owner] = chunk
+
+    @staticmethod
+    def _compress(chunks: typing.Dict[str, str], meta: dict) -> bytes:
+        """Streams chunks of owners into gzip archive"""
+        result = io.BytesIO()
+        with gzip.GzipFile(fileobj=result, mode="wb") as f:
+            f.write(json.dumps(meta)[:-1].encode() + b', "owners": {')
+            for i, (owner, chunk) in enumerate(chunks.items()):
+                f.write(f"{', ' if i else ''}{json.dumps(owner)}: {chunk}".encode())
+
+            f.write(b"}}")
+
+        return result.getvalue()
+
+    async def build(
+        self,
+        base: typing.Optional[dict] = None,
+    ) -> typing.Tuple[bytes, typing.Dict[str, str]]:
+        """
+        Builds backup. Only serialization of changed owners is done in event
+        loop, hashing and compression are done in worker thread
+        :param base: Manifest of the full backup to build incremental one against.
+            If not passed, full backup is built
+        :return: Compressed backup and digests of all owners
+        """
+        chunks, stored = self._snapshot()
+        if stored:
+            await self._read_stored(chunks, stored)
+
+        def build() -> typing.Tuple[bytes, typing.Dict[str, str]]:
+            digests = {
+                owner: hashlib.sha256(chunk.encode()).hexdigest()
+                for owner, chunk in chunks.items()
+            }
+            meta = {"format": BACKUP_FORMAT, "created": round(time.time())}
+
+            if base is None:
+                meta["type"] = "full"
+                return self._compress(chunks, meta), digests
+
+            meta.update(
+                type="incremental",
+                base=base["message_id"],
+                removed=sorted(base["digests"].keys() - digests.keys()),
+            )
+            return (
+                self._compress(
+                    {
+                        owner: chunk
+                        for owner, chunk in chunks.items()
+                        if base["digests"].get(owner) != digests[owner]
+                    },
+                    meta,
+                ),
+                digests,
+            )
+
+        return await utils.run_sync(build)
+
+
+def decode(data: bytes) -> dict:
+    """
+    Decodes backup. Backups, made before compression was introduced,
+    are plain JSON of the database, so they are treated as full ones
+    :param data: Backup file contents
+    :return: Backup with `type` and `owners`
+    """
+    if not data.startswith(b"\x1f\x8b"):
+        return {"type": "full", "owners": json.loads(data.decode())}
+
+    return json.loads(gzip.decompress(data))
+
+
+def apply_increment(owners: dict, increment: dict) -> dict:
+    """
+    Replays incremental backup on top of owners of the full one
+    :param owners: Owners of the full backup. Modified in place
+    :param increment: Decoded incremental backup
+    :return: Owners of the database at the moment of incremental backup
+    """
+    for owner in increment["removed"]:
+        owners.pop(owner, None)
+
+    owners.update(increment["owners"])
+    return owners
@@ -0,0 +1,143 @@
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+"""Content-addressed on-disk cache of compiled module code"""
+
+import contextlib
+import hashlib
+import importlib.util
+import logging
+import marshal
+import os
+import sys
+import tempfile
+import typing
+from types import CodeType
+
+logger = logging.getLogger(__name__)
+
+CACHE_DIR = os.path.join(os.path.expanduser("~"), ".hikka", "bytecode_cache")
+MAX_FILES = 512
+
+# Cached code is only valid for the interpreter, which produced it
+_HEADER = importlib.util.MAGIC_NUMBER + f"{sys.version}|{sys.flags.optimize}".encode()
+
+
+def _get_key(source: bytes, origin: str) -> str:
+    return hashlib.sha256(
+        _HEADER + b"\0" + origin.encode() + b"\0" + source
+    ).hexdigest()
+
+
+def _get_path(key: str) -> str:
+    return os.path.join(CACHE_DIR, f"{key}.bin")
+
+
+def load(source: bytes, origin: str) -> typing.Optional[CodeType]:
+    """
+    Gets compiled code of the source from cache
+    :param source: Source code of the module
+    :param origin: Origin of the module, which code was compiled with
+    :return: Code object or `None` if it's not cached or cache is invalid
+    """
+    key = _get_key(source, origin)
+    path = _get_path(key)
+
+    try:
+        with open(path, "rb") as f:
+            data = f.read()
+    except OSError:
+        return None
+
+    prefix = _HEADER + key.encode()
+    if data.startswith(prefix):
+        with contextlib.suppress(EOFError, ValueError, TypeError):
+            code = marshal.loads(data[len(prefix) :])
+            if isinstance(code, CodeType):
+                # Mtime is used to evict the least recently used records
+                with contextlib.suppress(OSError):
+                    os.utime(path)
+
+                return code
+
+    logger.debug("Dropping invalid bytecode cache of %s", origin)
+    with contextlib.suppress(OSError):
+        os.remove(path)
+
+    return None
+
+
+def save(source: bytes, origin: str, code: CodeType):
+    """
+    Saves compiled code of the source to cache
+    :param source: Source code of the module
+    :param origin: Origin of the module, which code was compiled with
+    :param code: Compiled code object
+    """
+    key = _get_key(source, origin)
+    path = _get_path(key)
+    temp_path = None
+
+    try:
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        # Modules are compiled by several threads and clients at once,
+        # so each writer needs its own temporary file
+        with tempfile.NamedTemporaryFile(
+            dir=CACHE_DIR,
+            prefix=f"{key}.",
+            suffix=".tmp",
+            delete=False,
+        ) as f:
+            temp_path = f.name
+            f.write(_HEADER + key.encode() + marshal.dumps(code))
+
+        # Replace is atomic, so concurrent readers never see partial record
+        os.replace(temp_path, path)
+    except OSError:
+        logger.debug("Can't save bytecode cache of %s", origin, exc_info=True)
+        if temp_path:
+            with contextlib.suppress(OSError):
+                os.remove(temp_path)
+
+        return
+
+    _prune()
+
+
+def _prune():
+    """Removes the least recently used records, if there are too many of them"""
+    try:
+        records = [
+            entry for entry in os.scandir(CACHE_DIR) if entry.name.endswith(".bin")
+        ]
+    except OSError:
+        return
+
+    if len(records) <= MAX_FILES:
+        return
+
+    with contextlib.suppress(OSError):
+        records.sort(key=lambda entry: entry.stat().st_mtime)
+
+    for entry in records[: len(records) - MAX_FILES]:
+        with contextlib.suppress(OSError):
+            os.remove(entry.path)
+
+
+def compile_cached(source: bytes, origin: str) -> CodeType:
+    """
+    Compiles the source, reusing code from cache if the same source
+    was already compiled with the same origin
+    :param source: Source code of the module
+    :param origin: Origin of the module
+    :return: Code object
+    """
+    if (code := load(source, origin)) is not None:
+        return code
+
+    code = compile(source, origin, "exec", dont_inherit=True)
+    save(source, origin, code)
+    return code
@@ -0,0 +1,155 @@
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+"""Bounded in-memory cache with LRU and TTL eviction"""
+
+import collections
+import heapq
+import itertools
+import time
+import typing
+
+_MISSING = object()
+
+
+class TTLCache:
+    """
+    Mapping, which holds at most `maxsize` records. Least recently used records
+    are evicted when the limit is reached, and every record is evicted after
+    its time to live passes. Expiration times are kept in a heap, so eviction
+    never scans the whole cache.
+    """
+
+    def __init__(self, maxsize: int, ttl: float):
+        """
+        :param maxsize: Maximum amount of records
+        :param ttl: Default time to live of the record in seconds
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._data: typing.OrderedDict[
+            typing.Hashable, typing.Tuple[float, typing.Any]
+        ] = collections.OrderedDict()
+        self._expirations: typing.List[typing.Tuple[float, int, typing.Hashable]] = []
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        self._expire()
+        return len(self._data)
+
+    def __contains__(self, key: typing.Hashable) -> bool:
+        self._expire()
+        return key in self._data
+
+    def __iter__(self) -> typing.Iterator[typing.Hashable]:
+        self._expire()
+        return iter(list(self._data))
+
+    def __getitem__(self, key: typing.Hashable) -> typing.Any:
+        if (value := self.get(key, _MISSING)) is _MISSING:
+            raise KeyError(key)
+
+        return value
+
+    def __setitem__(self, key: typing.Hashable, value: typing.Any):
+        self.set(key, value)
+
+    def __delitem__(self, key: typing.Hashable):
+        del self._data[key]
+
+    def __repr__(self) -> str:
+        return (
+            f"TTLCache(size={len(self)}/{self.maxsize}, hits={self.hits},"
+            f" misses={self.misses}, evictions={self.evictions})"
+        )
+
+    def get(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        """
+        Gets the record and marks it as recently used
+        :param key: Key of the record
+        :param default: Value to return if there is no such record
+        :return: Cached value or `default`
+        """
+        self._expire()
+
+        try:
+            _, value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def set(
+        self,
+        key: typing.Hashable,
+        value: typing.Any,
+        ttl: typing.Optional[float] = None,
+    ):
+        """
+        Saves the record, evicting the least recently used ones if needed
+        :param key: Key of the record
+        :param value: Value to save
+        :param ttl: Time to live of the record. Default one is used if not passed
+        """
+        expires = time.monotonic() + (self.ttl if ttl is None else ttl)
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        heapq.heappush(self._expirations, (expires, next(self._counter), key))
+
+        self._expire()
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+        # Heap keeps entries of overwritten and evicted records until they
+        # expire, so rebuild it if it got too large
+        if len(self._expirations) > 2 * self.maxsize + 64:
+            self._expirations = [
+                (expires, next(self._counter), key)
+                for key, (expires, _) in self._data.items()
+            ]
+            heapq.heapify(self._expirations)
+
+    def pop(self, key: typing.Hashable, default: typing.Any = None) -> typing.Any:
+        """
+        Removes the record
+        :param key: Key of the record
+        :param default: Value to return if there is no such record
+        :return: Removed value or `default`
+        """
+        self._expire()
+        record = self._data.pop(key, None)
+        return default if record is None else record[1]
+
+    def clear(self):
+        """Removes all records"""
+        self._data.clear()
+        self._expirations.clear()
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        """Usage counters of the cache"""
+        return {
+            "size": len(self),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+    def _expire(self):
+        now = time.monotonic()
+        while self._expirations and self._expirations[0][0] <= now:
+            expires, _, key = heapq.heappop(self._expirations)
+            if (record := self._data.get(key)) is not None and record[0] == expires:
+                del self._data[key]
+                self.evictions += 1
@@ -0,0 +1,89 @@
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import contextlib
+import contextvars
+import typing
+
+from hikkatl.tl.types import Message
+
+# Will be used to determine, which client caused logging messages.
+# Tasks, created via `asyncio.ensure_future`, inherit a copy of the
+# current context, so the value follows the code of particular client
+# without any stack inspection.
+client_id: "contextvars.ContextVar[typing.Optional[int]]" = contextvars.ContextVar(
+    "hikka_client_id",
+    default=None,
+)
+
+# Message, which is being processed by command or watcher in current context.
+# Used to recover forum topic if the one, where message was going to be sent,
+# is deleted.
+message: "contextvars.ContextVar[typing.Optional[Message]]" = contextvars.ContextVar(
+    "hikka_message",
+    default=None,
+)
+
+# Module, which code is being executed in current context. Used to tell apart
+# requests, issued by modules, from the ones, issued by Hikka itself, without
+# walking the stack. Typed loosely to avoid circular imports with `.types`.
+module: "contextvars.ContextVar[typing.Optional[typing.Any]]" = contextvars.ContextVar(
+    "hikka_module",
+    default=None,
+)
+
+
+def set_client_id(tg_id: typing.Optional[int]):
+    """
+    Marks current context as the one, which belongs to client `tg_id`
+    :param tg_id: Telegram ID of the client
+    """
+    client_id.set(tg_id)
+
+
+def get_client_id() -> typing.Optional[int]:
+    """Returns Telegram ID of the client, which owns current context"""
+    return client_id.get()
+
+
+def set_message(msg: typing.Optional[Message]):
+    """
+    Marks `msg` as the message, which is being processed in current context
+    :param msg: Message object
+    """
+    message.set(msg)
+
+
+def get_message() -> typing.Optional[Message]:
+    """Returns the message, which is being processed in current context"""
+    return message.get()
+
+
+def set_module(mod: typing.Optional[typing.Any]):
+    """
+    Marks current context as the one, where code of module `mod` is executed
+    :param mod: Module instance
+    """
+    module.set(mod)
+
+
+def get_module() -> typing.Optional[typing.Any]:
+    """Returns the module, which code is being executed in current context"""
+    return module.get()
+
+
+@contextlib.contextmanager
+def module_scope(mod: typing.Optional[typing.Any]) -> typing.Iterator[None]:
+    """
+    Marks the code inside of the block as the one, executed by module `mod`
+    Previous value is restored on exit
+    :param mod: Module instance
+    """
+    token = module.set(mod)
+    try:
+        yield
+    finally:
+        module.reset(token)
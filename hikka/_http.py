@@ -0,0 +1,134 @@
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+"""Shared HTTP client with connection pooling and conditional requests"""
+
+import json
+import logging
+import typing
+
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+CONNECTION_LIMIT = 32
+CONNECTION_LIMIT_PER_HOST = 6
+KEEPALIVE_TIMEOUT = 60
+TIMEOUT = aiohttp.ClientTimeout(total=60, connect=15)
+
+_session: typing.Optional[aiohttp.ClientSession] = None
+
+
+class HTTPError(Exception):
+    """Raised, when server responds with error status code"""
+
+    def __init__(self, response: "Response"):
+        self.response = response
+        super().__init__(f"{response.status} for url {response.url}")
+
+
+class Response(typing.NamedTuple):
+    """Fully read response of the server"""
+
+    url: str
+    status: int
+    headers: typing.Mapping[str, str]
+    text: str
+
+    @property
+    def ok(self) -> bool:
+        return 200 <= self.status < 400
+
+    @property
+    def not_modified(self) -> bool:
+        """Whether the cached copy, which request was conditioned on, is valid"""
+        return self.status == 304
+
+    @property
+    def etag(self) -> typing.Optional[str]:
+        return self.headers.get("ETag")
+
+    @property
+    def last_modified(self) -> typing.Optional[str]:
+        return self.headers.get("Last-Modified")
+
+    def json(self) -> typing.Any:
+        return json.loads(self.text)
+
+    def raise_for_status(self):
+        """Raises :class:`HTTPError` if status code is not successful"""
+        if not self.ok:
+            raise HTTPError(self)
+
+
+def get_session() -> aiohttp.ClientSession:
+    """
+    Returns the session, shared by all requests, creating it if needed.
+    Connections are kept alive and reused between requests to the same host
+    """
+    global _session
+
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=CONNECTION_LIMIT,
+                limit_per_host=CONNECTION_LIMIT_PER_HOST,
+                keepalive_timeout=KEEPALIVE_TIMEOUT,
+                ttl_dns_cache=300,
+            ),
+            timeout=TIMEOUT,
+            headers={"User-Agent": "Hikka Userbot"},
+        )
+
+    return _session
+
+
+async def close():
+    """Closes the shared session and its connections"""
+    global _session
+
+    if _session is not None and not _session.closed:
+        await _session.close()
+
+    _session = None
+
+
+async def get(
+    url: str,
+    *,
+    auth: typing.Optional[str] = None,
+    headers: typing.Optional[typing.Dict[str, str]] = None,
+    etag: typing.Optional[str] = None,
+    last_modified: typing.Optional[str] = None,
+) -> Response:
+    """
+    Performs GET request, using the shared session
+    :param url: URL to request
+    :param auth: Optional authentication string in the format "username:password"
+    :param headers: Additional headers
+    :param etag: `ETag` of the cached copy to revalidate
+    :param last_modified: `Last-Modified` of the cached copy to revalidate
+    :return: Response. If cached copy is still valid, its status is 304
+        and text is empty
+    """
+    headers = dict(headers or {})
+    if etag:
+        headers["If-None-Match"] = etag
+
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+
+    async with get_session().get(
+        url,
+        auth=aiohttp.BasicAuth(*auth.split(":", 1)) if auth else None,
+        headers=headers,
+    ) as response:
+        return Response(
+            url=str(response.url),
+            status=response.status,
+            headers=response.headers,
+            text="" if response.status == 304 else await response.text(),
+        )
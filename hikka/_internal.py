@@ -27,8 +27,19 @@ def get_startup_callback() -> callable:
     )
 
 
+def flush_databases():
+    """Writes pending database changes of all clients before the process exits"""
+    from . import main
+
+    for client in getattr(getattr(main, "hikka", None), "clients", []):
+        if (db := getattr(client, "hikka_db", None)) is not None:
+            db.flush_sync()
+
+
 def die():
     """Platform-dependent way to kill the current process group"""
+    flush_databases()
+
     if "DOCKER" in os.environ:
         sys.exit(0)
     else:
@@ -51,6 +62,7 @@ def restart():
     print("🔄 Restarting...")
 
     if "LAVHOST" in os.environ:
+        flush_databases()
         os.system("lavhost restart")
         return
 
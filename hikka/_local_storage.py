@@ -8,13 +8,12 @@
 import asyncio
 import contextlib
 import hashlib
+import json
 import logging
 import os
 import typing
 
-import requests
-
-from . import utils
+from . import _http, utils
 from .tl_cache import CustomTelegramClient
 from .version import __version__
 
@@ -23,13 +22,27 @@ logger = logging.getLogger(__name__)
 MAX_FILESIZE = 1024 * 1024 * 5  # 5 MB
 MAX_TOTALSIZE = 1024 * 1024 * 100  # 100 MB
 
+PRELOAD_CONCURRENCY = 4
+PRELOAD_RATE = 2  # Requests per second
+
+# Every client has its own storage, but all of them use the same directory,
+# so they share the index instead of overwriting entries of each other
+_indexes: typing.Dict[str, typing.Dict[str, typing.Dict[str, typing.Any]]] = {}
+
 
 class LocalStorage:
     """Saves modules to disk and fetches them if remote storage is not available."""
 
     def __init__(self):
         self._path = os.path.join(os.path.expanduser("~"), ".hikka", "modules_cache")
+        self._index_path = os.path.join(self._path, "index.json")
         self._ensure_dirs()
+        if self._index_path not in _indexes:
+            _indexes[self._index_path] = self._load_index()
+
+        self._index = _indexes[self._index_path]
+        self._index_dirty = False
+        self._batch_depth = 0
 
     @property
     def _total_size(self) -> int:
@@ -40,18 +53,116 @@ class LocalStorage:
         if not os.path.isdir(self._path):
             os.makedirs(self._path)
 
+    @staticmethod
+    def _get_key(repo: str, module_name: str) -> str:
+        return hashlib.sha256(f"{repo}_{module_name}".encode()).hexdigest()
+
     def _get_path(self, repo: str, module_name: str) -> str:
-        return os.path.join(
-            self._path,
-            hashlib.sha256(f"{repo}_{module_name}".encode()).hexdigest() + ".py",
-        )
+        return os.path.join(self._path, self._get_key(repo, module_name) + ".py")
+
+    def _load_index(self) -> typing.Dict[str, typing.Dict[str, typing.Any]]:
+        """Loads metadata of cached modules from disk."""
+        try:
+            with open(self._index_path, "r") as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+        return index if isinstance(index, dict) else {}
+
+    def _save_index(self):
+        """Saves metadata of cached modules to disk."""
+        temp_path = f"{self._index_path}.tmp"
+        try:
+            with open(temp_path, "w") as f:
+                json.dump(self._index, f)
+
+            os.replace(temp_path, self._index_path)
+        except OSError:
+            logger.debug("Can't save local storage index.", exc_info=True)
+            return
 
-    def save(self, repo: str, module_name: str, module_code: str):
+        self._index_dirty = False
+
+    def _mark_index_dirty(self):
+        self._index_dirty = True
+        if not self._batch_depth:
+            self._save_index()
+
+    @contextlib.contextmanager
+    def batch(self) -> typing.Iterator[None]:
+        """Defers saving of the index until the end of the block."""
+        self._batch_depth += 1
+        try:
+            yield
+        finally:
+            self._batch_depth -= 1
+            if not self._batch_depth and self._index_dirty:
+                self._save_index()
+
+    def get_validators(self, repo: str, module_name: str) -> typing.Dict[str, str]:
+        """
+        Gets validators of the cached module to revalidate it with remote storage.
+        :param repo: Repository name.
+        :param module_name: Module name.
+        :return: Dict with `etag` and `last_modified`, if they are known.
+        """
+        if not os.path.isfile(self._get_path(repo, module_name)):
+            return {}
+
+        entry = self._index.get(self._get_key(repo, module_name), {})
+        return {key: entry[key] for key in ("etag", "last_modified") if entry.get(key)}
+
+    def get_sha256(self, repo: str, module_name: str) -> typing.Optional[str]:
+        """
+        Gets sha256 of the cached module. File is read only if its size or
+        modification time differ from the ones, saved in the index.
+        :param repo: Repository name.
+        :param module_name: Module name.
+        :return: Hex digest or None if module is not cached.
+        """
+        path = self._get_path(repo, module_name)
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+
+        key = self._get_key(repo, module_name)
+        entry = self._index.get(key, {})
+        if (
+            entry.get("sha256")
+            and entry.get("size") == stat.st_size
+            and entry.get("mtime") == stat.st_mtime
+        ):
+            return entry["sha256"]
+
+        with open(path, "r") as f:
+            sha = hashlib.sha256(f.read().encode()).hexdigest()
+
+        self._index[key] = {
+            **entry,
+            "sha256": sha,
+            "size": stat.st_size,
+            "mtime": stat.st_mtime,
+        }
+        self._mark_index_dirty()
+        return sha
+
+    def save(
+        self,
+        repo: str,
+        module_name: str,
+        module_code: str,
+        etag: typing.Optional[str] = None,
+        last_modified: typing.Optional[str] = None,
+    ):
         """
         Saves module to disk.
         :param repo: Repository name.
         :param module_name: Module name.
         :param module_code: Module source code.
+        :param etag: `ETag` of the module, sent by remote storage.
+        :param last_modified: `Last-Modified` of the module, sent by remote storage.
         """
         size = len(module_code)
         if size > MAX_FILESIZE:
@@ -71,9 +182,29 @@ class LocalStorage:
             )
             return
 
-        with open(self._get_path(repo, module_name), "w") as f:
+        path = self._get_path(repo, module_name)
+        with open(path, "w") as f:
             f.write(module_code)
 
+        entry = {
+            key: value
+            for key, value in (("etag", etag), ("last_modified", last_modified))
+            if value
+        }
+
+        # Module is read back in text mode, which translates line endings,
+        # so the hash of such sources is computed on demand
+        if "\r" not in module_code:
+            stat = os.stat(path)
+            entry.update(
+                sha256=hashlib.sha256(module_code.encode()).hexdigest(),
+                size=stat.st_size,
+                mtime=stat.st_mtime,
+            )
+
+        self._index[self._get_key(repo, module_name)] = entry
+        self._mark_index_dirty()
+
         logger.debug("Saved module %s from %s to local cache.", module_name, repo)
 
     def fetch(self, repo: str, module_name: str) -> typing.Optional[str]:
@@ -96,42 +227,82 @@ class RemoteStorage:
         self._local_storage = LocalStorage()
         self._client = client
 
-    async def preload(self, urls: typing.List[str]):
-        """Preloads modules from remote storage."""
+    async def _preload_many(
+        self,
+        urls: typing.List[str],
+        concurrency: int = PRELOAD_CONCURRENCY,
+        rate: float = PRELOAD_RATE,
+    ):
+        """
+        Fetches modules concurrently, spacing out the requests.
+        :param urls: URLs of modules.
+        :param concurrency: Maximum amount of simultaneous requests.
+        :param rate: Maximum amount of requests, started per second.
+        """
+        loop = asyncio.get_event_loop()
+        semaphore = asyncio.Semaphore(concurrency)
+        next_start = loop.time()
+
+        async def preload_one(url: str):
+            nonlocal next_start
+
+            async with semaphore:
+                now = loop.time()
+                delay = max(0, next_start - now)
+                next_start = max(now, next_start) + 1 / rate
+                await asyncio.sleep(delay)
+
+                logger.debug("Preloading module %s", url)
+                with contextlib.suppress(Exception):
+                    await self.fetch(url)
+
+        with self._local_storage.batch():
+            await asyncio.gather(*map(preload_one, urls))
+
+    async def preload(
+        self,
+        urls: typing.List[str],
+        concurrency: int = PRELOAD_CONCURRENCY,
+        rate: float = PRELOAD_RATE,
+    ):
+        """
+        Preloads modules from remote storage.
+        :param urls: URLs of modules.
+        :param concurrency: Maximum amount of simultaneous requests.
+        :param rate: Maximum amount of requests, started per second.
+        """
         logger.debug("Preloading modules from remote storage.")
-        for url in urls:
-            logger.debug("Preloading module %s", url)
-
-            with contextlib.suppress(Exception):
-                await self.fetch(url)
-
-            await asyncio.sleep(5)
-
-    async def preload_main_repo(self):
-        """Preloads modules from the main repo."""
-        mods_info = (
-            await utils.run_sync(requests.get, "https://mods.hikariatama.ru/mods.json")
-        ).json()
-        for name, info in mods_info.items():
-            _, repo, module_name = self._parse_url(info["link"])
-            code = self._local_storage.fetch(repo, module_name)
-
-            if code:
-                sha = hashlib.sha256(code.encode()).hexdigest()
-                if sha != info["sha"]:
-                    logger.debug("Module %s from main repo is outdated.", name)
-                    code = None
-                else:
+        await self._preload_many(urls, concurrency, rate)
+
+    async def preload_main_repo(
+        self,
+        concurrency: int = PRELOAD_CONCURRENCY,
+        rate: float = PRELOAD_RATE,
+    ):
+        """
+        Preloads outdated and missing modules from the main repo.
+        :param concurrency: Maximum amount of simultaneous requests.
+        :param rate: Maximum amount of requests, started per second.
+        """
+        mods_info = (await _http.get("https://mods.hikariatama.ru/mods.json")).json()
+        stale = []
+
+        with self._local_storage.batch():
+            for name, info in mods_info.items():
+                _, repo, module_name = self._parse_url(info["link"])
+                sha = self._local_storage.get_sha256(repo, module_name)
+
+                if sha == info["sha"]:
                     logger.debug("Module %s from main repo is up to date.", name)
+                    continue
 
-            if not code:
-                logger.debug("Preloading module %s from main repo.", name)
+                if sha:
+                    logger.debug("Module %s from main repo is outdated.", name)
 
-                with contextlib.suppress(Exception):
-                    await self.fetch(info["link"])
+                stale.append(info["link"])
 
-                await asyncio.sleep(5)
-                continue
+        logger.debug("Preloading %s modules from main repo.", len(stale))
+        await self._preload_many(stale, concurrency, rate)
 
     @staticmethod
     def _parse_url(url: str) -> typing.Tuple[str, str, str]:
@@ -164,30 +335,44 @@ class RemoteStorage:
         :return: Module source code.
         """
         url, repo, module_name = self._parse_url(url)
+        cached = self._local_storage.fetch(repo, module_name)
         try:
-            r = await utils.run_sync(
-                requests.get,
+            r = await _http.get(
                 url,
-                auth=(tuple(auth.split(":", 1)) if auth else None),
+                auth=auth,
                 headers={
-                    "User-Agent": "Hikka Userbot",
                     "X-Hikka-Version": ".".join(map(str, __version__)),
                     "X-Hikka-Commit-SHA": utils.get_git_hash(),
                     "X-Hikka-User": str(self._client.tg_id),
                 },
+                **(
+                    self._local_storage.get_validators(repo, module_name)
+                    if cached is not None
+                    else {}
+                ),
             )
+            if r.not_modified:
+                logger.debug("Module source in local storage is up to date.")
+                return cached
+
             r.raise_for_status()
         except Exception:
             logger.debug(
                 "Can't load module from remote storage. Trying local storage.",
                 exc_info=True,
             )
-            if module := self._local_storage.fetch(repo, module_name):
+            if cached:
                 logger.debug("Module source loaded from local storage.")
-                return module
+                return cached
 
             raise
 
-        self._local_storage.save(repo, module_name, r.text)
+        self._local_storage.save(
+            repo,
+            module_name,
+            r.text,
+            etag=r.etag,
+            last_modified=r.last_modified,
+        )
 
         return r.text
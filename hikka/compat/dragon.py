@@ -82,7 +82,7 @@ class DragonDb:
         return self.db.set(f"dragon.{module}", variable, value)
 
     def get_collection(self, module: str) -> typing.Dict[str, JSONSerializable]:
-        return dict.get(self.db, f"dragon.{module}", {})
+        return self.db[f"dragon.{module}"] if f"dragon.{module}" in self.db else {}
 
     def remove(self, module: str, variable: str) -> JSONSerializable:
         if f"dragon.{module}" not in self.db:
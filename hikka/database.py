@@ -9,21 +9,25 @@ import collections
 import json
 import logging
 import os
+import sqlite3
+import threading
 import time
 
 try:
     import redis
+    import redis.asyncio
 except ImportError as e:
     if "RAILWAY" in os.environ:
         raise e
 
 
 import typing
+from pathlib import Path
 
 from hikkatl.errors.rpcerrorlist import ChannelsTooMuchError
 from hikkatl.tl.types import Message, User
 
-from . import main, utils
+from . import utils
 from .pointers import (
     BaseSerializingMiddlewareDict,
     BaseSerializingMiddlewareList,
@@ -52,64 +56,497 @@ class NoAssetsChannel(Exception):
     """Raised when trying to read/store asset with no asset channel present"""
 
 
+class SQLiteStorage:
+    """
+    Stores database in SQLite file in WAL mode, one row per `(owner, key)`,
+    so one changed key costs one row write instead of full database rewrite
+    """
+
+    def __init__(self, path: Path):
+        self._path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(
+            str(path),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS db (owner TEXT NOT NULL, key TEXT NOT NULL,"
+            " value TEXT NOT NULL, PRIMARY KEY (owner, key)) WITHOUT ROWID"
+        )
+        # Reads have their own connection, so they don't wait for the write,
+        # running in executor. WAL lets them see the last committed state
+        # while the writer holds its transaction
+        self._read_lock = threading.Lock()
+        self._reader = sqlite3.connect(
+            str(path),
+            check_same_thread=False,
+            isolation_level=None,
+        )
+
+    def owners(self) -> typing.Set[str]:
+        """Get all owners, which have at least one key stored"""
+        with self._read_lock:
+            return {
+                owner
+                for owner, in self._reader.execute("SELECT DISTINCT owner FROM db")
+            }
+
+    def load_owner(self, owner: str) -> dict:
+        """Load all keys of single owner"""
+        with self._read_lock:
+            return {
+                key: json.loads(value)
+                for key, value in self._reader.execute(
+                    "SELECT key, value FROM db WHERE owner = ?",
+                    (owner,),
+                )
+            }
+
+    def dump_owner(self, owner: str) -> str:
+        """Get all keys of single owner as JSON object, without decoding values"""
+        with self._read_lock:
+            return (
+                "{"
+                + ", ".join(
+                    f"{json.dumps(key)}: {value}"
+                    for key, value in self._reader.execute(
+                        "SELECT key, value FROM db WHERE owner = ?",
+                        (owner,),
+                    )
+                )
+                + "}"
+            )
+
+    def write(
+        self,
+        upserts: typing.List[typing.Tuple[str, str, str]],
+        deletes: typing.List[typing.Tuple[str, str]],
+        dropped_owners: typing.Iterable[str],
+    ):
+        """
+        Apply changes in a single transaction
+        :param upserts: List of `(owner, key, serialized_value)` to insert or replace
+        :param deletes: List of `(owner, key)` to delete
+        :param dropped_owners: Owners to delete completely before applying upserts
+        """
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "DELETE FROM db WHERE owner = ?",
+                    [(owner,) for owner in dropped_owners],
+                )
+                self._conn.executemany(
+                    "DELETE FROM db WHERE owner = ? AND key = ?",
+                    deletes,
+                )
+                self._conn.executemany(
+                    "INSERT INTO db (owner, key, value) VALUES (?, ?, ?) ON"
+                    " CONFLICT (owner, key) DO UPDATE SET value = excluded.value",
+                    upserts,
+                )
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+
+            self._conn.execute("COMMIT")
+
+    def migrate(self, data: dict):
+        """Import database, which was previously stored as a single JSON"""
+        self.write(
+            [
+                (str(owner), str(key), json.dumps(value))
+                for owner, keys in data.items()
+                if isinstance(keys, dict)
+                for key, value in keys.items()
+            ],
+            [],
+            [],
+        )
+
+
+class RevisionJournal:
+    """
+    Keeps recent database revisions as per-owner JSON snapshots.
+    Snapshots of owners, which were not changed between revisions, are shared,
+    so each revision only costs the owners, changed since the previous one.
+    Snapshots are immutable strings, so revisions are isolated from the live
+    database and from each other.
+    """
+
+    def __init__(self, max_revisions: int = 15, max_size: int = 16 * 1024 * 1024):
+        self._max_revisions = max_revisions
+        self._max_size = max_size
+        self._revisions: typing.List[typing.Dict[str, str]] = []
+        self._size: int = 0
+        self._pending: typing.Set[str] = set()
+        self._pending_all: bool = True
+
+    def __len__(self) -> int:
+        return len(self._revisions)
+
+    @property
+    def size(self) -> int:
+        """Approximate amount of memory, occupied by snapshots, in bytes"""
+        return self._size
+
+    def mark(self, owner: typing.Optional[str] = None):
+        """
+        Mark owner as changed since the last revision
+        :param owner: Owner name. If not passed, all owners are considered changed
+        """
+        if owner is None:
+            self._pending_all = True
+        else:
+            self._pending.add(owner)
+
+    def record(self, db: dict):
+        """Record new revision of `db`, snapshotting only changed owners"""
+        revision = dict(self._revisions[-1]) if self._revisions else {}
+        changed = set(db) if self._pending_all or not self._revisions else self._pending
+        self._pending = set()
+        self._pending_all = False
+
+        for owner in changed:
+            if owner not in db:
+                revision.pop(owner, None)
+                continue
+
+            try:
+                snapshot = json.dumps(dict.__getitem__(db, owner))
+            except (TypeError, ValueError):
+                logger.debug(
+                    "Owner %s is not serializable, keeping old snapshot",
+                    owner,
+                )
+                continue
+
+            # Equal snapshot is shared instead of being stored twice
+            if snapshot != revision.get(owner):
+                revision[owner] = snapshot
+                self._size += len(snapshot)
+
+        for owner in set(revision) - set(db):
+            del revision[owner]
+
+        self._revisions += [revision]
+
+        while len(self._revisions) > 1 and (
+            len(self._revisions) > self._max_revisions or self._size > self._max_size
+        ):
+            self._release([self._revisions.pop(0)], self._revisions[0])
+
+    def get(self, n: int = 1) -> typing.Optional[dict]:
+        """
+        Get decoded revision
+        :param n: How many revisions back to go. `1` is the last recorded one
+        :return: Database state or `None`, if there is no such revision
+        """
+        if not 0 < n <= len(self._revisions):
+            return None
+
+        return {
+            owner: json.loads(snapshot)
+            for owner, snapshot in self._revisions[-n].items()
+        }
+
+    def drop(self, n: int = 1):
+        """Forget `n` last revisions"""
+        if n <= 0:
+            return
+
+        dropped = self._revisions[-n:]
+        del self._revisions[-n:]
+        self._release(dropped, self._revisions[-1] if self._revisions else None)
+
+    def _release(
+        self,
+        dropped: typing.List[typing.Dict[str, str]],
+        neighbour: typing.Optional[typing.Dict[str, str]],
+    ):
+        """
+        Subtracts snapshots of dropped revisions, which are not referenced
+        anymore, from the size. Snapshots are only passed between adjacent
+        revisions, so the shared ones are always in the remaining `neighbour`
+        """
+        alive = {id(snapshot) for snapshot in (neighbour or {}).values()}
+        freed = {
+            id(snapshot): len(snapshot)
+            for revision in dropped
+            for snapshot in revision.values()
+            if id(snapshot) not in alive
+        }
+        self._size -= sum(freed.values())
+
+
 class Database(dict):
     def __init__(self, client: CustomTelegramClient):
         super().__init__()
         self._client: CustomTelegramClient = client
         self._next_revision_call: int = 0
-        self._revisions: typing.List[dict] = []
+        self._journal: RevisionJournal = RevisionJournal()
         self._assets: int = None
         self._me: User = None
-        self._redis: redis.Redis = None
+        self._redis: "redis.asyncio.Redis" = None
+        self._redis_uri: typing.Optional[str] = None
         self._saving_task: asyncio.Future = None
+        self._db_file: typing.Optional[Path] = None
+        self._save_delay: float = 1
+        self._save_lock: asyncio.Lock = asyncio.Lock()
+        # Writes may be run by executor and on shutdown at the same time,
+        # so the older full write must not replace the newer one
+        self._write_lock: threading.Lock = threading.Lock()
+        self._generation: int = 0
+        self._written_generation: int = 0
+        self._dirty_owners: typing.Set[str] = set()
+        self._dirty_keys: typing.Set[typing.Tuple[str, str]] = set()
+        self._full_dirty: bool = True
+        self._serialized: typing.Dict[str, str] = {}
+        self._sqlite: typing.Optional[SQLiteStorage] = None
+        self._lazy_owners: typing.Set[str] = set()
+        self._lazy_loaded: typing.Set[str] = set()
+        self._change_callbacks: typing.Dict[
+            str, typing.List[typing.Callable[[], typing.Any]]
+        ] = collections.defaultdict(list)
+        self._change_listeners: typing.List[
+            typing.Callable[[typing.Optional[str]], typing.Any]
+        ] = []
 
     def __repr__(self):
         return object.__repr__(self)
 
-    def _redis_save_sync(self):
-        with self._redis.pipeline() as pipe:
-            pipe.set(
-                str(self._client.tg_id),
-                json.dumps(self, ensure_ascii=True),
-            )
-            pipe.execute()
+    def __missing__(self, owner: str) -> dict:
+        if owner not in self._lazy_owners:
+            raise KeyError(owner)
 
-    async def remote_force_save(self) -> bool:
-        """Force save database to remote endpoint without waiting"""
-        if not self._redis:
-            return False
+        # Owner is stored in SQLite, but was not requested yet
+        self._lazy_owners.discard(owner)
+        self._lazy_loaded.add(owner)
+        value = self._sqlite.load_owner(owner)
+        super().__setitem__(owner, value)
+        return value
+
+    def __contains__(self, owner: str) -> bool:
+        return super().__contains__(owner) or owner in self._lazy_owners
+
+    def clear(self):
+        self._lazy_owners.clear()
+        self._lazy_loaded.clear()
+        super().clear()
+
+    def load_all(self):
+        """Load all lazily stored owners into memory"""
+        for owner in self._lazy_owners.copy():
+            self.__missing__(owner)
+
+    @property
+    def lazy_owners(self) -> typing.Set[str]:
+        """Owners, which are stored, but were not loaded into memory yet"""
+        return set(self._lazy_owners)
+
+    def dump_stored(self, owners: typing.Iterable[str]) -> typing.Dict[str, str]:
+        """
+        Serializes owners straight from storage, without loading them into memory.
+        Blocks on storage, so must be run in executor
+        :param owners: Owners from `lazy_owners`
+        :return: Mapping of owners to their JSON
+        """
+        return {owner: self._sqlite.dump_owner(owner) for owner in owners}
+
+    @property
+    def _redis_key(self) -> str:
+        return f"hikka-db-{self._client.tg_id}"
+
+    def _redis_changes(
+        self,
+        full: bool,
+        owners: typing.Set[str],
+        keys: typing.Set[typing.Tuple[str, str]],
+    ) -> typing.Tuple[typing.Dict[str, str], typing.Set[str]]:
+        """
+        Collects changed owners as Redis hash fields
+        :return: Mapping of fields to set and fields to delete
+        """
+        dirty = set(self) if full else owners | {owner for owner, _ in keys}
+
+        mapping, deleted = {}, set()
+        for owner in dirty:
+            if not super().__contains__(owner):
+                deleted.add(str(owner))
+                continue
+
+            try:
+                mapping[str(owner)] = json.dumps(
+                    super().__getitem__(owner),
+                    ensure_ascii=True,
+                )
+            except (TypeError, ValueError):
+                logger.exception(
+                    "Can't serialize db owner %s, keeping its last saved state",
+                    owner,
+                )
+
+        return mapping, deleted
+
+    async def _redis_publish(self) -> bool:
+        """
+        Publish changed owners to Redis hash in a single pipeline.
+        If it fails, changes are kept for the next save
+        """
+        dirty = self._take_dirty()
+        try:
+            await self._redis_write(dirty[0], *self._redis_changes(*dirty))
+        except Exception:
+            self._restore_dirty(*dirty)
+            raise
 
-        await utils.run_sync(self._redis_save_sync)
-        logger.debug("Published db to Redis")
         return True
 
-    async def _redis_save(self) -> bool:
-        """Save database to redis"""
+    async def _redis_write(
+        self,
+        full: bool,
+        mapping: typing.Dict[str, str],
+        deleted: typing.Set[str],
+    ):
+        """
+        Writes fields to Redis hash
+        :param full: Whether fields, absent in `mapping`, must be dropped
+        :param mapping: Fields to set
+        :param deleted: Fields to delete
+        """
+        if full:
+            deleted |= {
+                field.decode() if isinstance(field, bytes) else field
+                for field in await self._redis.hkeys(self._redis_key)
+            } - set(mapping)
+
+        if not mapping and not deleted:
+            return
+
+        async with self._redis.pipeline(transaction=True) as pipe:
+            if deleted:
+                pipe.hdel(self._redis_key, *deleted)
+
+            if mapping:
+                pipe.hset(self._redis_key, mapping=mapping)
+
+            await pipe.execute()
+
+        logger.debug(
+            "Published %s owners to Redis (%s removed)",
+            len(mapping),
+            len(deleted),
+        )
+
+    def _redis_write_sync(
+        self,
+        mapping: typing.Dict[str, str],
+        deleted: typing.Set[str],
+    ):
+        """
+        Writes the whole database to Redis hash, blocking the caller.
+        Uses its own connection, since the async one belongs to the event loop
+        """
+        client = redis.Redis.from_url(self._redis_uri)
+        try:
+            deleted |= {
+                field.decode() if isinstance(field, bytes) else field
+                for field in client.hkeys(self._redis_key)
+            } - set(mapping)
+
+            with client.pipeline(transaction=True) as pipe:
+                if deleted:
+                    pipe.hdel(self._redis_key, *deleted)
+
+                if mapping:
+                    pipe.hset(self._redis_key, mapping=mapping)
+
+                pipe.execute()
+        finally:
+            client.close()
+
+    async def _redis_read(self):
+        """Read database from Redis hash without blocking the event loop"""
+        try:
+            if not await self._redis.exists(self._redis_key):
+                await self._redis_migrate()
+
+            async for owner, value in self._redis.hscan_iter(self._redis_key):
+                super().__setitem__(
+                    owner.decode() if isinstance(owner, bytes) else owner,
+                    json.loads(value),
+                )
+        except Exception:
+            logger.exception("Error reading redis database")
+
+    async def _redis_migrate(self):
+        """Move database, stored as a single JSON string, to Redis hash"""
+        legacy_key = str(self._client.tg_id)
+        if not (legacy := await self._redis.get(legacy_key)):
+            return
+
+        data = json.loads(legacy.decode())
+        await self._redis.hset(
+            self._redis_key,
+            mapping={
+                str(owner): json.dumps(value, ensure_ascii=True)
+                for owner, value in data.items()
+            },
+        )
+        await self._redis.rename(legacy_key, f"{legacy_key}.migrated")
+        logger.info("Migrated %s database owners to Redis hash", len(data))
+
+    async def remote_force_save(self) -> bool:
+        """Force save database to remote endpoint without waiting"""
         if not self._redis:
             return False
 
-        await asyncio.sleep(5)
-        await utils.run_sync(self._redis_save_sync)
-        logger.debug("Published db to Redis")
-        self._saving_task = None
-        return True
+        return await self.force_save()
 
     async def redis_init(self) -> bool:
         """Init redis database"""
+        from . import main
+
         if REDIS_URI := (
             os.environ.get("REDIS_URL") or main.get_config_key("redis_uri")
         ):
-            self._redis = redis.Redis.from_url(REDIS_URI)
+            self._redis_uri = REDIS_URI
+            self._redis = redis.asyncio.Redis.from_url(REDIS_URI)
         else:
             return False
 
     async def init(self):
         """Asynchronous initialization unit"""
+        # Main module builds the whole application on import, so it is
+        # only imported, when database is actually initialized
+        from . import main
+
         if os.environ.get("REDIS_URL") or main.get_config_key("redis_uri"):
             await self.redis_init()
 
         self._db_file = main.BASE_PATH / f"config-{self._client.tg_id}.json"
-        self.read()
+        self._save_delay = float(
+            main.get_config_key("db_save_delay") or (5 if self._redis else 1)
+        )
+
+        if not self._redis and main.get_config_key("db_backend") == "sqlite":
+            self._sqlite = SQLiteStorage(
+                main.BASE_PATH / f"config-{self._client.tg_id}.sqlite"
+            )
+
+        if self._redis:
+            await self._redis_read()
+        elif self._sqlite:
+            # Migration from JSON may take a while, so keep the loop free
+            await utils.run_sync(self.read)
+        else:
+            self.read()
+
+        # Storage is in sync with memory right after read
+        self._full_dirty = False
 
         try:
             self._assets, _ = await utils.asset_channel(
@@ -131,17 +568,10 @@ class Database(dict):
 
     def read(self):
         """Read database and stores it in self"""
-        if self._redis:
-            try:
-                self.update(
-                    **json.loads(
-                        self._redis.get(
-                            str(self._client.tg_id),
-                        ).decode(),
-                    )
-                )
-            except Exception:
-                logger.exception("Error reading redis database")
+        if self._sqlite:
+            self._lazy_owners = self._sqlite.owners()
+            if not self._lazy_owners and self._db_file.exists():
+                self._migrate_to_sqlite()
             return
 
         try:
@@ -151,6 +581,23 @@ class Database(dict):
         except FileNotFoundError:
             logger.debug("Database file not found, creating new one...")
 
+    def _migrate_to_sqlite(self):
+        """Move existing JSON database to SQLite storage"""
+        try:
+            data = json.loads(self._db_file.read_text())
+        except json.decoder.JSONDecodeError:
+            logger.warning("Can't migrate broken database file to SQLite")
+            return
+
+        self._sqlite.migrate(data)
+        self._db_file.rename(self._db_file.with_name(f"{self._db_file.name}.migrated"))
+        self._lazy_owners = self._sqlite.owners()
+        logger.info(
+            "Migrated %s database owners from %s to SQLite",
+            len(self._lazy_owners),
+            self._db_file.name,
+        )
+
     def process_db_autofix(self, db: dict) -> bool:
         if not utils.is_serializable(db):
             return False
@@ -189,45 +636,396 @@ class Database(dict):
 
         return True
 
-    def save(self) -> bool:
-        """Save database"""
-        if not self.process_db_autofix(self):
+    def _mark_dirty(
+        self,
+        owner: typing.Optional[str] = None,
+        key: typing.Optional[str] = None,
+    ):
+        self._journal.mark(owner)
+
+        for callback in (
+            [c for callbacks in self._change_callbacks.values() for c in callbacks]
+            if owner is None
+            else self._change_callbacks.get(owner, [])
+        ):
+            callback()
+
+        for listener in self._change_listeners:
+            listener(owner)
+
+        if owner is None:
+            self._full_dirty = True
+        elif key is None:
+            self._dirty_owners.add(owner)
+        else:
+            self._dirty_keys.add((owner, key))
+
+    def on_change(self, owner: str, callback: typing.Callable[[], typing.Any]):
+        """
+        Calls `callback` every time, when data of `owner` is saved
+        :param owner: Owner to watch
+        :param callback: Function without arguments
+        """
+        self._change_callbacks[owner].append(callback)
+
+    def on_any_change(
+        self,
+        listener: typing.Callable[[typing.Optional[str]], typing.Any],
+    ):
+        """
+        Calls `listener` every time, when data of any owner is saved
+        :param listener: Function, which accepts name of the changed owner
+                         or `None`, if the whole database has changed
+        """
+        self._change_listeners.append(listener)
+
+    def remove_change_listener(
+        self,
+        listener: typing.Callable[[typing.Optional[str]], typing.Any],
+    ):
+        """
+        Stops calling `listener`, added via `on_any_change`
+        :param listener: Previously added listener
+        """
+        if listener in self._change_listeners:
+            self._change_listeners.remove(listener)
+
+    def _serialize(
+        self,
+        full: bool,
+        owners: typing.Set[str],
+        keys: typing.Set[typing.Tuple[str, str]],
+    ) -> str:
+        """
+        Serializes database to JSON, reusing cached chunks of owners,
+        which were not changed since the last save
+        """
+        if full:
+            self._serialized.clear()
+            dirty = set(self)
+        else:
+            dirty = (
+                owners
+                | {owner for owner, _ in keys}
+                | (self.keys() - self._serialized.keys())
+            )
+
+        for owner in self._serialized.keys() - self.keys():
+            del self._serialized[owner]
+
+        for owner in dirty:
+            if owner not in self:
+                continue
+
+            try:
+                self._serialized[owner] = json.dumps(
+                    super().__getitem__(owner),
+                    indent=4,
+                ).replace("\n", "\n    ")
+            except (TypeError, ValueError):
+                logger.exception(
+                    "Can't serialize db owner %s, keeping its last saved state",
+                    owner,
+                )
+
+        if not self._serialized:
+            return "{}"
+
+        return (
+            "{\n"
+            + ",\n".join(
+                f"    {json.dumps(str(owner))}: {self._serialized[owner]}"
+                for owner in self
+                if owner in self._serialized
+            )
+            + "\n}"
+        )
+
+    def _take_dirty(
+        self,
+    ) -> typing.Tuple[bool, typing.Set[str], typing.Set[typing.Tuple[str, str]]]:
+        """
+        Takes changes, collected since the last save, so the new ones
+        are collected separately while the save is in progress
+        :return: Whether the whole database is dirty, dirty owners and dirty keys
+        """
+        dirty = (self._full_dirty, self._dirty_owners, self._dirty_keys)
+        self._full_dirty = False
+        self._dirty_owners = set()
+        self._dirty_keys = set()
+        return dirty
+
+    def _restore_dirty(
+        self,
+        full: bool,
+        owners: typing.Set[str],
+        keys: typing.Set[typing.Tuple[str, str]],
+    ):
+        """Returns changes, taken by the failed save, so the next save retries them"""
+        self._full_dirty |= full
+        self._dirty_owners |= owners
+        self._dirty_keys |= keys
+
+    def _sqlite_changes(
+        self,
+        full: bool,
+        owners: typing.Set[str],
+        keys: typing.Set[typing.Tuple[str, str]],
+    ) -> typing.Tuple[
+        typing.List[typing.Tuple[str, str, str]],
+        typing.List[typing.Tuple[str, str]],
+        typing.Optional[typing.Set[str]],
+    ]:
+        """
+        Collects changes as rows for `SQLiteStorage.write`.
+        Owners, marked dirty as a whole, are rewritten completely, while
+        for other ones only changed keys are upserted. If the whole database
+        is dirty, owners to drop are only known after reading the storage,
+        so `None` is returned instead of them
+        """
+        if full:
+            dropped = None
+            rewrite = set(super().keys())
+            keys = set()
+        else:
+            rewrite = owners
+            dropped = set(rewrite)
+            keys = {key for key in keys if key[0] not in rewrite}
+
+        upserts, deletes = [], []
+
+        def serialize(owner: str, key: str, value: typing.Any):
             try:
-                rev = self._revisions.pop()
-                while not self.process_db_autofix(rev):
-                    rev = self._revisions.pop()
-            except IndexError:
+                upserts.append((str(owner), str(key), json.dumps(value)))
+            except (TypeError, ValueError):
+                logger.exception(
+                    "Can't serialize db key %s of %s, keeping its last saved state",
+                    key,
+                    owner,
+                )
+
+        for owner in rewrite:
+            if super().__contains__(owner):
+                for key, value in super().__getitem__(owner).items():
+                    serialize(owner, key, value)
+
+        for owner, key in keys:
+            if not super().__contains__(owner):
+                continue
+
+            if key in (values := super().__getitem__(owner)):
+                serialize(owner, key, values[key])
+            else:
+                deletes.append((str(owner), str(key)))
+
+        return upserts, deletes, dropped
+
+    def _sqlite_write(
+        self,
+        upserts: typing.List[typing.Tuple[str, str, str]],
+        deletes: typing.List[typing.Tuple[str, str]],
+        dropped: typing.Optional[typing.Set[str]],
+        lazy_owners: typing.Set[str],
+        generation: int,
+    ):
+        """
+        Applies changes, collected by `_sqlite_changes`, to the storage.
+        Blocks on storage lock, so must be run in executor
+        """
+        with self._write_lock:
+            if generation < self._written_generation:
+                # Newer full rewrite already contains these changes
+                return
+
+            if dropped is None:
+                dropped = self._sqlite.owners() - lazy_owners
+                self._written_generation = generation
+
+            self._sqlite.write(upserts, deletes, dropped)
+
+    def _write_sync(self, data: str, generation: int):
+        """Atomically replaces database file with `data`"""
+        with self._write_lock:
+            if generation < self._written_generation:
+                return
+
+            temp_file = self._db_file.with_name(f"{self._db_file.name}.tmp")
+            with open(temp_file, "w", encoding="utf-8") as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+
+            os.replace(temp_file, self._db_file)
+            self._written_generation = generation
+
+    def _next_generation(self) -> int:
+        self._generation += 1
+        return self._generation
+
+    async def _delayed_save(self):
+        """Save database after the debounce window ends"""
+        await asyncio.sleep(self._save_delay)
+        self._saving_task = None
+        await self._flush()
+
+    async def _flush(self) -> bool:
+        if self._redis:
+            async with self._save_lock:
+                try:
+                    return await self._redis_publish()
+                except Exception:
+                    logger.exception("Database save failed!")
+                    return False
+
+        if self._sqlite:
+            async with self._save_lock:
+                dirty = self._take_dirty()
+                try:
+                    await utils.run_sync(
+                        self._sqlite_write,
+                        *self._sqlite_changes(*dirty),
+                        set(self._lazy_owners),
+                        self._next_generation(),
+                    )
+                except Exception:
+                    self._restore_dirty(*dirty)
+                    logger.exception("Database save failed!")
+                    return False
+
+            return True
+
+        if not self._db_file:
+            return False
+
+        async with self._save_lock:
+            dirty = self._take_dirty()
+            try:
+                await utils.run_sync(
+                    self._write_sync,
+                    self._serialize(*dirty),
+                    self._next_generation(),
+                )
+            except Exception:
+                self._restore_dirty(*dirty)
+                logger.exception("Database save failed!")
+                return False
+
+        return True
+
+    async def force_save(self) -> bool:
+        """Save database immediately, skipping the debounce window"""
+        if self._saving_task:
+            self._saving_task.cancel()
+            self._saving_task = None
+
+        return await self._flush()
+
+    def flush_sync(self) -> bool:
+        """
+        Save database immediately, blocking the caller. Used on shutdown,
+        when the event loop is stopped or is not going to run pending saves.
+        The whole database is written, because the save, interrupted
+        by shutdown, may have taken some of the changes
+        """
+        if self._saving_task:
+            self._saving_task.cancel()
+            self._saving_task = None
+
+        dirty = self._take_dirty()
+        if not any(dirty) and not self._save_lock.locked():
+            return True
+
+        try:
+            if self._redis:
+                self._redis_write_sync(*self._redis_changes(True, set(), set()))
+            elif self._sqlite:
+                self._sqlite_write(
+                    *self._sqlite_changes(True, set(), set()),
+                    set(self._lazy_owners),
+                    self._next_generation(),
+                )
+            elif self._db_file:
+                self._write_sync(
+                    self._serialize(True, set(), set()),
+                    self._next_generation(),
+                )
+            else:
+                return False
+        except Exception:
+            self._restore_dirty(*dirty)
+            logger.exception("Database save failed!")
+            return False
+
+        return True
+
+    def save(
+        self,
+        owner: typing.Optional[str] = None,
+        key: typing.Optional[str] = None,
+    ) -> bool:
+        """
+        Schedule database save
+        :param owner: If passed, only this owner is considered changed.
+                      Otherwise the whole database is re-serialized and checked
+        :param key: If passed along with `owner`, only this key is considered changed
+        """
+        self._mark_dirty(owner, key)
+
+        if owner is None and not self.process_db_autofix(self):
+            n = 1
+            while (rev := self._journal.get(n)) is not None:
+                if self.process_db_autofix(rev):
+                    break
+
+                n += 1
+            else:
                 raise RuntimeError(
                     "Can't find revision to restore broken database from "
                     "database is most likely broken and will lead to problems, "
                     "so its save is forbidden."
                 )
 
-            self.clear()
-            self.update(**rev)
+            self.rollback(n)
 
             raise RuntimeError(
                 "Rewriting database to the last revision because new one destructed it"
             )
 
         if self._next_revision_call < time.time():
-            self._revisions += [dict(self)]
+            self._journal.record(self)
             self._next_revision_call = time.time() + 3
 
-        while len(self._revisions) > 15:
-            self._revisions.pop()
+        if not self._saving_task:
+            self._saving_task = asyncio.ensure_future(self._delayed_save())
 
-        if self._redis:
-            if not self._saving_task:
-                self._saving_task = asyncio.ensure_future(self._redis_save())
-            return True
+        return True
 
-        try:
-            self._db_file.write_text(json.dumps(self, indent=4))
-        except Exception:
-            logger.exception("Database save failed!")
+    def rollback(self, n: int = 1) -> bool:
+        """
+        Restore database to one of the recent revisions
+        :param n: How many revisions back to go. `1` is the last recorded one
+        :return: `True` if revision was found and restored, otherwise `False`
+        """
+        if (rev := self._journal.get(n)) is None:
             return False
 
+        # Owners, which were not loaded from lazy storage when revision was
+        # recorded, are not the part of it. Loaded ones are returned to storage
+        # instead of being deleted, otherwise the save would drop them from disk
+        for owner in set(super().keys()) - set(rev):
+            super().__delitem__(owner)
+            if owner in self._lazy_loaded:
+                self._lazy_owners.add(owner)
+
+        self._lazy_owners -= set(rev)
+        super().update(rev)
+        self._journal.drop(n - 1)
+        self._mark_dirty()
+        self._journal.mark()
+
+        if not self._saving_task:
+            self._saving_task = asyncio.ensure_future(self._delayed_save())
+
         return True
 
     async def store_asset(self, message: Message) -> int:
@@ -296,8 +1094,11 @@ class Database(dict):
                 "JSON-serializable value which will cause errors"
             )
 
+        if owner in self._lazy_owners:
+            self.__missing__(owner)
+
         super().setdefault(owner, {})[key] = value
-        return self.save()
+        return self.save(owner, key)
 
     def pointer(
         self,
@@ -25,9 +25,10 @@
 import asyncio
 import collections
 import contextlib
-import copy
+import heapq
 import inspect
 import logging
+import operator
 import re
 import sys
 import traceback
@@ -37,7 +38,7 @@ from hikkatl import events
 from hikkatl.errors import FloodWaitError, RPCError
 from hikkatl.tl.types import Message
 
-from . import main, security, utils
+from . import _context, main, security, utils
 from .database import Database
 from .loader import Modules
 from .tl_cache import CustomTelegramClient
@@ -93,6 +94,53 @@ ALL_TAGS = [
 ]
 
 
+# Used to recognize commands, typed in the wrong keyboard layout
+LAYOUT_TABLE = str.maketrans(ru_keys + en_keys, en_keys + ru_keys)
+
+
+class DispatcherConfig(typing.NamedTuple):
+    """Snapshot of the settings, used by dispatcher on every update"""
+
+    prefix: str
+    translated_prefix: str
+    blacklist_chats: typing.Set[typing.Union[int, str]]
+    whitelist_chats: typing.Set[int]
+    whitelist_modules: typing.Set[str]
+    disabled_watchers: typing.Dict[str, typing.Set[typing.Union[int, str]]]
+    no_nickname: bool
+    nonickcmds: typing.Set[str]
+    nonickusers: typing.Set[int]
+    nonickchats: typing.Set[int]
+    grep: bool
+
+    @classmethod
+    def from_db(cls, db: Database) -> "DispatcherConfig":
+        """
+        Reads settings from database
+        :param db: Database to read settings from
+        :return: Settings snapshot
+        """
+        prefix = db.get(main.__name__, "command_prefix", False) or "."
+        return cls(
+            prefix=prefix,
+            translated_prefix=str.translate(prefix, LAYOUT_TABLE),
+            blacklist_chats=set(db.get(main.__name__, "blacklist_chats", [])),
+            whitelist_chats=set(db.get(main.__name__, "whitelist_chats", [])),
+            whitelist_modules=set(db.get(main.__name__, "whitelist_modules", [])),
+            disabled_watchers={
+                modname: set(rules)
+                for modname, rules in db.get(
+                    main.__name__, "disabled_watchers", {}
+                ).items()
+            },
+            no_nickname=bool(db.get(main.__name__, "no_nickname", False)),
+            nonickcmds=set(db.get(main.__name__, "nonickcmds", [])),
+            nonickusers=set(db.get(main.__name__, "nonickusers", [])),
+            nonickchats=set(db.get(main.__name__, "nonickchats", [])),
+            grep=bool(db.get(main.__name__, "grep", False)),
+        )
+
+
 def _decrement_ratelimit(delay, data, key, severity):
     def inner():
         data[key] = max(0, data[key] - severity)
@@ -100,6 +148,189 @@ def _decrement_ratelimit(delay, data, key, severity):
     asyncio.get_event_loop().call_later(delay, inner)
 
 
+_TAG_CHECKS: typing.Dict[
+    str, typing.Callable[[typing.Any, "WatcherPlan"], typing.Any]
+] = {
+    "out": lambda m, _: getattr(m, "out", True),
+    "in": lambda m, _: not getattr(m, "out", True),
+    "only_messages": lambda m, _: isinstance(m, Message),
+    "editable": (
+        lambda m, _: not getattr(m, "out", False)
+        and not getattr(m, "fwd_from", False)
+        and not getattr(m, "sticker", False)
+        and not getattr(m, "via_bot_id", False)
+    ),
+    "no_media": lambda m, _: (
+        not isinstance(m, Message) or not getattr(m, "media", False)
+    ),
+    "only_media": lambda m, _: isinstance(m, Message) and getattr(m, "media", False),
+    "only_photos": lambda m, _: utils.mime_type(m).startswith("image/"),
+    "only_videos": lambda m, _: utils.mime_type(m).startswith("video/"),
+    "only_audios": lambda m, _: utils.mime_type(m).startswith("audio/"),
+    "only_stickers": lambda m, _: getattr(m, "sticker", False),
+    "only_docs": lambda m, _: getattr(m, "document", False),
+    "only_inline": lambda m, _: getattr(m, "via_bot_id", False),
+    "only_channels": lambda m, _: (
+        getattr(m, "is_channel", False) and not getattr(m, "is_group", False)
+    ),
+    "no_channels": lambda m, _: not getattr(m, "is_channel", False),
+    "no_groups": (
+        lambda m, _: not getattr(m, "is_group", False)
+        or getattr(m, "private", False)
+        or getattr(m, "is_channel", False)
+    ),
+    "only_groups": (
+        lambda m, _: getattr(m, "is_group", False)
+        or not getattr(m, "private", False)
+        and not getattr(m, "is_channel", False)
+    ),
+    "no_pm": lambda m, _: not getattr(m, "private", False),
+    "only_pm": lambda m, _: getattr(m, "private", False),
+    "no_inline": lambda m, _: not getattr(m, "via_bot_id", False),
+    "no_stickers": lambda m, _: not getattr(m, "sticker", False),
+    "no_docs": lambda m, _: not getattr(m, "document", False),
+    "no_audios": lambda m, _: not utils.mime_type(m).startswith("audio/"),
+    "no_videos": lambda m, _: not utils.mime_type(m).startswith("video/"),
+    "no_photos": lambda m, _: not utils.mime_type(m).startswith("image/"),
+    "no_forwards": lambda m, _: not getattr(m, "fwd_from", False),
+    "no_reply": lambda m, _: not getattr(m, "reply_to_msg_id", False),
+    "only_forwards": lambda m, _: getattr(m, "fwd_from", False),
+    "only_reply": lambda m, _: getattr(m, "reply_to_msg_id", False),
+    "mention": lambda m, _: getattr(m, "mentioned", False),
+    "no_mention": lambda m, _: not getattr(m, "mentioned", False),
+    "startswith": lambda m, plan: (
+        isinstance(m, Message) and m.raw_text.startswith(plan.func.startswith)
+    ),
+    "endswith": lambda m, plan: (
+        isinstance(m, Message) and m.raw_text.endswith(plan.func.endswith)
+    ),
+    "contains": lambda m, plan: (
+        isinstance(m, Message) and plan.func.contains in m.raw_text
+    ),
+    "filter": lambda m, plan: callable(plan.func.filter) and plan.func.filter(m),
+    "from_id": lambda m, plan: getattr(m, "sender_id", None) == plan.func.from_id,
+    "chat_id": lambda m, plan: utils.get_chat_id(m) == plan.chat_id,
+    "regex": lambda m, plan: (
+        isinstance(m, Message) and re.search(plan.regex, m.raw_text)
+    ),
+}
+
+
+class WatcherPlan:
+    """Filters of a single watcher, resolved once instead of on every update"""
+
+    def __init__(self, func: callable):
+        self.func = func
+        self.modname = str(func.__self__.__class__.strings["name"])
+        self.module = func.__self__.__module__
+        self.no_commands = bool(getattr(func, "no_commands", False))
+        self.only_commands = bool(getattr(func, "only_commands", False))
+        self.checks = [
+            (tag, _TAG_CHECKS[tag])
+            for tag in ALL_TAGS
+            if tag in _TAG_CHECKS and getattr(func, tag, False)
+        ]
+
+        self.out = (
+            True
+            if getattr(func, "out", False)
+            else False if getattr(func, "in", False) else None
+        )
+
+        self.chat_id = None
+        if getattr(func, "chat_id", False):
+            self.chat_id = (
+                func.chat_id
+                if not str(func.chat_id).startswith("-100")
+                else int(str(func.chat_id)[4:])
+            )
+
+        self.regex = getattr(func, "regex", None)
+        if isinstance(self.regex, str):
+            with contextlib.suppress(re.error):
+                self.regex = re.compile(self.regex)
+
+    @classmethod
+    def of(cls, func: callable) -> "WatcherPlan":
+        """
+        Returns plan of the function, building it only on the first call.
+        The plan is cached on the underlying function object
+        :param func: Bound handler of the module
+        """
+        target = getattr(func, "__func__", func)
+        if (plan := getattr(target, "__watcher_plan__", None)) is None or (
+            plan.func != func
+        ):
+            plan = cls(func)
+            with contextlib.suppress(AttributeError):
+                target.__watcher_plan__ = plan
+
+        return plan
+
+    async def check(
+        self,
+        m: typing.Any,
+        is_command: typing.Callable[[], typing.Awaitable[typing.Any]],
+    ) -> typing.Optional[str]:
+        """
+        Checks if watcher should be called for the message
+        :param m: Message to check
+        :param is_command: Coroutine function, which tells if message is a command
+        :return: The tag, which prevented the call, or `None` if watcher should be called
+        """
+        if self.no_commands and await is_command():
+            return "no_commands"
+
+        if self.only_commands and not await is_command():
+            return "only_commands"
+
+        return next((tag for tag, check in self.checks if not check(m, self)), None)
+
+
+class WatcherIndex:
+    """
+    Watchers, bucketed by direction and chat, so each update only
+    evaluates filters of the watchers, which could possibly match it
+    """
+
+    def __init__(
+        self,
+        watchers: typing.List[callable],
+        previous: typing.Optional["WatcherIndex"] = None,
+    ):
+        plans = previous.plans if previous else {}
+        self.plans: typing.Dict[callable, WatcherPlan] = {}
+        self._buckets: typing.Dict[
+            typing.Tuple[typing.Optional[bool], typing.Optional[int]],
+            typing.List[typing.Tuple[int, WatcherPlan]],
+        ] = collections.defaultdict(list)
+
+        for i, func in enumerate(watchers):
+            if (plan := plans.get(func)) is None:
+                plan = WatcherPlan(func)
+
+            self.plans[func] = plan
+            self._buckets[(plan.out, plan.chat_id)] += [(i, plan)]
+
+        self._buckets = dict(self._buckets)
+
+    def candidates(self, m: typing.Any, chat_id: int) -> typing.Iterator[WatcherPlan]:
+        """
+        Yields watchers, which could match the message, in registration order
+        :param m: Message to find watchers for
+        :param chat_id: ID of the chat, where message was sent
+        """
+        out = bool(getattr(m, "out", True))
+        buckets = [
+            bucket
+            for key in {(None, None), (out, None), (None, chat_id), (out, chat_id)}
+            if (bucket := self._buckets.get(key))
+        ]
+
+        for _, plan in heapq.merge(*buckets, key=operator.itemgetter(0)):
+            yield plan
+
+
 class CommandDispatcher:
     def __init__(
         self,
@@ -135,6 +366,23 @@ class CommandDispatcher:
 
         self.raw_handlers = []
 
+        self._watcher_index: typing.Optional[WatcherIndex] = None
+        self._watcher_index_key: typing.Optional[tuple] = None
+
+        self._config: typing.Optional[DispatcherConfig] = None
+        db.on_change(main.__name__, self._invalidate_config)
+
+    @property
+    def config(self) -> DispatcherConfig:
+        """Current settings snapshot. Reread from database after it changes"""
+        if self._config is None:
+            self._config = DispatcherConfig.from_db(self._db)
+
+        return self._config
+
+    def _invalidate_config(self):
+        self._config = None
+
     async def _handle_ratelimit(self, message: Message, func: callable) -> bool:
         if await self.security.check(message, security.OWNER):
             return True
@@ -273,8 +521,8 @@ class CommandDispatcher:
         if not hasattr(event, "message") or not hasattr(event.message, "message"):
             return False
 
-        prefix = self._db.get(main.__name__, "command_prefix", False) or "."
-        change = str.maketrans(ru_keys + en_keys, en_keys + ru_keys)
+        config = self.config
+        prefix = config.prefix
         message = utils.censor(event.message)
 
         if not event.message.message:
@@ -286,8 +534,8 @@ class CommandDispatcher:
             and (
                 message.message.startswith(prefix * 2)
                 and any(s != prefix for s in message.message)
-                or message.message.startswith(str.translate(prefix * 2, change))
-                and any(s != str.translate(prefix, change) for s in message.message)
+                or message.message.startswith(config.translated_prefix * 2)
+                and any(s != config.translated_prefix for s in message.message)
             )
         ):
             # Allow escaping commands using .'s
@@ -303,11 +551,11 @@ class CommandDispatcher:
             return False
 
         if (
-            event.message.message.startswith(str.translate(prefix, change))
-            and str.translate(prefix, change) != prefix
+            event.message.message.startswith(config.translated_prefix)
+            and config.translated_prefix != prefix
         ):
-            message.message = str.translate(message.message, change)
-            message.text = str.translate(message.text, change)
+            message.message = str.translate(message.message, LAYOUT_TABLE)
+            message.text = str.translate(message.text, LAYOUT_TABLE)
         elif not event.message.message.startswith(prefix):
             return False
 
@@ -320,12 +568,9 @@ class CommandDispatcher:
         ):
             return False
 
-        blacklist_chats = self._db.get(main.__name__, "blacklist_chats", [])
-        whitelist_chats = self._db.get(main.__name__, "whitelist_chats", [])
-        whitelist_modules = self._db.get(main.__name__, "whitelist_modules", [])
-
-        if utils.get_chat_id(message) in blacklist_chats or (
-            whitelist_chats and utils.get_chat_id(message) not in whitelist_chats
+        if utils.get_chat_id(message) in config.blacklist_chats or (
+            config.whitelist_chats
+            and utils.get_chat_id(message) not in config.whitelist_chats
         ):
             return False
 
@@ -356,12 +601,11 @@ class CommandDispatcher:
             pass
         elif (
             not event.is_private
-            and not self._db.get(main.__name__, "no_nickname", False)
-            and command not in self._db.get(main.__name__, "nonickcmds", [])
-            and initiator not in self._db.get(main.__name__, "nonickusers", [])
+            and not config.no_nickname
+            and command not in config.nonickcmds
+            and initiator not in config.nonickusers
             and not self.security.check_tsec(initiator, command)
-            and utils.get_chat_id(event)
-            not in self._db.get(main.__name__, "nonickchats", [])
+            and utils.get_chat_id(event) not in config.nonickchats
         ):
             return False
 
@@ -405,27 +649,30 @@ class CommandDispatcher:
 
         if (
             f"{str(utils.get_chat_id(message))}.{func.__self__.__module__}"
-            in blacklist_chats
-            or whitelist_modules
+            in config.blacklist_chats
+            or config.whitelist_modules
             and f"{utils.get_chat_id(message)}.{func.__self__.__module__}"
-            not in whitelist_modules
+            not in config.whitelist_modules
         ):
             return False
 
         if await self._handle_tags(event, func):
             return False
 
-        if self._db.get(main.__name__, "grep", False) and not watcher:
+        if config.grep and not watcher:
             message = self._handle_grep(message)
 
         return message, prefix, txt, func
 
     async def handle_raw(self, event: events.Raw):
         """Handle raw events."""
+        self.security.process_update(event)
+
         for handler in self.raw_handlers:
             if isinstance(event, tuple(handler.updates)):
                 try:
-                    await handler(event)
+                    with _context.module_scope(getattr(handler, "__self__", None)):
+                        await handler(event)
                 except Exception as e:
                     logger.exception("Error in raw handler %s: %s", handler.id, e)
 
@@ -526,95 +773,21 @@ class CommandDispatcher:
         :return: The reason for the tag to fail.
         """
         m = event if isinstance(event, Message) else getattr(event, "message", event)
-
-        reverse_mapping = {
-            "out": lambda: getattr(m, "out", True),
-            "in": lambda: not getattr(m, "out", True),
-            "only_messages": lambda: isinstance(m, Message),
-            "editable": (
-                lambda: not getattr(m, "out", False)
-                and not getattr(m, "fwd_from", False)
-                and not getattr(m, "sticker", False)
-                and not getattr(m, "via_bot_id", False)
-            ),
-            "no_media": lambda: (
-                not isinstance(m, Message) or not getattr(m, "media", False)
-            ),
-            "only_media": lambda: isinstance(m, Message) and getattr(m, "media", False),
-            "only_photos": lambda: utils.mime_type(m).startswith("image/"),
-            "only_videos": lambda: utils.mime_type(m).startswith("video/"),
-            "only_audios": lambda: utils.mime_type(m).startswith("audio/"),
-            "only_stickers": lambda: getattr(m, "sticker", False),
-            "only_docs": lambda: getattr(m, "document", False),
-            "only_inline": lambda: getattr(m, "via_bot_id", False),
-            "only_channels": lambda: (
-                getattr(m, "is_channel", False) and not getattr(m, "is_group", False)
-            ),
-            "no_channels": lambda: not getattr(m, "is_channel", False),
-            "no_groups": (
-                lambda: not getattr(m, "is_group", False)
-                or getattr(m, "private", False)
-                or getattr(m, "is_channel", False)
-            ),
-            "only_groups": (
-                lambda: getattr(m, "is_group", False)
-                or not getattr(m, "private", False)
-                and not getattr(m, "is_channel", False)
-            ),
-            "no_pm": lambda: not getattr(m, "private", False),
-            "only_pm": lambda: getattr(m, "private", False),
-            "no_inline": lambda: not getattr(m, "via_bot_id", False),
-            "no_stickers": lambda: not getattr(m, "sticker", False),
-            "no_docs": lambda: not getattr(m, "document", False),
-            "no_audios": lambda: not utils.mime_type(m).startswith("audio/"),
-            "no_videos": lambda: not utils.mime_type(m).startswith("video/"),
-            "no_photos": lambda: not utils.mime_type(m).startswith("image/"),
-            "no_forwards": lambda: not getattr(m, "fwd_from", False),
-            "no_reply": lambda: not getattr(m, "reply_to_msg_id", False),
-            "only_forwards": lambda: getattr(m, "fwd_from", False),
-            "only_reply": lambda: getattr(m, "reply_to_msg_id", False),
-            "mention": lambda: getattr(m, "mentioned", False),
-            "no_mention": lambda: not getattr(m, "mentioned", False),
-            "startswith": lambda: (
-                isinstance(m, Message) and m.raw_text.startswith(func.startswith)
-            ),
-            "endswith": lambda: (
-                isinstance(m, Message) and m.raw_text.endswith(func.endswith)
-            ),
-            "contains": lambda: isinstance(m, Message) and func.contains in m.raw_text,
-            "filter": lambda: callable(func.filter) and func.filter(m),
-            "from_id": lambda: getattr(m, "sender_id", None) == func.from_id,
-            "chat_id": lambda: utils.get_chat_id(m) == (
-                func.chat_id
-                if not str(func.chat_id).startswith("-100")
-                else int(str(func.chat_id)[4:])
-            ),
-            "regex": lambda: (
-                isinstance(m, Message) and re.search(func.regex, m.raw_text)
-            ),
-        }
-
-        return (
-            "no_commands"
-            if getattr(func, "no_commands", False)
-            and await self._handle_command(event, watcher=True)
-            else (
-                "only_commands"
-                if getattr(func, "only_commands", False)
-                and not await self._handle_command(event, watcher=True)
-                else next(
-                    (
-                        tag
-                        for tag in ALL_TAGS
-                        if getattr(func, tag, False)
-                        and tag in reverse_mapping
-                        and not reverse_mapping[tag]()
-                    ),
-                    None,
-                )
-            )
+        return await WatcherPlan.of(func).check(
+            m,
+            lambda: self._handle_command(event, watcher=True),
         )
 
+    def _get_watcher_index(self) -> "WatcherIndex":
+        """Returns index of currently registered watchers, rebuilding it if needed"""
+        watchers = self._modules.watchers
+        key = (id(watchers), len(watchers), self._modules.watchers_revision)
+        if key != self._watcher_index_key:
+            self._watcher_index = WatcherIndex(watchers, self._watcher_index)
+            self._watcher_index_key = key
+
+        return self._watcher_index
+
     async def handle_incoming(
         self,
         event: typing.Union[events.NewMessage, events.MessageDeleted],
@@ -622,46 +795,59 @@ class CommandDispatcher:
         """Handle all incoming messages"""
         message = utils.censor(getattr(event, "message", event))
 
-        blacklist_chats = self._db.get(main.__name__, "blacklist_chats", [])
-        whitelist_chats = self._db.get(main.__name__, "whitelist_chats", [])
-        whitelist_modules = self._db.get(main.__name__, "whitelist_modules", [])
+        config = self.config
+        chat_id = utils.get_chat_id(message)
 
-        if utils.get_chat_id(message) in blacklist_chats or (
-            whitelist_chats and utils.get_chat_id(message) not in whitelist_chats
+        if chat_id in config.blacklist_chats or (
+            config.whitelist_chats and chat_id not in config.whitelist_chats
         ):
             logger.debug("Message is blacklisted")
             return
 
-        for func in self._modules.watchers:
-            bl = self._db.get(main.__name__, "disabled_watchers", {})
-            modname = str(func.__self__.__class__.strings["name"])
+        bl = config.disabled_watchers
+        is_message = isinstance(message, Message)
+        is_command = None
+
+        async def check_command() -> bool:
+            # Command is parsed at most once per update, no matter how many
+            # watchers are interested in it
+            nonlocal is_command
+            if is_command is None:
+                is_command = bool(await self._handle_command(event, watcher=True))
+
+            return is_command
 
+        for plan in self._get_watcher_index().candidates(message, chat_id):
             if (
-                modname in bl
-                and isinstance(message, Message)
+                plan.modname in bl
+                and is_message
                 and (
-                    "*" in bl[modname]
-                    or utils.get_chat_id(message) in bl[modname]
-                    or "only_chats" in bl[modname]
+                    "*" in bl[plan.modname]
+                    or chat_id in bl[plan.modname]
+                    or "only_chats" in bl[plan.modname]
                     and message.is_private
-                    or "only_pm" in bl[modname]
+                    or "only_pm" in bl[plan.modname]
                     and not message.is_private
-                    or "out" in bl[modname]
+                    or "out" in bl[plan.modname]
                     and not message.out
-                    or "in" in bl[modname]
+                    or "in" in bl[plan.modname]
                     and message.out
                 )
-                or f"{str(utils.get_chat_id(message))}.{func.__self__.__module__}"
-                in blacklist_chats
-                or whitelist_modules
-                and f"{str(utils.get_chat_id(message))}.{func.__self__.__module__}"
-                not in whitelist_modules
-                or await self._handle_tags(event, func)
+                or f"{chat_id}.{plan.module}" in config.blacklist_chats
+                or config.whitelist_modules
+                and f"{chat_id}.{plan.module}" not in config.whitelist_modules
             ):
+                logger.debug(
+                    "Ignored watcher of module %s because it is disabled",
+                    plan.modname,
+                )
+                continue
+
+            if reason := await plan.check(message, check_command):
                 logger.debug(
                     "Ignored watcher of module %s because of %s",
-                    modname,
-                    await self._handle_tags_ext(event, func),
+                    plan.modname,
+                    reason,
                 )
                 continue
 
@@ -678,7 +864,7 @@ class CommandDispatcher:
             # of watchers with long actions, they can run simultaneously
             asyncio.ensure_future(
                 self.future_dispatcher(
-                    func,
+                    plan.func,
                     message,
                     self.watcher_exc,
                 )
@@ -691,9 +877,9 @@ class CommandDispatcher:
         exception_handler: callable,
         *args,
     ):
-        # Will be used to determine, which client caused logging messages
-        # parsed via inspect.stack()
-        _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
+        _context.set_client_id(self.client.tg_id)
+        _context.set_message(message)
+        _context.set_module(getattr(func, "__self__", None))
         try:
             await func(message)
         except Exception as e:
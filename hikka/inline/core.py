@@ -31,6 +31,7 @@ from .gallery import Gallery
 from .list import List
 from .query_gallery import QueryGallery
 from .token_obtainment import TokenObtainment
+from .units import UnitRegistry
 from .utils import Utils
 
 logger = logging.getLogger(__name__)
@@ -68,13 +69,16 @@ class InlineManager(
         self._allmodules = allmodules
         self.translator: Translator = allmodules.translator
 
-        self._units: typing.Dict[str, dict] = {}
+        self._markup_ttl = 60 * 60 * 24
+        self._units: UnitRegistry = UnitRegistry(
+            maxsize=db.get("hikka.inline", "units_limit", 5000),
+            idle_ttl=self._markup_ttl,
+        )
         self._custom_map: typing.Dict[str, callable] = {}
         self.fsm: typing.Dict[str, str] = {}
         self._web_auth_tokens: typing.List[str] = []
         self._error_events: typing.Dict[str, asyncio.Event] = {}
 
-        self._markup_ttl = 60 * 60 * 24
         self.init_complete = False
 
         self._token = db.get("hikka.inline", "bot_token", False)
@@ -89,13 +93,29 @@ class InlineManager(
         self.bot_username: str = None
 
     async def _cleaner(self):
-        """Cleans outdated inline units"""
-        while True:
-            for unit_id, unit in self._units.copy().items():
-                if (unit.get("ttl") or (time.time() + self._markup_ttl)) < time.time():
-                    del self._units[unit_id]
+        """Cleans outdated inline units, sleeping until the nearest one expires"""
+        reschedule = asyncio.Event()
+        self._units.on_schedule = reschedule.set
 
-            await asyncio.sleep(5)
+        try:
+            while True:
+                if removed := self._units.expire():
+                    logger.debug("Cleaned %s outdated inline units", removed)
+
+                reschedule.clear()
+                expires = self._units.next_expiry
+                with contextlib.suppress(asyncio.TimeoutError):
+                    await asyncio.wait_for(
+                        reschedule.wait(),
+                        None if expires is None else max(expires - time.time(), 0),
+                    )
+        finally:
+            self._units.on_schedule = None
+
+    @property
+    def units_stats(self) -> typing.Dict[str, int]:
+        """Amount of alive inline units and their approximate memory footprint"""
+        return self._units.stats
 
     async def register_manager(
         self,
@@ -22,7 +22,7 @@ from aiogram.types import (
 )
 from aiogram.types import Message as AiogramMessage
 
-from .. import utils
+from .. import _context, utils
 from .types import BotInlineCall, InlineCall, InlineQuery, InlineUnit
 
 logger = logging.getLogger(__name__)
@@ -43,7 +43,8 @@ class Events(InlineUnit):
                 continue
 
             try:
-                await mod.aiogram_watcher(message)
+                with _context.module_scope(mod):
+                    await mod.aiogram_watcher(message)
             except Exception:
                 logger.exception("Error on running aiogram watcher!")
 
@@ -62,11 +63,13 @@ class Events(InlineUnit):
             )
         ):
             instance = InlineQuery(inline_query)
+            handler = self._allmodules.inline_handlers[cmd]
 
             try:
-                if not (
-                    result := await self._allmodules.inline_handlers[cmd](instance)
-                ):
+                with _context.module_scope(getattr(handler, "__self__", None)):
+                    result = await handler(instance)
+
+                if not result:
                     return
             except Exception:
                 logger.exception("Error on running inline watcher!")
@@ -225,13 +228,14 @@ class Events(InlineUnit):
         for func in self._allmodules.callback_handlers.values():
             if await self.check_inline_security(func=func, user=call.from_user.id):
                 try:
-                    await func(
-                        (
-                            BotInlineCall
-                            if getattr(getattr(call, "message", None), "chat", None)
-                            else InlineCall
-                        )(call, self, None)
-                    )
+                    with _context.module_scope(getattr(func, "__self__", None)):
+                        await func(
+                            (
+                                BotInlineCall
+                                if getattr(getattr(call, "message", None), "chat", None)
+                                else InlineCall
+                            )(call, self, None)
+                        )
                 except Exception:
                     logger.exception("Error on running callback watcher!")
                     await call.answer(
@@ -240,67 +244,56 @@ class Events(InlineUnit):
                     )
                     continue
 
-        for unit_id, unit in self._units.copy().items():
-            for button in utils.array_sum(unit.get("buttons", [])):
-                if not isinstance(button, dict):
-                    logger.warning(
-                        "Can't process update, because of corrupted button: %s",
-                        button,
+        for unit_id, button in self._units.find_callback(call.data)[:1]:
+            unit = self._units[unit_id]
+            if (
+                button.get("disable_security", False)
+                or unit.get("disable_security", False)
+                or (unit.get("force_me", False) and call.from_user.id == self._me)
+                or not unit.get("force_me", False)
+                and (
+                    await self.check_inline_security(
+                        func=unit.get(
+                            "perms_map",
+                            lambda: self._client.dispatcher.security._default,
+                        )(),  # we call it so we can get reloaded rights in runtime
+                        user=call.from_user.id,
                     )
-                    continue
-
-                if button.get("_callback_data") == call.data:
-                    if (
-                        button.get("disable_security", False)
-                        or unit.get("disable_security", False)
-                        or (
-                            unit.get("force_me", False)
-                            and call.from_user.id == self._me
-                        )
-                        or not unit.get("force_me", False)
-                        and (
-                            await self.check_inline_security(
-                                func=unit.get(
-                                    "perms_map",
-                                    lambda: self._client.dispatcher.security._default,
-                                )(),  # we call it so we can get reloaded rights in runtime
-                                user=call.from_user.id,
-                            )
-                            if "message" in unit
-                            else False
-                        )
-                    ):
-                        pass
-                    elif call.from_user.id not in (
-                        self._client.dispatcher.security._owner
-                        + unit.get("always_allow", [])
-                        + button.get("always_allow", [])
-                    ):
-                        await call.answer(self.translator.getkey("inline.button403"))
-                        return
+                    if "message" in unit
+                    else False
+                )
+            ):
+                pass
+            elif call.from_user.id not in (
+                self._client.dispatcher.security._owner
+                + unit.get("always_allow", [])
+                + button.get("always_allow", [])
+            ):
+                await call.answer(self.translator.getkey("inline.button403"))
+                return
 
-                    try:
-                        result = await button["callback"](
-                            (
-                                BotInlineCall
-                                if getattr(getattr(call, "message", None), "chat", None)
-                                else InlineCall
-                            )(call, self, unit_id),
-                            *button.get("args", []),
-                            **button.get("kwargs", {}),
-                        )
-                    except Exception:
-                        logger.exception("Error on running callback watcher!")
-                        await call.answer(
-                            (
-                                "Error occurred while processing request. More info in"
-                                " logs"
-                            ),
-                            show_alert=True,
-                        )
-                        return
+            try:
+                with _context.module_scope(
+                    getattr(button["callback"], "__self__", None)
+                ):
+                    result = await button["callback"](
+                        (
+                            BotInlineCall
+                            if getattr(getattr(call, "message", None), "chat", None)
+                            else InlineCall
+                        )(call, self, unit_id),
+                        *button.get("args", []),
+                        **button.get("kwargs", {}),
+                    )
+            except Exception:
+                logger.exception("Error on running callback watcher!")
+                await call.answer(
+                    "Error occurred while processing request. More info in logs",
+                    show_alert=True,
+                )
+                return
 
-                    return result
+            return result
 
         if call.data in self._custom_map:
             if (
@@ -331,15 +324,18 @@ class Events(InlineUnit):
                 await call.answer(self.translator.getkey("inline.button403"))
                 return
 
-            await self._custom_map[call.data]["handler"](
-                (
-                    BotInlineCall
-                    if getattr(getattr(call, "message", None), "chat", None)
-                    else InlineCall
-                )(call, self, None),
-                *self._custom_map[call.data].get("args", []),
-                **self._custom_map[call.data].get("kwargs", {}),
-            )
+            with _context.module_scope(
+                getattr(self._custom_map[call.data]["handler"], "__self__", None)
+            ):
+                await self._custom_map[call.data]["handler"](
+                    (
+                        BotInlineCall
+                        if getattr(getattr(call, "message", None), "chat", None)
+                        else InlineCall
+                    )(call, self, None),
+                    *self._custom_map[call.data].get("args", []),
+                    **self._custom_map[call.data].get("kwargs", {}),
+                )
             return
 
     async def _chosen_inline_handler(
@@ -348,44 +344,37 @@ class Events(InlineUnit):
     ):
         query = chosen_inline_query.query
 
-        if not query:
+        if not query.strip():
             return
 
-        for unit_id, unit in self._units.items():
-            if (
-                unit_id == query
-                and "future" in unit
-                and isinstance(unit["future"], Event)
-            ):
-                unit["inline_message_id"] = chosen_inline_query.inline_message_id
-                unit["future"].set()
-                return
+        if (unit := self._units.get(query)) is not None and isinstance(
+            unit.get("future"), Event
+        ):
+            unit["inline_message_id"] = chosen_inline_query.inline_message_id
+            unit["future"].set()
+            return
 
-        for unit_id, unit in self._units.copy().items():
-            for button in utils.array_sum(unit.get("buttons", [])):
-                if (
-                    "_switch_query" in button
-                    and "input" in button
-                    and button["_switch_query"] == query.split()[0]
-                    and chosen_inline_query.from_user.id
-                    in [self._me]
-                    + self._client.dispatcher.security._owner
-                    + unit.get("always_allow", [])
-                ):
-                    query = query.split(maxsplit=1)[1] if len(query.split()) > 1 else ""
+        for unit_id, button in self._units.find_switch(query.split()[0]):
+            if chosen_inline_query.from_user.id in (
+                [self._me]
+                + self._client.dispatcher.security._owner
+                + self._units[unit_id].get("always_allow", [])
+            ):
+                query = query.split(maxsplit=1)[1] if len(query.split()) > 1 else ""
 
-                    try:
+                try:
+                    with _context.module_scope(
+                        getattr(button["handler"], "__self__", None)
+                    ):
                         return await button["handler"](
                             InlineCall(chosen_inline_query, self, unit_id),
                             query,
                             *button.get("args", []),
                             **button.get("kwargs", {}),
                         )
-                    except Exception:
-                        logger.exception(
-                            "Exception while running chosen query watcher!"
-                        )
-                        return
+                except Exception:
+                    logger.exception("Exception while running chosen query watcher!")
+                    return
 
     async def _query_help(self, inline_query: InlineQuery):
         _help = []
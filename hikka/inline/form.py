@@ -31,7 +31,7 @@ from hikkatl.errors.rpcerrorlist import ChatSendInlineForbiddenError
 from hikkatl.extensions.html import CUSTOM_EMOJIS
 from hikkatl.tl.types import Message
 
-from .. import main, utils
+from .. import _context, main, utils
 from ..types import HikkaReplyMarkup
 from .types import InlineMessage, InlineUnit
 
@@ -109,7 +109,7 @@ class Form(InlineUnit):
         :return: If form is sent, returns :obj:`InlineMessage`, otherwise returns `False`
         """
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self._client.tg_id)  # noqa: F841
+            _context.set_client_id(self._client.tg_id)
 
         if reply_markup is None:
             reply_markup = []
@@ -389,43 +389,38 @@ class Form(InlineUnit):
         except IndexError:
             return
 
-        for unit in self._units.copy().values():
-            for button in utils.array_sum(unit.get("buttons", [])):
-                if (
-                    "_switch_query" in button
-                    and "input" in button
-                    and button["_switch_query"] == query
-                    and inline_query.from_user.id
-                    in [self._me]
-                    + self._client.dispatcher.security._owner
-                    + unit.get("always_allow", [])
-                ):
-                    await inline_query.answer(
-                        [
-                            InlineQueryResultArticle(
-                                id=utils.rand(20),
-                                title=button["input"],
-                                description=(
-                                    self.translator.getkey("inline.keep_id").format(
-                                        random.choice(VERIFICATION_EMOJIES)
-                                    )
-                                ),
-                                input_message_content=InputTextMessageContent(
-                                    (
-                                        "🔄 <b>Transferring value to"
-                                        " userbot...</b>\n<i>This message will be"
-                                        " deleted automatically</i>"
-                                        if inline_query.from_user.id == self._me
-                                        else "🔄 <b>Transferring value to userbot...</b>"
-                                    ),
-                                    "HTML",
-                                    disable_web_page_preview=True,
+        for unit_id, button in self._units.find_switch(query):
+            if inline_query.from_user.id in (
+                [self._me]
+                + self._client.dispatcher.security._owner
+                + self._units[unit_id].get("always_allow", [])
+            ):
+                await inline_query.answer(
+                    [
+                        InlineQueryResultArticle(
+                            id=utils.rand(20),
+                            title=button["input"],
+                            description=(
+                                self.translator.getkey("inline.keep_id").format(
+                                    random.choice(VERIFICATION_EMOJIES)
+                                )
+                            ),
+                            input_message_content=InputTextMessageContent(
+                                (
+                                    "🔄 <b>Transferring value to"
+                                    " userbot...</b>\n<i>This message will be"
+                                    " deleted automatically</i>"
+                                    if inline_query.from_user.id == self._me
+                                    else "🔄 <b>Transferring value to userbot...</b>"
                                 ),
-                            )
-                        ],
-                        cache_time=60,
-                    )
-                    return
+                                "HTML",
+                                disable_web_page_preview=True,
+                            ),
+                        )
+                    ],
+                    cache_time=60,
+                )
+                return
 
         if (
             inline_query.query not in self._units
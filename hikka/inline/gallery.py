@@ -6,7 +6,6 @@
 
 import asyncio
 import contextlib
-import copy
 import functools
 import logging
 import os
@@ -29,7 +28,7 @@ from hikkatl.errors.rpcerrorlist import ChatSendInlineForbiddenError
 from hikkatl.extensions.html import CUSTOM_EMOJIS
 from hikkatl.tl.types import Message
 
-from .. import main, utils
+from .. import _context, main, utils
 from ..types import HikkaReplyMarkup
 from .types import InlineMessage, InlineUnit
 
@@ -94,7 +93,7 @@ class Gallery(InlineUnit):
         :return: If gallery is sent, returns :obj:`InlineMessage`, otherwise returns `False`
         """
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self._client.tg_id)  # noqa: F841
+            _context.set_client_id(self._client.tg_id)
 
         custom_buttons = self._validate_markup(custom_buttons)
 
@@ -392,11 +391,13 @@ class Gallery(InlineUnit):
         while True:
             await asyncio.sleep(7)
 
-            unit = self._units[unit_id]
-
-            if unit_id not in self._units or not unit.get("slideshow", False):
+            if unit_id not in self._units or not self._units[unit_id].get(
+                "slideshow", False
+            ):
                 return
 
+            unit = self._units[unit_id]
+
             if unit["current_index"] + 1 >= len(unit["photos"]) and isinstance(
                 unit["next_handler"],
                 ListGalleryHelper,
@@ -517,6 +518,8 @@ class Gallery(InlineUnit):
             await self._delete_unit_message(call, unit_id=unit_id)
             return
 
+        self._units.touch(unit_id)
+
         if page < 0:
             await call.answer("No way back")
             return
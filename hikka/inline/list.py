@@ -6,7 +6,6 @@
 
 import asyncio
 import contextlib
-import copy
 import functools
 import logging
 import time
@@ -25,7 +24,7 @@ from hikkatl.errors.rpcerrorlist import ChatSendInlineForbiddenError
 from hikkatl.extensions.html import CUSTOM_EMOJIS
 from hikkatl.tl.types import Message
 
-from .. import main, utils
+from .. import _context, main, utils
 from ..types import HikkaReplyMarkup
 from .types import InlineMessage, InlineUnit
 
@@ -67,7 +66,7 @@ class List(InlineUnit):
         :return: If list is sent, returns :obj:`InlineMessage`, otherwise returns `False`
         """
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self._client.tg_id)  # noqa: F841
+            _context.set_client_id(self._client.tg_id)
 
         custom_buttons = self._validate_markup(custom_buttons)
 
@@ -252,6 +251,8 @@ class List(InlineUnit):
             await self._delete_unit_message(call, unit_id=unit_id)
             return
 
+        self._units.touch(unit_id)
+
         if self._units[unit_id]["current_index"] < 0 or page >= len(
             self._units[unit_id]["strings"]
         ):
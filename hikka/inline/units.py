@@ -0,0 +1,267 @@
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import collections
+import heapq
+import itertools
+import logging
+import sys
+import time
+import typing
+
+from .. import utils
+
+logger = logging.getLogger(__name__)
+
+
+class UnitRegistry(dict):
+    """
+    Storage of inline units, which indexes their buttons by callback data
+    and switch query, so button presses don't scan all alive units.
+    Buttons get their data only when markup is generated, so units are
+    (re)indexed lazily, right before the lookup.
+    Units expire at their `ttl` or, if they have none, after `idle_ttl`
+    seconds of inactivity. Expiration times are kept in a heap, so cleaner
+    only wakes up when the nearest unit expires. If there are more than
+    `maxsize` units, the least recently used ones are evicted
+    """
+
+    def __init__(
+        self,
+        maxsize: int = 5000,
+        idle_ttl: float = 60 * 60 * 24,
+        on_schedule: typing.Optional[typing.Callable[[], typing.Any]] = None,
+    ):
+        """
+        :param maxsize: Maximum amount of units
+        :param idle_ttl: Time to live of units without `ttl` since their last use
+        :param on_schedule: Called, when unit expires earlier than all others
+        """
+        super().__init__()
+        self.maxsize = maxsize
+        self.idle_ttl = idle_ttl
+        self.on_schedule = on_schedule
+        self.expirations = 0
+        self.evictions = 0
+        self._expires: typing.Dict[str, float] = {}
+        self._expiry_heap: typing.List[typing.Tuple[float, int, str]] = []
+        self._counter = itertools.count()
+        self._recent: typing.OrderedDict[str, None] = collections.OrderedDict()
+        self._callbacks: typing.Dict[str, typing.Dict[str, dict]] = {}
+        self._switches: typing.Dict[str, typing.Dict[str, dict]] = {}
+        # Index and key of every entry, added for the unit
+        self._indexed: typing.Dict[
+            str,
+            typing.List[typing.Tuple[typing.Dict[str, typing.Dict[str, dict]], str]],
+        ] = {}
+        self._dirty: typing.Set[str] = set()
+
+    def __setitem__(self, unit_id: str, unit: dict):
+        self._unindex(unit_id)
+        super().__setitem__(unit_id, unit)
+        self._dirty.add(unit_id)
+        self.touch(unit_id)
+        self._evict()
+
+    def __delitem__(self, unit_id: str):
+        super().__delitem__(unit_id)
+        self._forget(unit_id)
+
+    def pop(self, unit_id: str, *args) -> typing.Any:
+        self._forget(unit_id)
+        return super().pop(unit_id, *args)
+
+    def clear(self):
+        super().clear()
+        self._callbacks.clear()
+        self._switches.clear()
+        self._indexed.clear()
+        self._dirty.clear()
+        self._expires.clear()
+        self._expiry_heap.clear()
+        self._recent.clear()
+
+    def mark_dirty(self, unit_id: str):
+        """
+        Schedules reindexing of unit buttons. Must be called, when they change
+        :param unit_id: ID of the unit
+        """
+        if unit_id in self:
+            self._dirty.add(unit_id)
+            self.touch(unit_id)
+
+    def touch(self, unit_id: str):
+        """
+        Marks unit as recently used, postponing its expiration, if it has no `ttl`
+        :param unit_id: ID of the unit
+        """
+        if unit_id not in self:
+            return
+
+        self._recent[unit_id] = None
+        self._recent.move_to_end(unit_id)
+
+        expires = self[unit_id].get("ttl") or (time.time() + self.idle_ttl)
+        if self._expires.get(unit_id) == expires:
+            return
+
+        self._expires[unit_id] = expires
+        # Head of the heap may be an outdated entry, so it is not compared to
+        nearest = self.next_expiry
+        is_nearest = nearest is None or expires < nearest
+        heapq.heappush(self._expiry_heap, (expires, next(self._counter), unit_id))
+
+        # Heap keeps entries of postponed and removed units until they
+        # expire, so rebuild it if it got too large
+        if len(self._expiry_heap) > 2 * len(self) + 64:
+            self._expiry_heap = [
+                (expires, next(self._counter), unit_id)
+                for unit_id, expires in self._expires.items()
+            ]
+            heapq.heapify(self._expiry_heap)
+
+        if is_nearest and callable(self.on_schedule):
+            self.on_schedule()
+
+    @property
+    def next_expiry(self) -> typing.Optional[float]:
+        """Timestamp, when the nearest unit expires, or `None` if there are no units"""
+        while self._expiry_heap:
+            expires, _, unit_id = self._expiry_heap[0]
+            if self._expires.get(unit_id) == expires:
+                return expires
+
+            heapq.heappop(self._expiry_heap)
+
+        return None
+
+    def expire(self) -> int:
+        """
+        Removes expired units
+        :return: Amount of removed units
+        """
+        now = time.time()
+        removed = 0
+        while (expires := self.next_expiry) is not None and expires <= now:
+            _, _, unit_id = heapq.heappop(self._expiry_heap)
+            del self[unit_id]
+            removed += 1
+
+        self.expirations += removed
+        return removed
+
+    @property
+    def stats(self) -> typing.Dict[str, int]:
+        """Gauges of the registry. Memory footprint is approximate"""
+        return {
+            "units": len(self),
+            "maxsize": self.maxsize,
+            "memory": sum(
+                sys.getsizeof(unit) + sum(map(sys.getsizeof, unit.values()))
+                for unit in self.values()
+            ),
+            "indexed_buttons": (
+                sum(map(len, self._callbacks.values()))
+                + sum(map(len, self._switches.values()))
+            ),
+            "expirations": self.expirations,
+            "evictions": self.evictions,
+        }
+
+    def _evict(self):
+        if len(self) <= self.maxsize:
+            return
+
+        # Units, which are still being sent, are waited for by their
+        # creator and can't be evicted
+        for unit_id in list(self._recent):
+            if len(self) <= self.maxsize:
+                break
+
+            if "future" not in self[unit_id]:
+                del self[unit_id]
+                self.evictions += 1
+                logger.debug(
+                    "Evicted inline unit %s, because limit is reached", unit_id
+                )
+
+    def _forget(self, unit_id: str):
+        self._unindex(unit_id)
+        self._expires.pop(unit_id, None)
+        self._recent.pop(unit_id, None)
+
+    def find_callback(self, data: str) -> typing.List[typing.Tuple[str, dict]]:
+        """
+        Finds buttons with callback data
+        :param data: Callback data of the pressed button
+        :return: Pairs of unit ID and button
+        """
+        self._flush()
+        found = list(self._callbacks.get(data, {}).items())
+        for unit_id, _ in found:
+            self.touch(unit_id)
+
+        return found
+
+    def find_switch(self, query: str) -> typing.List[typing.Tuple[str, dict]]:
+        """
+        Finds input buttons with switch query
+        :param query: First word of the inline query
+        :return: Pairs of unit ID and button
+        """
+        self._flush()
+        found = list(self._switches.get(query, {}).items())
+        for unit_id, _ in found:
+            self.touch(unit_id)
+
+        return found
+
+    def _unindex(self, unit_id: str):
+        self._dirty.discard(unit_id)
+        for index, key in self._indexed.pop(unit_id, []):
+            if (buttons := index.get(key)) is not None:
+                buttons.pop(unit_id, None)
+                if not buttons:
+                    del index[key]
+
+    def _flush(self):
+        for unit_id in self._dirty.copy():
+            self._index(unit_id)
+
+    def _index(self, unit_id: str):
+        self._unindex(unit_id)
+
+        entries = []
+        pending = False
+        for button in utils.array_sum(self[unit_id].get("buttons") or []):
+            if not isinstance(button, dict):
+                logger.warning(
+                    "Can't index button of unit %s, because it's corrupted: %s",
+                    unit_id,
+                    button,
+                )
+                continue
+
+            # Markup is not generated yet, so the unit must be indexed again
+            if (
+                ("callback" in button or "action" in button)
+                and "_callback_data" not in button
+            ) or ("input" in button and "_switch_query" not in button):
+                pending = True
+
+            if "_callback_data" in button:
+                entries += [(self._callbacks, button["_callback_data"], button)]
+
+            if "_switch_query" in button and "input" in button:
+                entries += [(self._switches, button["_switch_query"], button)]
+
+        for index, key, button in entries:
+            index.setdefault(key, {}).setdefault(unit_id, button)
+
+        self._indexed[unit_id] = [(index, key) for index, key, _ in entries]
+
+        if pending:
+            self._dirty.add(unit_id)
@@ -65,6 +65,7 @@ class Utils(InlineUnit):
         map_ = self._normalize_markup(map_)
 
         setup_callbacks = False
+        setup_switches = False
 
         for row in map_:
             for button in row:
@@ -103,6 +104,10 @@ class Utils(InlineUnit):
 
                 if "input" in button and "_switch_query" not in button:
                     button["_switch_query"] = utils.rand(10)
+                    setup_switches = True
+
+        if isinstance(markup_obj, str) and (setup_callbacks or setup_switches):
+            self._units.mark_dirty(markup_obj)
 
         for row in map_:
             line = []
@@ -359,6 +364,7 @@ class Utils(InlineUnit):
             unit = self._units[unit_id]
 
             unit["buttons"] = reply_markup
+            self._units.mark_dirty(unit_id)
 
             if isinstance(force_me, bool):
                 unit["force_me"] = force_me
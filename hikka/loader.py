@@ -7,8 +7,8 @@
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
 import asyncio
+import bisect
 import contextlib
-import copy
 import importlib
 import importlib.machinery
 import importlib.util
@@ -17,6 +17,7 @@ import logging
 import os
 import re
 import sys
+import time
 import typing
 from functools import wraps
 from pathlib import Path
@@ -25,7 +26,7 @@ from uuid import uuid4
 
 from hikkatl.tl.tlobject import TLObject
 
-from . import security, utils, validators
+from . import _context, security, utils, validators
 from .database import Database
 from .inline.core import InlineManager
 from .translations import Strings, Translator
@@ -159,9 +160,7 @@ class InfiniteLoop:
 
     def stop(self, *args, **kwargs):
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(  # noqa: F841
-                self.module_instance.allmodules.client.tg_id
-            )
+            _context.set_client_id(self.module_instance.allmodules.client.tg_id)
 
         if self._task:
             logger.debug("Stopped loop for method %s", self.func)
@@ -176,9 +175,7 @@ class InfiniteLoop:
 
     def start(self, *args, **kwargs):
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(  # noqa: F841
-                self.module_instance.allmodules.client.tg_id
-            )
+            _context.set_client_id(self.module_instance.allmodules.client.tg_id)
 
         if not self._task:
             logger.debug("Started loop for method %s", self.func)
@@ -191,6 +188,8 @@ class InfiniteLoop:
         while not self.module_instance:
             await asyncio.sleep(0.01)
 
+        _context.set_module(self.module_instance)
+
         if isinstance(self._stop_clause, str) and self._stop_clause:
             self.module_instance.set(self._stop_clause, True)
 
@@ -249,6 +248,8 @@ def loop(
 
 
 MODULES_NAME = "modules"
+# Amount of module sources, which are read and compiled simultaneously
+LOAD_CONCURRENCY = 8
 ru_keys = 'ёйцукенгшщзхъфывапролджэячсмитьбю.Ё"№;%:?ЙЦУКЕНГШЩЗХЪФЫВАПРОЛДЖЭ/ЯЧСМИТЬБЮ,'
 en_keys = "`qwertyuiop[]asdfghjkl;'zxcvbnm,./~@#$%^&QWERTYUIOP{}ASDFGHJKL:\"|ZXCVBNM<>?"
 
@@ -469,6 +470,15 @@ def raw_handler(*updates: TLObject):
     return inner
 
 
+def _get_command_aliases(cmd: Command) -> typing.List[str]:
+    """Returns aliases, declared by command itself"""
+    aliases = []
+    if getattr(cmd, "alias", None) and not (aliases := getattr(cmd, "aliases", None)):
+        aliases = [cmd.alias]
+
+    return aliases or []
+
+
 class Modules:
     """Stores all registered modules"""
 
@@ -488,8 +498,12 @@ class Modules:
         self.dragon_modules = []
         self.libraries = []
         self.watchers = []
+        self.watchers_revision = 0
         self._log_handlers = []
-        self._core_commands = []
+        self._core_commands = set()
+        self._alias_index: typing.Dict[str, str] = {}
+        self._prefix_index: typing.Optional[typing.List[str]] = None
+        self._load_timings: typing.Dict[str, typing.Dict[str, float]] = {}
         self.__approve = []
         self.allclients = allclients
         self.client = client
@@ -497,17 +511,25 @@ class Modules:
         self.db = db
         self.translator = translator
         self.secure_boot = False
+        self._junk_event = asyncio.Event()
         asyncio.ensure_future(self._junk_collector())
         self.inline = InlineManager(self.client, self._db, self)
         self.client.hikka_inline = self.inline
 
+    def _schedule_junk_collection(self):
+        """Requests reload of handlers after set of loaded modules has changed"""
+        self._junk_event.set()
+
     async def _junk_collector(self):
         """
-        Periodically reloads commands, inline handlers, callback handlers and watchers from loaded
-        modules to prevent zombie handlers
+        Reloads commands, inline handlers, callback handlers and watchers from loaded
+        modules after they change to prevent zombie handlers
         """
         while True:
-            await asyncio.sleep(30)
+            await self._junk_event.wait()
+            # Let bulk (re)loads settle, so handlers are reloaded only once
+            await asyncio.sleep(1)
+            self._junk_event.clear()
             commands = {}
             inline_handlers = {}
             callback_handlers = {}
@@ -519,9 +541,11 @@ class Modules:
                 watchers.extend(module.hikka_watchers.values())
 
             self.commands = commands
+            self._rebuild_command_index()
             self.inline_handlers = inline_handlers
             self.callback_handlers = callback_handlers
             self.watchers = watchers
+            self.watchers_revision += 1
 
             logger.debug(
                 (
@@ -584,12 +608,15 @@ class Modules:
         origin: str = "<core>",
     ) -> typing.List[Module]:
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
+            _context.set_client_id(self.client.tg_id)
 
-        loaded = []
+        semaphore = asyncio.Semaphore(LOAD_CONCURRENCY)
 
-        for mod in modules:
-            try:
+        async def compile_module(
+            mod: str,
+        ) -> typing.Tuple[importlib.machinery.ModuleSpec, float]:
+            async with semaphore:
+                started = time.perf_counter()
                 mod_shortname = os.path.basename(mod).rsplit(".py", maxsplit=1)[0]
                 module_name = f"{__package__}.{MODULES_NAME}.{mod_shortname}"
                 user_friendly_origin = (
@@ -598,18 +625,95 @@ class Modules:
 
                 logger.debug("Loading %s from filesystem", module_name)
 
+                string_loader = StringLoader(
+                    await utils.run_sync(Path(mod).read_text),
+                    user_friendly_origin,
+                )
+                await utils.run_sync(string_loader.get_code, module_name)
                 spec = importlib.machinery.ModuleSpec(
                     module_name,
-                    StringLoader(Path(mod).read_text(), user_friendly_origin),
+                    string_loader,
                     origin=user_friendly_origin,
                 )
+                return spec, time.perf_counter() - started
+
+        loaded = []
 
-                loaded += [await self.register_module(spec, module_name, origin)]
+        # Sources are read and compiled concurrently, but modules are executed
+        # and registered one by one in the original order, because they share
+        # registries and may depend on each other
+        for mod, result in zip(
+            modules,
+            await asyncio.gather(
+                *map(compile_module, modules),
+                return_exceptions=True,
+            ),
+        ):
+            try:
+                if isinstance(result, BaseException):
+                    raise result
+
+                spec, compile_time = result
+                started = time.perf_counter()
+                instance = await self.register_module(spec, spec.name, origin)
+                loaded += [instance]
+                self.record_load_timing(
+                    spec.origin,
+                    compile=compile_time,
+                    register=time.perf_counter() - started,
+                )
             except Exception as e:
                 logger.exception("Failed to load module %s due to %s:", mod, e)
 
         return loaded
 
+    def record_load_timing(self, origin: str, **stages: float):
+        """
+        Saves durations of module loading stages for the timing report
+        :param origin: Origin of the module, e.g. `<core hikka.modules.help>`
+            for local modules or link for remote ones
+        :param stages: Durations of stages in seconds
+        """
+        self._load_timings.setdefault(origin, {}).update(stages)
+
+    def log_load_timings(self, title: str, top: int = 5):
+        """
+        Logs durations of module loading stages, recorded since the last report
+        :param title: Name of the modules group
+        :param top: Amount of the slowest modules to mention in summary
+        """
+        if not self._load_timings:
+            return
+
+        timings, self._load_timings = self._load_timings, {}
+        report = sorted(
+            timings.items(),
+            key=lambda item: sum(item[1].values()),
+            reverse=True,
+        )
+
+        logger.info(
+            "Loaded %s %s modules, slowest: %s",
+            len(report),
+            title,
+            ", ".join(
+                f"{name} ({sum(stages.values()):.2f}s)" for name, stages in report[:top]
+            ),
+        )
+        logger.debug(
+            "Loading timings of %s modules:\n%s",
+            title,
+            "\n".join(
+                "{}: {}".format(
+                    name,
+                    ", ".join(
+                        f"{stage} {seconds:.3f}s" for stage, seconds in stages.items()
+                    ),
+                )
+                for name, stages in report
+            ),
+        )
+
     def register_dragon(self, module: ModuleType, instance: DragonModule):
         for mod in self.dragon_modules.copy():
             if mod.name == instance.name:
@@ -660,7 +764,7 @@ class Modules:
     ) -> typing.Union[Module, typing.Tuple[ModuleType, DragonModule]]:
         """Register single module from importlib spec"""
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
+            _context.set_client_id(self.client.tg_id)
 
         module = importlib.util.module_from_spec(spec)
         sys.modules[module_name] = module
@@ -706,9 +810,51 @@ class Modules:
 
         return ret
 
+    def _index_command(self, name: str, cmd: Command):
+        """Adds command's own aliases to the index"""
+        for alias in _get_command_aliases(cmd):
+            self._alias_index.setdefault(alias.lower(), name)
+
+        self._prefix_index = None
+
+    def _rebuild_command_index(self):
+        """Rebuilds the index of commands' own aliases from scratch"""
+        self._alias_index = {}
+        for name, cmd in self.commands.items():
+            self._index_command(name, cmd)
+
+        self._prefix_index = None
+
+    def suggest_commands(self, prefix: str, limit: int = 5) -> typing.List[str]:
+        """
+        Finds commands and aliases, which start with `prefix`
+        :param prefix: Beginning of the command
+        :param limit: Maximum amount of suggestions
+        :return: Sorted list of matching commands and aliases
+        """
+        if not (prefix := prefix.lower()):
+            return []
+
+        if self._prefix_index is None:
+            self._prefix_index = sorted(
+                {*self.commands, *self._alias_index, *self.aliases}
+            )
+
+        suggestions = []
+        for name in self._prefix_index[
+            bisect.bisect_left(self._prefix_index, prefix) :
+        ]:
+            if not name.startswith(prefix) or len(suggestions) >= limit:
+                break
+
+            suggestions += [name]
+
+        return suggestions
+
     def add_aliases(self, aliases: dict):
         """Saves aliases and applies them to <core>/<file> modules"""
         self.aliases.update(aliases)
+        self._prefix_index = None
         for alias, cmd in aliases.items():
             self.add_alias(alias, cmd)
 
@@ -733,10 +879,10 @@ class Modules:
     def register_commands(self, instance: Module):
         """Register commands from instance"""
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
+            _context.set_client_id(self.client.tg_id)
 
         if instance.__origin__.startswith("<core"):
-            self._core_commands += list(
+            self._core_commands |= set(
                 map(lambda x: x.lower(), list(instance.hikka_commands))
             )
 
@@ -753,6 +899,7 @@ class Modules:
                 raise CoreOverwriteError(command=_command)
 
             self.commands.update({_command.lower(): cmd})
+            self._index_command(_command.lower(), cmd)
 
         for alias, cmd in self.aliases.copy().items():
             if cmd in instance.hikka_commands:
@@ -834,7 +981,7 @@ class Modules:
     def register_watchers(self, instance: Module):
         """Register watcher from instance"""
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
+            _context.set_client_id(self.client.tg_id)
 
         for _watcher in self.watchers:
             if _watcher.__self__.__class__.__name__ == instance.__class__.__name__:
@@ -844,6 +991,8 @@ class Modules:
         for _watcher in instance.hikka_watchers.values():
             self.watchers += [_watcher]
 
+        self.watchers_revision += 1
+
     def lookup(
         self,
         modname: str,
@@ -897,7 +1046,7 @@ class Modules:
     async def complete_registration(self, instance: Module):
         """Complete registration of instance"""
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
+            _context.set_client_id(self.client.tg_id)
 
         instance.allmodules = self
         instance.internal_init()
@@ -938,22 +1087,11 @@ class Modules:
         if not alias:
             return None
 
-        for command_name, _command in self.commands.items():
-            aliases = []
-            if getattr(_command, "alias", None) and not (
-                aliases := getattr(_command, "aliases", None)
-            ):
-                aliases = [_command.alias]
-
-            if not aliases:
-                continue
-
-            if any(
-                alias.lower() == _alias.lower()
-                and alias.lower() not in self._core_commands
-                for _alias in aliases
-            ):
-                return command_name
+        if (
+            alias.lower() not in self._core_commands
+            and (command_name := self._alias_index.get(alias.lower())) in self.commands
+        ):
+            return command_name
 
         if alias in self.aliases and include_legacy:
             return self.aliases[alias]
@@ -962,19 +1100,14 @@ class Modules:
 
     def dispatch(self, _command: str) -> typing.Tuple[str, typing.Optional[str]]:
         """Dispatch command to appropriate module"""
+        if (func := self.commands.get(_command.lower())) is not None:
+            return _command, func
 
-        return next(
-            (
-                (cmd, self.commands[cmd.lower()])
-                for cmd in [
-                    _command,
-                    self.aliases.get(_command.lower()),
-                    self.find_alias(_command),
-                ]
-                if cmd and cmd.lower() in self.commands
-            ),
-            (_command, None),
-        )
+        for cmd in (self.aliases.get(_command.lower()), self.find_alias(_command)):
+            if cmd and cmd.lower() in self.commands:
+                return cmd, self.commands[cmd.lower()]
+
+        return _command, None
 
     def send_config(self, skip_hook: bool = False):
         """Configure modules"""
@@ -984,7 +1117,7 @@ class Modules:
     def send_config_one(self, mod: Module, skip_hook: bool = False):
         """Send config to single instance"""
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
+            _context.set_client_id(self.client.tg_id)
 
         if hasattr(mod, "config"):
             modcfg = self._db.get(
@@ -1029,19 +1162,26 @@ class Modules:
             logger.exception("Failed to send mod config complete signal due to %s", e)
             raise
 
-    async def send_ready_one_wrapper(self, *args, **kwargs):
+    async def send_ready_one_wrapper(self, mod: Module, *args, **kwargs):
         """Wrapper for send_ready_one"""
+        started = time.perf_counter()
         try:
-            await self.send_ready_one(*args, **kwargs)
+            await self.send_ready_one(mod, *args, **kwargs)
         except Exception as e:
             logger.exception("Failed to send mod init complete signal due to %s", e)
 
+        self.record_load_timing(
+            mod.__origin__,
+            ready=time.perf_counter() - started,
+        )
+
     async def send_ready(self):
         """Send all data to all modules"""
         await self.inline.register_manager()
         await asyncio.gather(
             *[self.send_ready_one_wrapper(mod) for mod in self.modules]
         )
+        self.log_load_timings("local")
 
     async def send_ready_one(
         self,
@@ -1050,22 +1190,24 @@ class Modules:
         from_dlmod: bool = False,
     ):
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
+            _context.set_client_id(self.client.tg_id)
 
         if from_dlmod:
             try:
-                if len(inspect.signature(mod.on_dlmod).parameters) == 2:
-                    await mod.on_dlmod(self.client, self._db)
-                else:
-                    await mod.on_dlmod()
+                with _context.module_scope(mod):
+                    if len(inspect.signature(mod.on_dlmod).parameters) == 2:
+                        await mod.on_dlmod(self.client, self._db)
+                    else:
+                        await mod.on_dlmod()
             except Exception:
                 logger.info("Can't process `on_dlmod` hook", exc_info=True)
 
         try:
-            if len(inspect.signature(mod.client_ready).parameters) == 2:
-                await mod.client_ready(self.client, self._db)
-            else:
-                await mod.client_ready()
+            with _context.module_scope(mod):
+                if len(inspect.signature(mod.client_ready).parameters) == 2:
+                    await mod.client_ready(self.client, self._db)
+                else:
+                    await mod.client_ready()
         except SelfUnload as e:
             if no_self_unload:
                 raise e
@@ -1099,12 +1241,15 @@ class Modules:
 
                 logger.debug("Added module %s to method %s", mod, method)
 
+        mod.invalidate_handlers()
+
         self.unregister_commands(mod, "update")
         self.unregister_raw_handlers(mod, "update")
 
         self.register_commands(mod)
         self.register_watchers(mod)
         self.register_raw_handlers(mod)
+        self._schedule_junk_collection()
 
     def get_classname(self, name: str) -> str:
         return next(
@@ -1121,7 +1266,7 @@ class Modules:
         worked = []
 
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
+            _context.set_client_id(self.client.tg_id)
 
         for module in self.modules:
             if classname.lower() in (
@@ -1156,6 +1301,7 @@ class Modules:
                 self.unregister_watchers(module, "unload")
                 self.unregister_inline_stuff(module, "unload")
 
+        self._schedule_junk_collection()
         logger.debug("Worked: %s", worked)
         return worked
 
@@ -1184,6 +1330,8 @@ class Modules:
                     if _command == name:
                         del self.aliases[alias]
 
+        self._rebuild_command_index()
+
     def unregister_watchers(self, instance: Module, purpose: str):
         for _watcher in self.watchers.copy():
             if _watcher.__self__.__class__.__name__ == instance.__class__.__name__:
@@ -1195,6 +1343,8 @@ class Modules:
                 )
                 self.watchers.remove(_watcher)
 
+        self.watchers_revision += 1
+
     def unregister_raw_handlers(self, instance: Module, purpose: str):
         """Unregister event handlers for a module"""
         for handler in self.client.dispatcher.raw_handlers:
@@ -1213,10 +1363,12 @@ class Modules:
             return False
 
         self.aliases[alias.lower().strip()] = cmd
+        self._prefix_index = None
         return True
 
     def remove_alias(self, alias: str) -> bool:
         """Remove an alias"""
+        self._prefix_index = None
         return bool(self.aliases.pop(alias.lower().strip(), None))
 
     async def log(self, *args, **kwargs):
@@ -20,7 +20,7 @@ from logging.handlers import RotatingFileHandler
 import hikkatl
 from aiogram.utils.exceptions import NetworkError
 
-from . import utils
+from . import _context, utils
 from .tl_cache import CustomTelegramClient
 from .types import BotInlineCall, Module
 from .web.debugger import WebDebugger
@@ -424,24 +424,9 @@ class TelegramLogsHandler(logging.Handler):
                         )
 
     def emit(self, record: logging.LogRecord):
-        try:
-            caller = next(
-                (
-                    frame_info.frame.f_locals["_hikka_client_id_logging_tag"]
-                    for frame_info in inspect.stack()
-                    if isinstance(
-                        getattr(getattr(frame_info, "frame", None), "f_locals", {}).get(
-                            "_hikka_client_id_logging_tag"
-                        ),
-                        int,
-                    )
-                ),
-                False,
-            )
+        caller = _context.get_client_id()
 
-            if not isinstance(caller, int):
-                caller = None
-        except Exception:
+        if not isinstance(caller, int):
             caller = None
 
         record.hikka_caller = caller
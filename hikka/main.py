@@ -33,8 +33,10 @@ import json
 import logging
 import os
 import random
+import signal
 import socket
 import sqlite3
+import sys
 import typing
 from getpass import getpass
 from pathlib import Path
@@ -58,8 +60,8 @@ from hikkatl.sessions import MemorySession, SQLiteSession
 from hikkatl.tl.functions.account import GetPasswordRequest
 from hikkatl.tl.functions.auth import CheckPasswordRequest
 
-from . import database, loader, utils, version
-from ._internal import print_banner
+from . import _context, _http, database, loader, utils, version
+from ._internal import flush_databases, print_banner
 from .dispatcher import CommandDispatcher
 from .qr import QRCode
 from .tl_cache import CustomTelegramClient
@@ -741,6 +743,7 @@ class Hikka:
             client._tg_id = me.id
             client.tg_id = me.id
             client.hikka_me = me
+            _context.set_client_id(me.id)
             while await self.amain(first, client):
                 first = False
 
@@ -906,7 +909,16 @@ class Hikka:
 
     def main(self):
         """Main entrypoint"""
-        self.loop.run_until_complete(self._main())
+        # SIGTERM kills the process right away by default, so turn it
+        # into exit to let pending database changes be written
+        signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+
+        try:
+            self.loop.run_until_complete(self._main())
+        finally:
+            flush_databases()
+
+        self.loop.run_until_complete(_http.close())
         self.loop.close()
 
 
@@ -5,10 +5,10 @@
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
 import asyncio
+import collections
 import io
 import json
 import logging
-import random
 import time
 import typing
 
@@ -43,6 +43,9 @@ GROUPS = [
     "stats",
 ]
 
+# Groups of methods, which are counted by ratelimiter. Each one has its own
+# budget, so flood in one group does not hold requests of another one
+PROTECTED_GROUPS = {"messages", "account", "channels"}
 
 CONSTRUCTORS = {
     (lambda x: x[0].lower() + x[1:])(
@@ -68,9 +71,11 @@ class APIRatelimiterMod(loader.Module):
     strings = {"name": "APILimiter"}
 
     def __init__(self):
-        self._ratelimiter: typing.List[tuple] = []
+        self._ratelimiter: typing.Dict[str, typing.Deque[typing.Tuple[str, float]]] = (
+            collections.defaultdict(collections.deque)
+        )
+        self._blocked_until: typing.Dict[str, float] = {}
         self._suspend_until = 0
-        self._lock = False
         self.config = loader.ModuleConfig(
             loader.ConfigValue(
                 "time_sample",
@@ -126,7 +131,6 @@ class APIRatelimiterMod(loader.Module):
             ordered: bool = False,
             flood_sleep_threshold: int = None,
         ):
-            await asyncio.sleep(random.randint(1, 5) / 100)
             req = (request,) if not is_list_like(request) else request
             for r in req:
                 if (
@@ -135,49 +139,10 @@ class APIRatelimiterMod(loader.Module):
                         "disable_protection",
                         True,
                     )
-                    and (
-                        r.__module__.rsplit(".", maxsplit=1)[1]
-                        in {"messages", "account", "channels"}
-                    )
+                    and (group := r.__module__.rsplit(".", maxsplit=1)[1])
+                    in PROTECTED_GROUPS
                 ):
-                    request_name = type(r).__name__
-                    self._ratelimiter += [(request_name, time.perf_counter())]
-
-                    self._ratelimiter = list(
-                        filter(
-                            lambda x: time.perf_counter() - x[1]
-                            < int(self.config["time_sample"]),
-                            self._ratelimiter,
-                        )
-                    )
-
-                    if (
-                        len(self._ratelimiter) > int(self.config["threshold"])
-                        and not self._lock
-                    ):
-                        self._lock = True
-                        report = io.BytesIO(
-                            json.dumps(
-                                self._ratelimiter,
-                                indent=4,
-                            ).encode()
-                        )
-                        report.name = "local_fw_report.json"
-
-                        await self.inline.bot.send_document(
-                            self.tg_id,
-                            report,
-                            caption=self.inline.sanitise_text(
-                                self.strings("warning").format(
-                                    self.config["local_floodwait"],
-                                    prefix=utils.escape_html(self.get_prefix()),
-                                )
-                            ),
-                        )
-
-                        # It is intented to use time.sleep instead of asyncio.sleep
-                        time.sleep(int(self.config["local_floodwait"]))
-                        self._lock = False
+                    await self._throttle(group, type(r).__name__)
 
             return await old_call(sender, request, ordered, flood_sleep_threshold)
 
@@ -186,6 +151,44 @@ class APIRatelimiterMod(loader.Module):
         self._client._call._hikka_overwritten = True
         logger.debug("Successfully installed ratelimiter")
 
+    async def _throttle(self, group: str, request_name: str):
+        """
+        Accounts request in sliding window of its group and holds it, if
+        the group exceeded the limit. Only requests of this group are held,
+        the rest of the client keeps running
+        :param group: Group of the method
+        :param request_name: Name of the request
+        """
+        if (delay := self._blocked_until.get(group, 0) - time.perf_counter()) > 0:
+            await asyncio.sleep(delay)
+
+        now = time.perf_counter()
+        window = self._ratelimiter[group]
+        window.append((request_name, now))
+        while now - window[0][1] >= int(self.config["time_sample"]):
+            window.popleft()
+
+        if len(window) <= int(self.config["threshold"]):
+            return
+
+        self._blocked_until[group] = now + int(self.config["local_floodwait"])
+        report = io.BytesIO(json.dumps(list(window), indent=4).encode())
+        report.name = "local_fw_report.json"
+        window.clear()
+
+        await self.inline.bot.send_document(
+            self.tg_id,
+            report,
+            caption=self.inline.sanitise_text(
+                self.strings("warning").format(
+                    self.config["local_floodwait"],
+                    prefix=utils.escape_html(self.get_prefix()),
+                )
+            ),
+        )
+
+        await asyncio.sleep(max(0, self._blocked_until[group] - time.perf_counter()))
+
     async def on_unload(self):
         if hasattr(self._client, "_old_call_rewritten"):
             self._client._call = self._client._old_call_rewritten
@@ -97,6 +97,14 @@ class Help(loader.Module):
                 args.lower().strip(self.get_prefix())
             )[1]:
                 module = method.__self__
+            elif (
+                suggestions := self.allmodules.suggest_commands(
+                    args.lower().strip(self.get_prefix()),
+                    limit=1,
+                )
+            ) and (method := self.allmodules.dispatch(suggestions[0])[1]):
+                module = method.__self__
+                exact = False
             else:
                 module = self.lookup(
                     next(
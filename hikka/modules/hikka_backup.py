@@ -12,16 +12,20 @@ import json
 import logging
 import os
 import time
+import typing
 import zipfile
 from pathlib import Path
 
 from hikkatl.tl.types import Message
 
-from .. import loader, utils
+from .. import _backup, loader, main, utils
 from ..inline.types import BotInlineCall
 
 logger = logging.getLogger(__name__)
 
+# Amount of incremental backups, made between full snapshots
+FULL_BACKUP_EVERY = 24
+
 
 @loader.tds
 class HikkaBackupMod(loader.Module):
@@ -30,6 +34,8 @@ class HikkaBackupMod(loader.Module):
     strings = {"name": "HikkaBackup"}
 
     async def client_ready(self):
+        self._engine = _backup.BackupEngine(self._db)
+
         if not self.get("period"):
             await self.inline.bot.send_photo(
                 self.tg_id,
@@ -121,12 +127,7 @@ class HikkaBackupMod(loader.Module):
                 self.get("last_backup") + self.get("period") - time.time()
             )
 
-            backup = io.BytesIO(json.dumps(self._db).encode())
-            backup.name = (
-                f"hikka-db-backup-{datetime.datetime.now():%d-%m-%Y-%H-%M}.json"
-            )
-
-            await self._client.send_file(self._backup_channel, backup)
+            await self._send_backup()
             self.set("last_backup", round(time.time()))
         except loader.StopLoop:
             raise
@@ -134,10 +135,89 @@ class HikkaBackupMod(loader.Module):
             logger.exception("HikkaBackup failed")
             await asyncio.sleep(60)
 
+    async def on_unload(self):
+        self._engine.close()
+
+    @property
+    def _manifest_path(self) -> Path:
+        # Manifest holds digests of all owners, so being stored in the database
+        # it would get to every incremental backup
+        return main.BASE_PATH / f"backup-manifest-{self.tg_id}.json"
+
+    def _load_manifest(self) -> typing.Optional[dict]:
+        try:
+            return json.loads(self._manifest_path.read_text())
+        except (OSError, ValueError):
+            return None
+
+    def _save_manifest(self, manifest: dict):
+        temp_path = self._manifest_path.with_name(f"{self._manifest_path.name}.tmp")
+        temp_path.write_text(json.dumps(manifest))
+        os.replace(temp_path, self._manifest_path)
+
+    async def _send_backup(self):
+        """
+        Sends backup to the backup channel. Every `FULL_BACKUP_EVERY`-th backup
+        is full, others contain only owners, changed since the last full one
+        """
+        manifest = await utils.run_sync(self._load_manifest)
+        full = (
+            not manifest
+            or manifest["increments"] >= FULL_BACKUP_EVERY
+            or manifest["channel_id"] != self._backup_channel.id
+        )
+
+        data, digests = await self._engine.build(None if full else manifest)
+        backup = io.BytesIO(data)
+        backup.name = "hikka-db-{}-{:%d-%m-%Y-%H-%M}.json.gz".format(
+            "backup" if full else "increment",
+            datetime.datetime.now(),
+        )
+
+        message = await self._client.send_file(self._backup_channel, backup)
+
+        if full:
+            manifest = {
+                "channel_id": self._backup_channel.id,
+                "message_id": message.id,
+                "digests": digests,
+                "increments": 0,
+            }
+        else:
+            manifest["increments"] += 1
+
+        await utils.run_sync(self._save_manifest, manifest)
+
+    async def _read_backup(self, data: bytes) -> dict:
+        """
+        Decodes backup. Incremental backup is replayed on top of the full one,
+        which is downloaded from the backup channel
+        """
+        backup = await utils.run_sync(_backup.decode, data)
+        if backup.get("type") != "incremental":
+            return backup["owners"]
+
+        if (
+            not (
+                base := await self._client.get_messages(
+                    self._backup_channel,
+                    ids=backup["base"],
+                )
+            )
+            or not base.media
+        ):
+            raise RuntimeError("Full backup of incremental one is not available")
+
+        return _backup.apply_increment(
+            await self._read_backup(await base.download_media(bytes)),
+            backup,
+        )
+
     @loader.command()
     async def backupdb(self, message: Message):
-        txt = io.BytesIO(json.dumps(self._db).encode())
-        txt.name = f"db-backup-{datetime.datetime.now():%d-%m-%Y-%H-%M}.json"
+        data, _ = await self._engine.build()
+        txt = io.BytesIO(data)
+        txt.name = f"db-backup-{datetime.datetime.now():%d-%m-%Y-%H-%M}.json.gz"
         await self._client.send_file(
             "me",
             txt,
@@ -157,7 +237,7 @@ class HikkaBackupMod(loader.Module):
             return
 
         file = await reply.download_media(bytes)
-        decoded_text = json.loads(file.decode())
+        decoded_text = await self._read_backup(file)
 
         with contextlib.suppress(KeyError):
             decoded_text["hikka.inline"].pop("bot_token")
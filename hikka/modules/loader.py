@@ -27,12 +27,11 @@ from collections import ChainMap
 from importlib.machinery import ModuleSpec
 from urllib.parse import urlparse
 
-import requests
 from hikkatl.errors.rpcerrorlist import MediaCaptionTooLongError
 from hikkatl.tl.functions.channels import JoinChannelRequest
 from hikkatl.tl.types import Channel, Message
 
-from .. import loader, main, utils
+from .. import _http, loader, main, utils
 from .._local_storage import RemoteStorage
 from ..compat import dragon, geek
 from ..compat.pyroproxy import PyroProxyClient
@@ -41,6 +40,9 @@ from ..types import CoreOverwriteError, CoreUnloadError, DragonModule
 
 logger = logging.getLogger(__name__)
 
+# Amount of remote modules, which are downloaded simultaneously on startup
+DOWNLOAD_CONCURRENCY = 8
+
 
 class FakeLock:
     async def __aenter__(self, *args):
@@ -242,31 +244,35 @@ class LoaderMod(loader.Module):
 
     async def _get_repo(self, repo: str) -> str:
         repo = repo.strip("/")
+        cached = self._links_cache.get(repo, {})
 
-        if self._links_cache.get(repo, {}).get("exp", 0) >= time.time():
-            return self._links_cache[repo]["data"]
+        if cached.get("exp", 0) >= time.time():
+            return cached["data"]
 
-        res = await utils.run_sync(
-            requests.get,
+        res = await _http.get(
             f"{repo}/full.txt",
-            auth=(
-                tuple(self.config["basic_auth"].split(":", 1))
-                if self.config["basic_auth"]
-                else None
-            ),
+            auth=self.config["basic_auth"] or None,
+            etag=cached.get("etag"),
+            last_modified=cached.get("last_modified"),
         )
 
-        if not str(res.status_code).startswith("2"):
+        if res.not_modified:
+            cached["exp"] = time.time() + 5 * 60
+            return cached["data"]
+
+        if not str(res.status).startswith("2"):
             logger.debug(
                 "Can't load repo %s contents because of %s status code",
                 repo,
-                res.status_code,
+                res.status,
             )
             return []
 
         self._links_cache[repo] = {
             "exp": time.time() + 5 * 60,
             "data": [link for link in res.text.strip().splitlines() if link],
+            "etag": res.etag,
+            "last_modified": res.last_modified,
         }
 
         return self._links_cache[repo]["data"]
@@ -301,31 +307,47 @@ class LoaderMod(loader.Module):
             False,
         )
 
+    async def _resolve_link(
+        self,
+        module_name: str,
+    ) -> typing.Tuple[typing.Union[str, bool], bool]:
+        """
+        Converts module name or link to the link to its raw source
+        :param module_name: Name of the module in repos or link to it
+        :return: Link (falsy if module is not found) and whether it was a blob link
+        """
+        if not urlparse(module_name).netloc:
+            return await self._find_link(module_name), False
+
+        if re.match(
+            r"^(https:\/\/github\.com\/.*?\/.*?\/blob\/.*\.py)|"
+            r"(https:\/\/gitlab\.com\/.*?\/.*?\/-\/blob\/.*\.py)$",
+            module_name,
+        ):
+            return module_name.replace("/blob/", "/raw/"), True
+
+        return module_name, False
+
     async def download_and_install(
         self,
         module_name: str,
         message: typing.Optional[Message] = None,
+        source: typing.Optional[str] = None,
     ):
+        """
+        Downloads module and loads it
+        :param module_name: Name of the module in repos or link to it
+        :param message: Message to report progress to
+        :param source: Already downloaded source of the module, if any
+        """
         try:
-            blob_link = False
             module_name = module_name.strip()
-            if urlparse(module_name).netloc:
-                url = module_name
-                if re.match(
-                    r"^(https:\/\/github\.com\/.*?\/.*?\/blob\/.*\.py)|"
-                    r"(https:\/\/gitlab\.com\/.*?\/.*?\/-\/blob\/.*\.py)$",
-                    url,
-                ):
-                    url = url.replace("/blob/", "/raw/")
-                    blob_link = True
-            else:
-                url = await self._find_link(module_name)
-
-                if not url:
-                    if message is not None:
-                        await utils.answer(message, self.strings("no_module"))
+            url, blob_link = await self._resolve_link(module_name)
+            if not url:
+                if message is not None:
+                    await utils.answer(message, self.strings("no_module"))
 
-                    return False
+                return False
 
             if message:
                 message = await utils.answer(
@@ -334,8 +356,15 @@ class LoaderMod(loader.Module):
                 )
 
             try:
-                r = await self._storage.fetch(url, auth=self.config["basic_auth"])
-            except requests.exceptions.HTTPError:
+                r = (
+                    source
+                    if source is not None
+                    else await self._storage.fetch(
+                        url,
+                        auth=self.config["basic_auth"],
+                    )
+                )
+            except _http.HTTPError:
                 if message is not None:
                     await utils.answer(message, self.strings("no_module"))
 
@@ -1161,14 +1190,9 @@ class LoaderMod(loader.Module):
             args = f"https://{args}"
 
         try:
-            r = await utils.run_sync(
-                requests.get,
+            r = await _http.get(
                 f"{args}/full.txt",
-                auth=(
-                    tuple(self.config["basic_auth"].split(":", 1))
-                    if self.config["basic_auth"]
-                    else None
-                ),
+                auth=self.config["basic_auth"] or None,
             )
             r.raise_for_status()
             if not r.text.strip():
@@ -1223,9 +1247,7 @@ class LoaderMod(loader.Module):
             self._db.set(loader.__name__, "secure_boot", False)
             self._secure_boot = True
         else:
-            for mod in todo.values():
-                await self.download_and_install(mod)
-
+            await self._install_remote_modules(list(todo.values()))
             self.update_modules_in_db()
 
             aliases = {
@@ -1241,15 +1263,63 @@ class LoaderMod(loader.Module):
         with contextlib.suppress(AttributeError):
             await self.lookup("Updater").full_restart_complete(self._secure_boot)
 
+    async def _install_remote_modules(self, modules: typing.List[str]):
+        """
+        Downloads modules concurrently and installs them in the original order
+        :param modules: Names of modules in repos or links to them
+        """
+        semaphore = asyncio.Semaphore(DOWNLOAD_CONCURRENCY)
+
+        async def prefetch(
+            module_name: str,
+        ) -> typing.Tuple[typing.Optional[str], typing.Optional[str]]:
+            async with semaphore:
+                started = time.perf_counter()
+                url = None
+                try:
+                    url, _ = await self._resolve_link(module_name.strip())
+                    return url, (
+                        await self._storage.fetch(url, auth=self.config["basic_auth"])
+                        if url
+                        else None
+                    )
+                except Exception:
+                    # Module will be downloaded again during installation,
+                    # which reports the error properly
+                    logger.debug("Can't prefetch %s", module_name, exc_info=True)
+                    return url, None
+                finally:
+                    # Remote modules are reported by their links, which are
+                    # also their origins after installation
+                    self.allmodules.record_load_timing(
+                        url or module_name,
+                        fetch=time.perf_counter() - started,
+                    )
+
+        # Installation itself stays sequential, because modules can require
+        # libraries and other modules, installed before them
+        for module_name, (url, source) in zip(
+            modules,
+            await asyncio.gather(*map(prefetch, modules)),
+        ):
+            started = time.perf_counter()
+            await self.download_and_install(module_name, source=source)
+            self.allmodules.record_load_timing(
+                url or module_name,
+                install=time.perf_counter() - started,
+            )
+
+        self.allmodules.log_load_timings("remote")
+
     def flush_cache(self) -> int:
         """Flush the cache of links to modules"""
-        count = sum(map(len, self._links_cache.values()))
+        count = sum(len(repo["data"]) for repo in self._links_cache.values())
         self._links_cache = {}
         return count
 
     def inspect_cache(self) -> int:
         """Inspect the cache of links to modules"""
-        return sum(map(len, self._links_cache.values()))
+        return sum(len(repo["data"]) for repo in self._links_cache.values())
 
     async def reload_core(self) -> int:
         """Forcefully reload all core modules"""
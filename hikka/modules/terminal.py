@@ -23,10 +23,13 @@
 # meta developer: @bsolute
 
 import asyncio
+import codecs
+import collections
 import contextlib
 import logging
 import os
 import re
+import time
 import typing
 
 import hikkatl
@@ -40,32 +43,71 @@ def hash_msg(message):
     return f"{str(utils.get_chat_id(message))}/{str(message.id)}"
 
 
-async def read_stream(func: callable, stream, delay: float):
-    last_task = None
-    data = b""
-    while True:
-        dat = await stream.read(1)
+STREAM_CHUNK_SIZE = 65536
+# Only the tail of the output is shown, so there is no need to keep the whole
+STREAM_BUFFER_SIZE = 65536
+# Minimal interval between edits of the same message
+EDIT_INTERVAL = 1.0
+
 
-        if not dat:
-            # EOF
-            if last_task:
-                # Send all pending data
-                last_task.cancel()
-                await func(data.decode())
-                # If there is no last task there is inherently no data, so theres no point sending a blank string
-            break
+class RingBuffer:
+    """Keeps only the last `size` characters of the text, written to it"""
 
-        data += dat
+    def __init__(self, size: int):
+        self.size = size
+        self._chunks = collections.deque()
+        self._length = 0
 
-        if last_task:
-            last_task.cancel()
+    def write(self, text: str):
+        if not text:
+            return
 
-        last_task = asyncio.ensure_future(sleep_for_task(func, data, delay))
+        self._chunks.append(text)
+        self._length += len(text)
+        while self._length - len(self._chunks[0]) >= self.size:
+            self._length -= len(self._chunks.popleft())
 
+    def getvalue(self) -> str:
+        return "".join(self._chunks)[-self.size :]
 
-async def sleep_for_task(func: callable, data: bytes, delay: float):
-    await asyncio.sleep(delay)
-    await func(data.decode())
+
+async def read_stream(func: callable, stream, delay: float):
+    """
+    Reads the stream by chunks and passes its decoded tail to `func`
+    at most once per `delay` seconds and once after EOF
+    """
+    decoder = codecs.getincrementaldecoder("utf-8")(errors="replace")
+    buffer = RingBuffer(STREAM_BUFFER_SIZE)
+    flush_task = None
+    waiting = False
+
+    async def flush():
+        nonlocal waiting
+
+        waiting = True
+        await asyncio.sleep(delay)
+        waiting = False
+        await func(buffer.getvalue())
+
+    while chunk := await stream.read(STREAM_CHUNK_SIZE):
+        buffer.write(decoder.decode(chunk))
+
+        # All data, received before the flush, is sent at once
+        if flush_task is None or flush_task.done():
+            flush_task = asyncio.ensure_future(flush())
+
+    buffer.write(decoder.decode(b"", final=True))
+
+    # If there is no task there is inherently no data,
+    # so there's no point sending a blank string
+    if flush_task is not None:
+        if waiting:
+            flush_task.cancel()
+        else:
+            with contextlib.suppress(Exception):
+                await flush_task
+
+        await func(buffer.getvalue())
 
 
 class MessageEditor:
@@ -86,6 +128,32 @@ class MessageEditor:
         self.config = config
         self.strings = strings
         self.request_message = request_message
+        self._edit_lock = asyncio.Lock()
+        self._last_edit = 0
+        self._last_text = None
+
+    async def _edit(
+        self,
+        render: typing.Callable[[], str],
+    ) -> typing.Optional[hikkatl.tl.types.Message]:
+        """
+        Edits the message with the rendered text, keeping edits at least
+        `EDIT_INTERVAL` apart. Text is rendered right before the edit, so
+        updates, received meanwhile, are coalesced into it
+        :param render: Function, which returns text of the message
+        :return: Edited message or `None` if the text hasn't changed
+        """
+        async with self._edit_lock:
+            if (delay := self._last_edit + EDIT_INTERVAL - time.monotonic()) > 0:
+                await asyncio.sleep(delay)
+
+            if (text := render()) == self._last_text:
+                return None
+
+            message = await utils.answer(self.message, text)
+            self._last_text = text
+            self._last_edit = time.monotonic()
+            return message
 
     async def update_stdout(self, stdout):
         self.stdout = stdout
@@ -95,7 +163,7 @@ class MessageEditor:
         self.stderr = stderr
         await self.redraw()
 
-    async def redraw(self):
+    def render(self) -> str:
         text = self.strings("running").format(utils.escape_html(self.command))  # fmt: skip
 
         if self.rc is not None:
@@ -106,13 +174,16 @@ class MessageEditor:
         stderr = utils.escape_html(self.stderr[max(len(self.stderr) - 1024, 0) :])
         text += (self.strings("stderr") + stderr) if stderr else ""
         text += self.strings("end")
+        return text
 
+    async def redraw(self):
         with contextlib.suppress(hikkatl.errors.rpcerrorlist.MessageNotModifiedError):
             try:
-                self.message = await utils.answer(self.message, text)
+                if (message := await self._edit(self.render)) is not None:
+                    self.message = message
             except hikkatl.errors.rpcerrorlist.MessageTooLongError as e:
                 logger.error(e)
-                logger.error(text)
+                logger.error(self._last_text)
         # The message is never empty due to the template header
 
     async def cmd_ended(self, rc):
@@ -254,9 +325,7 @@ class RawMessageEditor(SudoMessageEditor):
         super().__init__(message, command, config, strings, request_message)
         self.show_done = show_done
 
-    async def redraw(self):
-        logger.debug(self.rc)
-
+    def render(self) -> str:
         if self.rc is None:
             text = (
                 "<code>"
@@ -279,7 +348,10 @@ class RawMessageEditor(SudoMessageEditor):
         if self.rc is not None and self.show_done:
             text += "\n" + self.strings("done")
 
-        logger.debug(text)
+        return text
+
+    async def redraw(self):
+        logger.debug(self.rc)
 
         with contextlib.suppress(
             hikkatl.errors.rpcerrorlist.MessageNotModifiedError,
@@ -287,10 +359,10 @@ class RawMessageEditor(SudoMessageEditor):
             ValueError,
         ):
             try:
-                await utils.answer(self.message, text)
+                await self._edit(self.render)
             except hikkatl.errors.rpcerrorlist.MessageTooLongError as e:
                 logger.error(e)
-                logger.error(text)
+                logger.error(self._last_text)
 
 
 @loader.tds
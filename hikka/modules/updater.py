@@ -6,9 +6,10 @@
 
 import asyncio
 import contextlib
+import importlib.metadata
 import logging
 import os
-import subprocess
+import re
 import sys
 import time
 import typing
@@ -22,12 +23,34 @@ from hikkatl.tl.functions.messages import (
 )
 from hikkatl.tl.types import DialogFilter, Message
 
-from .. import loader, main, utils, version
+from .. import _bytecode_cache, loader, main, utils, version
 from .._internal import restart
 from ..inline.types import InlineCall
 
 logger = logging.getLogger(__name__)
 
+PINNED_REQUIREMENT = re.compile(r"^([A-Za-z0-9_.\-]+)==([^\s;#]+)$")
+
+
+def _parse_requirements(text: str) -> typing.List[str]:
+    """Returns meaningful lines of requirements file"""
+    return [
+        line
+        for line in (line.split(" #", 1)[0].strip() for line in text.splitlines())
+        if line and not line.startswith("#")
+    ]
+
+
+def _is_satisfied(requirement: str) -> bool:
+    """Checks, whether pinned requirement is already installed"""
+    if not (match := PINNED_REQUIREMENT.match(requirement)):
+        return False
+
+    try:
+        return importlib.metadata.version(match[1]) == match[2]
+    except importlib.metadata.PackageNotFoundError:
+        return False
+
 
 @loader.tds
 class UpdaterMod(loader.Module):
@@ -119,7 +142,10 @@ class UpdaterMod(loader.Module):
 
         self.set("restart_ts", time.time())
 
-        await self._db.remote_force_save()
+        for client in self.allclients:
+            # Flush pending debounced writes of all accounts before restart
+            with contextlib.suppress(AttributeError):
+                await client.hikka_db.force_save()
 
         if "LAVHOST" in os.environ:
             os.system("lavhost restart")
@@ -140,49 +166,119 @@ class UpdaterMod(loader.Module):
         await message.client.disconnect()
         restart()
 
-    async def download_common(self):
+    @staticmethod
+    async def _git(*args: str) -> str:
+        """
+        Runs git command in the repository of Hikka without blocking event loop
+        :param args: Arguments of the command
+        :return: Output of the command
+        """
+        proc = await asyncio.create_subprocess_exec(
+            "git",
+            *args,
+            cwd=os.path.dirname(utils.get_base_dir()),
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        stdout, stderr = await proc.communicate()
+        if proc.returncode:
+            raise GitCommandError(
+                ["git", *args],
+                proc.returncode,
+                stderr.decode(errors="replace"),
+            )
+
+        return stdout.decode(errors="replace")
+
+    @staticmethod
+    def _requirements_path() -> str:
+        return os.path.join(os.path.dirname(utils.get_base_dir()), "requirements.txt")
+
+    def _read_requirements(self) -> typing.List[str]:
+        with contextlib.suppress(OSError):
+            with open(self._requirements_path()) as f:
+                return _parse_requirements(f.read())
+
+        return []
+
+    def _init_repo(self):
+        repo = Repo.init(os.path.dirname(utils.get_base_dir()))
+        origin = repo.create_remote("origin", self.config["GIT_ORIGIN_URL"])
+        origin.fetch()
+        repo.create_head("master", origin.refs.master)
+        repo.heads.master.set_tracking_branch(origin.refs.master)
+        repo.heads.master.checkout(True)
+
+    async def download_common(self) -> bool:
+        """
+        Pulls updates without blocking event loop
+        :return: Whether requirements file was changed by the update
+        """
         try:
-            repo = Repo(os.path.dirname(utils.get_base_dir()))
-            origin = repo.remote("origin")
-            r = origin.pull()
-            new_commit = repo.head.commit
-            for info in r:
-                if info.old_commit:
-                    for d in new_commit.diff(info.old_commit):
-                        if d.b_path == "requirements.txt":
-                            return True
-            return False
+            Repo(os.path.dirname(utils.get_base_dir()))
         except git.exc.InvalidGitRepositoryError:
-            repo = Repo.init(os.path.dirname(utils.get_base_dir()))
-            origin = repo.create_remote("origin", self.config["GIT_ORIGIN_URL"])
-            origin.fetch()
-            repo.create_head("master", origin.refs.master)
-            repo.heads.master.set_tracking_branch(origin.refs.master)
-            repo.heads.master.checkout(True)
-            return False
+            await utils.run_sync(self._init_repo)
+            return True
+
+        old_requirements = self._read_requirements()
+        await self._git("pull", "origin")
+        return self._read_requirements() != old_requirements
+
+    async def req_common(self):
+        """
+        Installs requirements file, streaming output of pip to logs.
+        Skipped if every requirement is pinned and already installed
+        """
+        if (requirements := self._read_requirements()) and all(
+            map(_is_satisfied, requirements)
+        ):
+            logger.debug("Requirements are already satisfied")
+            return
 
-    @staticmethod
-    def req_common():
-        # Now we have downloaded new code, install requirements
         logger.debug("Installing new requirements...")
-        try:
-            subprocess.run(
-                [
-                    sys.executable,
-                    "-m",
-                    "pip",
-                    "install",
-                    "-r",
-                    os.path.join(
-                        os.path.dirname(utils.get_base_dir()),
-                        "requirements.txt",
-                    ),
-                    "--user",
-                ],
-                check=True,
-            )
-        except subprocess.CalledProcessError:
-            logger.exception("Req install failed")
+        proc = await asyncio.create_subprocess_exec(
+            sys.executable,
+            "-m",
+            "pip",
+            "install",
+            "-r",
+            self._requirements_path(),
+            "--user",
+            stdout=asyncio.subprocess.PIPE,
+            stderr=asyncio.subprocess.STDOUT,
+        )
+
+        while line := await proc.stdout.readline():
+            logger.debug("pip: %s", line.decode(errors="replace").rstrip())
+
+        if await proc.wait():
+            logger.error("Req install failed with code %s", proc.returncode)
+
+    async def prepare_restart(self):
+        """
+        Compiles updated core modules into the bytecode cache in background,
+        so the restart takes less time
+        """
+        modules_dir = os.path.join(utils.get_base_dir(), loader.MODULES_NAME)
+
+        def warm_up():
+            for mod in os.listdir(modules_dir):
+                if not mod.endswith(".py") or mod.startswith("_"):
+                    continue
+
+                module_name = "{}.{}.{}".format(
+                    loader.__package__,
+                    loader.MODULES_NAME,
+                    mod.rsplit(".py", maxsplit=1)[0],
+                )
+                with contextlib.suppress(Exception):
+                    with open(os.path.join(modules_dir, mod), "rb") as f:
+                        _bytecode_cache.compile_cached(
+                            f.read(),
+                            f"<core {module_name}>",
+                        )
+
+        await utils.run_sync(warm_up)
 
     @loader.command()
     async def update(self, message: Message):
@@ -222,9 +318,13 @@ class UpdaterMod(loader.Module):
         msg_obj: typing.Union[InlineCall, Message],
         hard: bool = False,
     ):
-        # We don't really care about asyncio at this point, as we are shutting down
+        # Update is prepared in background, so the userbot keeps working until
+        # everything is ready for the restart
         if hard:
-            os.system(f"cd {utils.get_base_dir()} && cd .. && git reset --hard HEAD")
+            try:
+                await self._git("reset", "--hard", "HEAD")
+            except GitCommandError:
+                logger.exception("Can't reset local changes before update")
 
         try:
             if "LAVHOST" in os.environ:
@@ -248,14 +348,15 @@ class UpdaterMod(loader.Module):
             with contextlib.suppress(Exception):
                 msg_obj = await utils.answer(msg_obj, self.strings("downloading"))
 
-            req_update = await self.download_common()
+            requirements_changed = await self.download_common()
 
             with contextlib.suppress(Exception):
                 msg_obj = await utils.answer(msg_obj, self.strings("installing"))
 
-            if req_update:
-                self.req_common()
+            if requirements_changed:
+                await self.req_common()
 
+            await self.prepare_restart()
             await self.restart_common(msg_obj)
         except GitCommandError:
             if not hard:
@@ -22,22 +22,44 @@
 # You can redistribute it and/or modify it under the terms of the GNU AGPLv3
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
+import heapq
 import logging
 import time
 import typing
 
+from hikkatl.errors import UserNotParticipantError
 from hikkatl.hints import EntityLike
 from hikkatl.tl.functions.messages import GetFullChatRequest
-from hikkatl.tl.types import ChatParticipantAdmin, ChatParticipantCreator, Message
+from hikkatl.tl.types import (
+    ChatParticipantAdmin,
+    ChatParticipantCreator,
+    ChatParticipants,
+    Message,
+    UpdateChannelParticipant,
+    UpdateChatParticipant,
+    UpdateChatParticipantAdd,
+    UpdateChatParticipantAdmin,
+    UpdateChatParticipantDelete,
+    UpdateChatParticipants,
+)
 from hikkatl.utils import get_display_name
 
 from . import main, utils
+from ._cache import TTLCache
 from .database import Database
 from .tl_cache import CustomTelegramClient
 from .types import Command
 
 logger = logging.getLogger(__name__)
 
+PERMS_CACHE_SIZE = 10000
+PERMS_CACHE_TTL = 5 * 60
+# "Not a participant" records are kept for a shorter time, because joins
+# are not always delivered as updates
+NEGATIVE_PERMS_CACHE_TTL = 60
+
+_MISSING = object()
+
 OWNER = 1 << 0
 SUDO = 1 << 1
 SUPPORT = 1 << 2
@@ -168,7 +190,9 @@ class SecurityManager:
     def __init__(self, client: CustomTelegramClient, db: Database):
         self._client = client
         self._db = db
-        self._cache: typing.Dict[int, dict] = {}
+        # Permissions of users in chats, keyed by `(chat_id, user_id)`. `None`
+        # means that user is not a participant of the chat
+        self._cache = TTLCache(PERMS_CACHE_SIZE, PERMS_CACHE_TTL)
         self._last_warning: int = 0
         self._sgroups: typing.Dict[str, SecurityGroup] = {}
 
@@ -178,11 +202,91 @@ class SecurityManager:
         self._tsec_user = self.tsec_user = db.pointer(__name__, "tsec_user", [])
         self._owner = self.owner = db.pointer(__name__, "owner", [])
 
+        # Targeted security rules and security groups, compiled into sets of
+        # `(target_id, rule_type, rule)`. Rebuilt lazily after rules change
+        self._rules: typing.Optional[typing.Dict[str, typing.Set[tuple]]] = None
+        self._rules_expirations: typing.List[int] = []
+        db.on_change(__name__, self._invalidate_rules)
+
         self._reload_rights()
 
+    def process_update(self, update: typing.Any):
+        """
+        Drops cached permissions, which are affected by the update
+        :param update: Raw update
+        """
+        if isinstance(update, UpdateChannelParticipant):
+            self._cache.pop((update.channel_id, update.user_id))
+        elif isinstance(
+            update,
+            (
+                UpdateChatParticipant,
+                UpdateChatParticipantAdd,
+                UpdateChatParticipantAdmin,
+                UpdateChatParticipantDelete,
+            ),
+        ):
+            self._cache.pop((update.chat_id, update.user_id))
+        elif isinstance(update, UpdateChatParticipants) and isinstance(
+            update.participants,
+            ChatParticipants,
+        ):
+            self._index_participants(update.participants)
+
+    def _index_participants(self, participants: ChatParticipants):
+        """Caches all participants of basic group at once"""
+        for participant in participants.participants:
+            self._cache[(participants.chat_id, participant.user_id)] = participant
+
     def apply_sgroups(self, sgroups: typing.Dict[str, SecurityGroup]):
         """Apply security groups"""
         self._sgroups = sgroups
+        self._invalidate_rules()
+
+    def _invalidate_rules(self):
+        self._rules = None
+
+    def _get_rules(self) -> typing.Dict[str, typing.Set[tuple]]:
+        """
+        Returns compiled targeted security rules and security groups,
+        dropping expired rules first
+        """
+        if self._rules_expirations and self._rules_expirations[0] < time.time():
+            for info in self._tsec_user.copy():
+                if info["expires"] and info["expires"] < time.time():
+                    self._tsec_user.remove(info)
+
+            for info in self._tsec_chat.copy():
+                if info["expires"] and info["expires"] < time.time():
+                    self._tsec_chat.remove(info)
+
+            self._invalidate_rules()
+
+        if self._rules is None:
+            self._rules = {"user": set(), "chat": set(), "sgroup": set()}
+            self._rules_expirations = []
+
+            for target_type, rules in (
+                ("user", self._tsec_user),
+                ("chat", self._tsec_chat),
+            ):
+                for info in rules:
+                    self._rules[target_type].add(
+                        (info["target"], info["rule_type"], info["rule"])
+                    )
+                    if info["expires"]:
+                        self._rules_expirations.append(info["expires"])
+
+            for info in self._sgroups.values():
+                for user in info.users:
+                    for permission in info.permissions:
+                        self._rules["sgroup"].add(
+                            (user, permission["rule_type"], permission["rule"])
+                        )
+
+            heapq.heapify(self._rules_expirations)
+
+        return self._rules
 
     def _reload_rights(self):
         """
@@ -193,13 +297,7 @@ class SecurityManager:
         if self._client.tg_id not in self._owner:
             self._owner.append(self._client.tg_id)
 
-        for info in self._tsec_user.copy():
-            if info["expires"] and info["expires"] < time.time():
-                self._tsec_user.remove(info)
-
-        for info in self._tsec_chat.copy():
-            if info["expires"] and info["expires"] < time.time():
-                self._tsec_chat.remove(info)
+        self._get_rules()
 
     def add_rule(
         self,
@@ -325,39 +423,29 @@ class SecurityManager:
         :return: True if permitted, False otherwise
         """
 
-        return command and any(
-            (
-                rule["target"] == user_id
-                and rule["rule_type"] == "inline"
-                and rule["rule"] == command
-            )
-            for rule in self._tsec_user
+        return bool(command) and (
+            (user_id, "inline", command) in self._get_rules()["user"]
         )
 
     def check_tsec(self, user_id: int, command: str) -> bool:
-        for info in self._sgroups.copy().values():
-            if user_id in info.users:
-                for permission in info.permissions:
-                    if (
-                        permission["rule_type"] == "command"
-                        and permission["rule"] == command
-                        or permission["rule_type"] == "module"
-                        and permission["rule"] == command
-                    ):
-                        return True
-
-        for info in self._tsec_user.copy():
-            if info["target"] == user_id and (
-                info["rule_type"] == "command"
-                and info["rule"] == command
-                or info["rule_type"] == "module"
-                and command in self._client.loader.commands
-                and info["rule"]
-                == self._client.loader.commands[command].__qualname__.split(".")[0]
-            ):
-                return True
+        rules = self._get_rules()
+        if any(
+            (user_id, rule_type, command) in rules["sgroup"]
+            for rule_type in ("command", "module")
+        ):
+            return True
 
-        return False
+        if (user_id, "command", command) in rules["user"]:
+            return True
+
+        return command in self._client.loader.commands and (
+            (
+                user_id,
+                "module",
+                self._client.loader.commands[command].__qualname__.split(".")[0],
+            )
+            in rules["user"]
+        )
 
     async def check(
         self,
@@ -472,73 +560,35 @@ class SecurityManager:
 
         if callable(func):
             command = self._client.loader.find_alias(cmd, include_legacy=True) or cmd
+            module = func.__self__.__class__.__name__
+            rules = self._get_rules()
 
-            for info in self._sgroups.copy().values():
-                if user_id in info.users:
-                    for permission in info.permissions:
-                        if (
-                            permission["rule_type"] == "command"
-                            and permission["rule"] == command
-                        ):
-                            logger.debug("sgroup match for %s", command)
-                            return True
-
-                        if (
-                            permission["rule_type"] == "module"
-                            and permission["rule"] == func.__self__.__class__.__name__
-                        ):
-                            logger.debug(
-                                "sgroup match for %s", func.__self__.__class__.__name__
-                            )
-                            return True
+            for target_type, target in (
+                ("sgroup", user_id),
+                ("user", user_id),
+                ("chat", chat),
+            ):
+                if not target:
+                    continue
 
-            for info in self._tsec_user.copy():
-                if info["target"] == user_id:
-                    if info["rule_type"] == "command" and info["rule"] == command:
-                        logger.debug("tsec match for user %s", command)
-                        return True
-
-                    if (
-                        info["rule_type"] == "module"
-                        and info["rule"] == func.__self__.__class__.__name__
-                    ):
-                        logger.debug(
-                            "tsec match for user %s",
-                            func.__self__.__class__.__name__,
-                        )
-                        return True
-
-            if chat:
-                for info in self._tsec_chat.copy():
-                    if info["target"] == chat:
-                        if info["rule_type"] == "command" and info["rule"] == command:
-                            logger.debug("tsec match for %s", command)
-                            return True
-
-                        if (
-                            info["rule_type"] == "module"
-                            and info["rule"] == func.__self__.__class__.__name__
-                        ):
-                            logger.debug(
-                                "tsec match for %s",
-                                func.__self__.__class__.__name__,
-                            )
-                            return True
+                if (target, "command", command) in rules[target_type]:
+                    logger.debug("%s match for %s", target_type, command)
+                    return True
+
+                if (target, "module", module) in rules[target_type]:
+                    logger.debug("%s match for %s", target_type, module)
+                    return True
 
         if f_group_member and message.is_group or f_pm and message.is_private:
             return True
 
         if message.is_channel:
             if not message.is_group:
-                chat_id = utils.get_chat_id(message)
-                if (
-                    chat_id in self._cache
-                    and self._cache[chat_id]["exp"] >= time.time()
-                ):
-                    chat = self._cache[chat_id]["chat"]
-                else:
+                # Rights of userbot itself are stored in channel entity
+                cache_obj = (utils.get_chat_id(message), self._client.tg_id)
+                if (chat := self._cache.get(cache_obj, _MISSING)) is _MISSING:
                     chat = await message.get_chat()
-                    self._cache[chat_id] = {"chat": chat, "exp": time.time() + 5 * 60}
+                    self._cache[cache_obj] = chat
 
                 if (
                     not chat.creator
@@ -551,24 +601,20 @@ class SecurityManager:
                 if self._any_admin and f_group_admin_any or f_group_admin:
                     return True
             elif f_group_admin_any or f_group_owner:
-                chat_id = utils.get_chat_id(message)
-                cache_obj = f"{chat_id}/{user_id}"
-                if (
-                    cache_obj in self._cache
-                    and self._cache[cache_obj]["exp"] >= time.time()
-                ):
-                    participant = self._cache[cache_obj]["user"]
-                else:
-                    participant = await message.client.get_permissions(
-                        message.peer_id,
-                        user_id,
-                    )
-                    self._cache[cache_obj] = {
-                        "user": participant,
-                        "exp": time.time() + 5 * 60,
-                    }
+                cache_obj = (utils.get_chat_id(message), user_id)
+                if (participant := self._cache.get(cache_obj, _MISSING)) is _MISSING:
+                    try:
+                        participant = await message.client.get_permissions(
+                            message.peer_id,
+                            user_id,
+                        )
+                    except UserNotParticipantError:
+                        participant = None
+                        self._cache.set(cache_obj, None, NEGATIVE_PERMS_CACHE_TTL)
+                    else:
+                        self._cache[cache_obj] = participant
 
-                if (
+                if participant is not None and (
                     participant.is_creator
                     or participant.is_admin
                     and (
@@ -593,29 +639,17 @@ class SecurityManager:
             return False
 
         if message.is_group and (f_group_admin_any or f_group_owner):
-            chat_id = utils.get_chat_id(message)
-            cache_obj = f"{chat_id}/{user_id}"
+            cache_obj = (utils.get_chat_id(message), user_id)
 
-            if (
-                cache_obj in self._cache
-                and self._cache[cache_obj]["exp"] >= time.time()
-            ):
-                participant = self._cache[cache_obj]["user"]
-            else:
+            if (participant := self._cache.get(cache_obj, _MISSING)) is _MISSING:
                 full_chat = await message.client(GetFullChatRequest(message.chat_id))
-                participants = full_chat.full_chat.participants.participants
-                participant = next(
-                    (
-                        possible_participant
-                        for possible_participant in participants
-                        if possible_participant.user_id == message.sender_id
-                    ),
-                    None,
-                )
-                self._cache[cache_obj] = {
-                    "user": participant,
-                    "exp": time.time() + 5 * 60,
-                }
+                participants = full_chat.full_chat.participants
+                if isinstance(participants, ChatParticipants):
+                    self._index_participants(participants)
+
+                if (participant := self._cache.get(cache_obj, _MISSING)) is _MISSING:
+                    participant = None
+                    self._cache.set(cache_obj, None, NEGATIVE_PERMS_CACHE_TTL)
 
             if not participant:
                 return
@@ -4,7 +4,9 @@
 # You can redistribute it and/or modify it under the terms of the GNU AGPLv3
 # 🔑 https://www.gnu.org/licenses/agpl-3.0.html
 
+import asyncio
 import copy
+import functools
 import inspect
 import logging
 import time
@@ -27,6 +29,8 @@ from hikkatl.tl.types import (
 )
 from hikkatl.utils import is_list_like
 
+from . import _context
+from ._cache import TTLCache
 from .types import (
     CacheRecordEntity,
     CacheRecordFullChannel,
@@ -37,6 +41,13 @@ from .types import (
 
 logger = logging.getLogger(__name__)
 
+# Records are also checked against `exp` of particular request, cache lifetime
+# only limits how long unused records are kept in memory
+CACHE_TTL = 60 * 60
+ENTITY_CACHE_SIZE = 10000
+PERMS_CACHE_SIZE = 10000
+FULL_CACHE_SIZE = 1000
+
 
 def hashable(value: typing.Any) -> bool:
     """
@@ -57,27 +68,14 @@ class CustomTelegramClient(TelegramClient):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
 
-        self._hikka_entity_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordEntity,
-        ] = {}
-
-        self._hikka_perms_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordPerms,
-        ] = {}
-
-        self._hikka_fullchannel_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordFullChannel,
-        ] = {}
+        self._hikka_entity_cache = TTLCache(ENTITY_CACHE_SIZE, CACHE_TTL)
+        self._hikka_perms_cache = TTLCache(PERMS_CACHE_SIZE, CACHE_TTL)
+        self._hikka_fullchannel_cache = TTLCache(FULL_CACHE_SIZE, CACHE_TTL)
+        self._hikka_fulluser_cache = TTLCache(FULL_CACHE_SIZE, CACHE_TTL)
 
-        self._hikka_fulluser_cache: typing.Dict[
-            typing.Union[str, int],
-            CacheRecordFullUser,
-        ] = {}
+        self._hikka_inflight: typing.Dict[tuple, asyncio.Future] = {}
 
-        self._forbidden_constructors: typing.List[int] = []
+        self._forbidden_constructors: typing.Set[int] = set()
 
         self._raw_updates_processor: typing.Optional[
             typing.Callable[
@@ -101,23 +99,23 @@ class CustomTelegramClient(TelegramClient):
         self._raw_updates_processor = value
 
     @property
-    def hikka_entity_cache(self) -> typing.Dict[int, CacheRecordEntity]:
+    def hikka_entity_cache(self) -> TTLCache:
         return self._hikka_entity_cache
 
     @property
-    def hikka_perms_cache(self) -> typing.Dict[int, CacheRecordPerms]:
+    def hikka_perms_cache(self) -> TTLCache:
         return self._hikka_perms_cache
 
     @property
-    def hikka_fullchannel_cache(self) -> typing.Dict[int, CacheRecordFullChannel]:
+    def hikka_fullchannel_cache(self) -> TTLCache:
         return self._hikka_fullchannel_cache
 
     @property
-    def hikka_fulluser_cache(self) -> typing.Dict[int, CacheRecordFullUser]:
+    def hikka_fulluser_cache(self) -> TTLCache:
         return self._hikka_fulluser_cache
 
     @property
-    def forbidden_constructors(self) -> typing.List[str]:
+    def forbidden_constructors(self) -> typing.Set[int]:
         return self._forbidden_constructors
 
     async def force_get_entity(self, *args, **kwargs):
@@ -130,6 +128,7 @@ class CustomTelegramClient(TelegramClient):
         entity: EntityLike,
         exp: int = 5 * 60,
         force: bool = False,
+        stale_while_revalidate: bool = False,
     ):
         """
         Gets the entity and cache it
@@ -137,12 +136,11 @@ class CustomTelegramClient(TelegramClient):
         :param entity: Entity to fetch
         :param exp: Expiration time of the cache record and maximum time of already cached record
         :param force: Whether to force refresh the cache (make API request)
+        :param stale_while_revalidate: Whether to return expired cache record immediately and refresh it in background
         :return: :obj:`Entity`
         """
 
-        # Will be used to determine, which client caused logging messages
-        # parsed via inspect.stack()
-        _hikka_client_id_logging_tag = copy.copy(self.tg_id)  # noqa: F841
+        _context.set_client_id(self.tg_id)
 
         if not hashable(entity):
             try:
@@ -163,42 +161,56 @@ class CustomTelegramClient(TelegramClient):
         if str(hashable_entity).isdigit() and int(hashable_entity) < 0:
             hashable_entity = int(str(hashable_entity)[4:])
 
+        async def fetch():
+            resolved_entity = await TelegramClient.get_entity(self, entity)
+
+            if resolved_entity:
+                cache_record = CacheRecordEntity(hashable_entity, resolved_entity, exp)
+                self._hikka_entity_cache[hashable_entity] = cache_record
+                logger.debug("Saved hashable_entity %s to cache", hashable_entity)
+
+                if getattr(resolved_entity, "id", None):
+                    logger.debug(
+                        "Saved resolved_entity id %s to cache",
+                        resolved_entity.id,
+                    )
+                    self._hikka_entity_cache[resolved_entity.id] = cache_record
+
+                if getattr(resolved_entity, "username", None):
+                    logger.debug(
+                        "Saved resolved_entity username @%s to cache",
+                        resolved_entity.username,
+                    )
+                    self._hikka_entity_cache[f"@{resolved_entity.username}"] = (
+                        cache_record
+                    )
+                    self._hikka_entity_cache[resolved_entity.username] = cache_record
+
+            return resolved_entity
+
         if (
             not force
             and hashable_entity
-            and hashable_entity in self._hikka_entity_cache
-            and (
-                not exp
-                or self._hikka_entity_cache[hashable_entity].ts + exp > time.time()
-            )
+            and (record := self._hikka_entity_cache.get(hashable_entity))
         ):
-            logger.debug(
-                "Using cached entity %s (%s)",
-                entity,
-                type(self._hikka_entity_cache[hashable_entity].entity).__name__,
-            )
-            return copy.deepcopy(self._hikka_entity_cache[hashable_entity].entity)
-
-        resolved_entity = await TelegramClient.get_entity(self, entity)
-
-        if resolved_entity:
-            cache_record = CacheRecordEntity(hashable_entity, resolved_entity, exp)
-            self._hikka_entity_cache[hashable_entity] = cache_record
-            logger.debug("Saved hashable_entity %s to cache", hashable_entity)
-
-            if getattr(resolved_entity, "id", None):
-                logger.debug("Saved resolved_entity id %s to cache", resolved_entity.id)
-                self._hikka_entity_cache[resolved_entity.id] = cache_record
-
-            if getattr(resolved_entity, "username", None):
+            if not exp or record.ts + exp > time.time():
                 logger.debug(
-                    "Saved resolved_entity username @%s to cache",
-                    resolved_entity.username,
+                    "Using cached entity %s (%s)",
+                    entity,
+                    type(record.entity).__name__,
                 )
-                self._hikka_entity_cache[f"@{resolved_entity.username}"] = cache_record
-                self._hikka_entity_cache[resolved_entity.username] = cache_record
+                return copy.copy(record.entity)
+
+            if stale_while_revalidate:
+                logger.debug("Using stale entity %s, refreshing it", entity)
+                self._single_flight(("entity", hashable_entity), fetch)
+                return copy.copy(record.entity)
 
-        return copy.deepcopy(resolved_entity)
+        return copy.copy(
+            await asyncio.shield(
+                self._single_flight(("entity", hashable_entity), fetch)
+            )
+        )
 
     async def get_perms_cached(
         self,
@@ -206,6 +218,7 @@ class CustomTelegramClient(TelegramClient):
         user: typing.Optional[EntityLike] = None,
         exp: int = 5 * 60,
         force: bool = False,
+        stale_while_revalidate: bool = False,
     ):
         """
         Gets the permissions of the user in the entity and cache it
@@ -214,12 +227,11 @@ class CustomTelegramClient(TelegramClient):
         :param user: User to fetch
         :param exp: Expiration time of the cache record and maximum time of already cached record
         :param force: Whether to force refresh the cache (make API request)
+        :param stale_while_revalidate: Whether to return expired cache record immediately and refresh it in background
         :return: :obj:`ChatPermissions`
         """
 
-        # Will be used to determine, which client caused logging messages
-        # parsed via inspect.stack()
-        _hikka_client_id_logging_tag = copy.copy(self.tg_id)  # noqa: F841
+        _context.set_client_id(self.tg_id)
 
         entity = await self.get_entity(entity)
         user = await self.get_entity(user) if user else None
@@ -260,68 +272,81 @@ class CustomTelegramClient(TelegramClient):
         if str(hashable_user).isdigit() and int(hashable_user) < 0:
             hashable_user = int(str(hashable_user)[4:])
 
+        async def fetch():
+            resolved_perms = await self.get_permissions(entity, user)
+
+            if resolved_perms:
+                cache_record = CacheRecordPerms(
+                    hashable_entity,
+                    hashable_user,
+                    resolved_perms,
+                    exp,
+                )
+                self._hikka_perms_cache[(hashable_entity, hashable_user)] = cache_record
+                logger.debug("Saved hashable_entity %s perms to cache", hashable_entity)
+
+                def save_user(key: typing.Union[str, int]):
+                    if getattr(user, "id", None):
+                        self._hikka_perms_cache[(key, user.id)] = cache_record
+
+                    if getattr(user, "username", None):
+                        self._hikka_perms_cache[(key, f"@{user.username}")] = (
+                            cache_record
+                        )
+                        self._hikka_perms_cache[(key, user.username)] = cache_record
+
+                if getattr(entity, "id", None):
+                    logger.debug(
+                        "Saved resolved_entity id %s perms to cache",
+                        entity.id,
+                    )
+                    save_user(entity.id)
+
+                if getattr(entity, "username", None):
+                    logger.debug(
+                        "Saved resolved_entity username @%s perms to cache",
+                        entity.username,
+                    )
+                    save_user(f"@{entity.username}")
+                    save_user(entity.username)
+
+            return resolved_perms
+
+        key = ("perms", hashable_entity, hashable_user)
+
         if (
             not force
             and hashable_entity
             and hashable_user
-            and hashable_user in self._hikka_perms_cache.get(hashable_entity, {})
             and (
-                not exp
-                or self._hikka_perms_cache[hashable_entity][hashable_user].ts + exp
-                > time.time()
+                record := self._hikka_perms_cache.get((hashable_entity, hashable_user))
             )
         ):
-            logger.debug("Using cached perms %s (%s)", hashable_entity, hashable_user)
-            return copy.deepcopy(
-                self._hikka_perms_cache[hashable_entity][hashable_user].perms
-            )
-
-        resolved_perms = await self.get_permissions(entity, user)
+            if not exp or record.ts + exp > time.time():
+                logger.debug(
+                    "Using cached perms %s (%s)",
+                    hashable_entity,
+                    hashable_user,
+                )
+                return copy.copy(record.perms)
 
-        if resolved_perms:
-            cache_record = CacheRecordPerms(
-                hashable_entity,
-                hashable_user,
-                resolved_perms,
-                exp,
-            )
-            self._hikka_perms_cache.setdefault(hashable_entity, {})[
-                hashable_user
-            ] = cache_record
-            logger.debug("Saved hashable_entity %s perms to cache", hashable_entity)
-
-            def save_user(key: typing.Union[str, int]):
-                nonlocal self, cache_record, user, hashable_user
-                if getattr(user, "id", None):
-                    self._hikka_perms_cache.setdefault(key, {})[user.id] = cache_record
-
-                if getattr(user, "username", None):
-                    self._hikka_perms_cache.setdefault(key, {})[
-                        f"@{user.username}"
-                    ] = cache_record
-                    self._hikka_perms_cache.setdefault(key, {})[
-                        user.username
-                    ] = cache_record
-
-            if getattr(entity, "id", None):
-                logger.debug("Saved resolved_entity id %s perms to cache", entity.id)
-                save_user(entity.id)
-
-            if getattr(entity, "username", None):
+            if stale_while_revalidate:
                 logger.debug(
-                    "Saved resolved_entity username @%s perms to cache",
-                    entity.username,
+                    "Using stale perms %s (%s), refreshing them",
+                    hashable_entity,
+                    hashable_user,
                 )
-                save_user(f"@{entity.username}")
-                save_user(entity.username)
+                self._single_flight(key, fetch)
+                return copy.copy(record.perms)
 
-        return copy.deepcopy(resolved_perms)
+        return copy.copy(await asyncio.shield(self._single_flight(key, fetch)))
 
     async def get_fullchannel(
         self,
         entity: EntityLike,
         exp: int = 300,
         force: bool = False,
+        stale_while_revalidate: bool = False,
     ) -> ChannelFull:
         """
         Gets the FullChannelRequest and cache it
@@ -329,6 +354,7 @@ class CustomTelegramClient(TelegramClient):
         :param entity: Channel to fetch ChannelFull of
         :param exp: Expiration time of the cache record and maximum time of already cached record
         :param force: Whether to force refresh the cache (make API request)
+        :param stale_while_revalidate: Whether to return expired cache record immediately and refresh it in background
         :return: :obj:`ChannelFull`
         """
         if not hashable(entity):
@@ -353,27 +379,33 @@ class CustomTelegramClient(TelegramClient):
         if str(hashable_entity).isdigit() and int(hashable_entity) < 0:
             hashable_entity = int(str(hashable_entity)[4:])
 
-        if (
-            not force
-            and self._hikka_fullchannel_cache.get(hashable_entity)
-            and not self._hikka_fullchannel_cache[hashable_entity].expired
-            and self._hikka_fullchannel_cache[hashable_entity].ts + exp > time.time()
-        ):
-            return self._hikka_fullchannel_cache[hashable_entity].full_channel
+        async def fetch():
+            result = await self(GetFullChannelRequest(channel=entity))
+            self._hikka_fullchannel_cache[hashable_entity] = CacheRecordFullChannel(
+                hashable_entity,
+                result,
+                exp,
+            )
+            return result
+
+        if not force and (record := self._hikka_fullchannel_cache.get(hashable_entity)):
+            if not record.expired and record.ts + exp > time.time():
+                return record.full_channel
+
+            if stale_while_revalidate:
+                self._single_flight(("fullchannel", hashable_entity), fetch)
+                return record.full_channel
 
-        result = await self(GetFullChannelRequest(channel=entity))
-        self._hikka_fullchannel_cache[hashable_entity] = CacheRecordFullChannel(
-            hashable_entity,
-            result,
-            exp,
+        return await asyncio.shield(
+            self._single_flight(("fullchannel", hashable_entity), fetch)
         )
-        return result
 
     async def get_fulluser(
         self,
         entity: EntityLike,
         exp: int = 300,
         force: bool = False,
+        stale_while_revalidate: bool = False,
     ) -> UserFull:
         """
         Gets the FullUserRequest and cache it
@@ -381,6 +413,7 @@ class CustomTelegramClient(TelegramClient):
         :param entity: User to fetch UserFull of
         :param exp: Expiration time of the cache record and maximum time of already cached record
         :param force: Whether to force refresh the cache (make API request)
+        :param stale_while_revalidate: Whether to return expired cache record immediately and refresh it in background
         :return: :obj:`UserFull`
         """
         if not hashable(entity):
@@ -405,70 +438,78 @@ class CustomTelegramClient(TelegramClient):
         if str(hashable_entity).isdigit() and int(hashable_entity) < 0:
             hashable_entity = int(str(hashable_entity)[4:])
 
-        if (
-            not force
-            and self._hikka_fulluser_cache.get(hashable_entity)
-            and not self._hikka_fulluser_cache[hashable_entity].expired
-            and self._hikka_fulluser_cache[hashable_entity].ts + exp > time.time()
-        ):
-            return self._hikka_fulluser_cache[hashable_entity].full_user
+        async def fetch():
+            result = await self(GetFullUserRequest(entity))
+            self._hikka_fulluser_cache[hashable_entity] = CacheRecordFullUser(
+                hashable_entity,
+                result,
+                exp,
+            )
+            return result
+
+        if not force and (record := self._hikka_fulluser_cache.get(hashable_entity)):
+            if not record.expired and record.ts + exp > time.time():
+                return record.full_user
 
-        result = await self(GetFullUserRequest(entity))
-        self._hikka_fulluser_cache[hashable_entity] = CacheRecordFullUser(
-            hashable_entity,
-            result,
-            exp,
+            if stale_while_revalidate:
+                self._single_flight(("fulluser", hashable_entity), fetch)
+                return record.full_user
+
+        return await asyncio.shield(
+            self._single_flight(("fulluser", hashable_entity), fetch)
         )
-        return result
 
-    @staticmethod
-    def _find_message_obj_in_frame(
-        chat_id: int,
-        frame: inspect.FrameInfo,
-    ) -> typing.Optional[Message]:
+    def _single_flight(
+        self,
+        key: tuple,
+        factory: typing.Callable[[], typing.Awaitable[typing.Any]],
+    ) -> asyncio.Future:
         """
-        Finds the message object from the frame
+        Starts the request, unless the same one is already in flight. Callers
+        should wrap the result in `asyncio.shield`, so cancellation of one
+        of them does not cancel the request for the rest
+        :param key: Key, identifying the request
+        :param factory: Function, which creates the request coroutine
+        :return: Future, shared by all callers, which requested `key`
         """
-        logger.debug("Finding message object in frame %s", frame)
-        return next(
-            (
-                obj
-                for obj in frame.frame.f_locals.values()
-                if isinstance(obj, Message)
-                and getattr(obj.reply_to, "forum_topic", False)
-                and chat_id == getattr(obj.peer_id, "channel_id", None)
-            ),
-            None,
-        )
+        if (future := self._hikka_inflight.get(key)) is None:
+            future = asyncio.ensure_future(factory())
+            self._hikka_inflight[key] = future
+            future.add_done_callback(functools.partial(self._single_flight_done, key))
+
+        return future
 
-    async def _find_message_obj_in_stack(
+    def _single_flight_done(self, key: tuple, future: asyncio.Future):
+        if self._hikka_inflight.get(key) is future:
+            del self._hikka_inflight[key]
+
+        if not future.cancelled() and (exc := future.exception()):
+            logger.debug("Request %s failed", key, exc_info=exc)
+
+    async def _find_message_obj(
         self,
         chat: EntityLike,
-        stack: typing.List[inspect.FrameInfo],
     ) -> typing.Optional[Message]:
         """
-        Finds the message object from the stack
+        Finds the message object, which is being processed in current context
         """
+        message = _context.get_message()
+        if not isinstance(message, Message) or not getattr(
+            message.reply_to, "forum_topic", False
+        ):
+            return None
+
         chat_id = (await self.get_entity(chat, exp=0)).id
-        logger.debug("Finding message object in stack for chat %s", chat_id)
-        return next(
-            (
-                self._find_message_obj_in_frame(chat_id, frame_info)
-                for frame_info in stack
-                if self._find_message_obj_in_frame(chat_id, frame_info)
-            ),
-            None,
+        logger.debug("Checking context message for chat %s", chat_id)
+        return (
+            message if chat_id == getattr(message.peer_id, "channel_id", None) else None
         )
 
-    async def _find_topic_in_stack(
-        self,
-        chat: EntityLike,
-        stack: typing.List[inspect.FrameInfo],
-    ) -> typing.Optional[Message]:
+    async def _find_topic(self, chat: EntityLike) -> typing.Optional[int]:
         """
-        Finds the message object from the stack
+        Finds the topic id from the message in current context
         """
-        message = await self._find_message_obj_in_stack(chat, stack)
+        message = await self._find_message_obj(chat)
         return (
             (message.reply_to.reply_to_top_id or message.reply_to.reply_to_msg_id)
             if message
@@ -478,7 +519,6 @@ class CustomTelegramClient(TelegramClient):
     async def _topic_guesser(
         self,
         native_method: typing.Callable[..., typing.Awaitable[Message]],
-        stack: typing.List[inspect.FrameInfo],
         *args,
         **kwargs,
     ):
@@ -491,7 +531,7 @@ class CustomTelegramClient(TelegramClient):
 
             logger.debug("Topic deleted, trying to guess topic id")
 
-            topic = await self._find_topic_in_stack(args[0], stack)
+            topic = await self._find_topic(args[0])
 
             logger.debug("Guessed topic id: %s", topic)
 
@@ -500,23 +540,39 @@ class CustomTelegramClient(TelegramClient):
 
             kwargs["reply_to"] = topic
             kwargs["_topic_no_retry"] = True
-            return await self._topic_guesser(native_method, stack, *args, **kwargs)
+            return await self._topic_guesser(native_method, *args, **kwargs)
 
     async def send_file(self, *args, **kwargs) -> Message:
-        return await self._topic_guesser(
-            TelegramClient.send_file,
-            inspect.stack(),
-            *args,
-            **kwargs,
-        )
+        return await self._topic_guesser(TelegramClient.send_file, *args, **kwargs)
 
     async def send_message(self, *args, **kwargs) -> Message:
-        return await self._topic_guesser(
-            TelegramClient.send_message,
-            inspect.stack(),
-            *args,
-            **kwargs,
-        )
+        return await self._topic_guesser(TelegramClient.send_message, *args, **kwargs)
+
+    @staticmethod
+    def _is_module_request() -> bool:
+        """
+        Checks, whether current request is issued by non-core module.
+        Module is taken from context. Code, which Hikka doesn't enter itself
+        (e.g. handlers, added via `add_event_handler`), has none there,
+        so the stack is walked in this case
+        """
+
+        def is_external(obj: typing.Any) -> bool:
+            return isinstance(obj, Module) and not getattr(
+                obj, "__origin__", ""
+            ).startswith("<core")
+
+        if (module := _context.get_module()) is not None:
+            return is_external(module)
+
+        frame = inspect.currentframe()
+        while frame is not None:
+            if is_external(frame.f_locals.get("self")):
+                return True
+
+            frame = frame.f_back
+
+        return False
 
     async def _call(
         self,
@@ -548,23 +604,14 @@ class CustomTelegramClient(TelegramClient):
             not_tuple = True
             request = (request,)
 
+        from_module = None
         new_request = []
 
         for item in request:
-            if item.CONSTRUCTOR_ID in self._forbidden_constructors and next(
-                (
-                    frame_info.frame.f_locals["self"]
-                    for frame_info in inspect.stack()
-                    if hasattr(frame_info, "frame")
-                    and hasattr(frame_info.frame, "f_locals")
-                    and isinstance(frame_info.frame.f_locals, dict)
-                    and "self" in frame_info.frame.f_locals
-                    and isinstance(frame_info.frame.f_locals["self"], Module)
-                    and not getattr(
-                        frame_info.frame.f_locals["self"], "__origin__", ""
-                    ).startswith("<core")
-                ),
-                None,
+            if item.CONSTRUCTOR_ID in self._forbidden_constructors and (
+                from_module
+                if from_module is not None
+                else (from_module := self._is_module_request())
             ):
                 logger.debug(
                     "🎉 I protected you from unintented %s (%s)!",
@@ -592,8 +639,7 @@ class CustomTelegramClient(TelegramClient):
 
         :param constructor: Constructor id to forbid
         """
-        self._forbidden_constructors.extend([constructor])
-        self._forbidden_constructors = list(set(self._forbidden_constructors))
+        self._forbidden_constructors.add(constructor)
 
     def forbid_constructors(self, constructors: list):
         """
@@ -602,7 +648,7 @@ class CustomTelegramClient(TelegramClient):
 
         :param constructors: Constructor ids to forbid
         """
-        self._forbidden_constructors = list(set(constructors))
+        self._forbidden_constructors = set(constructors)
 
     def _handle_update(
         self: "CustomTelegramClient",
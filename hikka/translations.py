@@ -9,10 +9,9 @@ import logging
 import typing
 from pathlib import Path
 
-import requests
 from ruamel.yaml import YAML
 
-from . import utils
+from . import _http, utils
 from .database import Database
 from .tl_cache import CustomTelegramClient
 from .types import Module
@@ -97,7 +96,7 @@ class BaseTranslator:
 
     async def load_module_translations(self, pack_url: str) -> typing.Union[bool, dict]:
         try:
-            data = yaml.load((await utils.run_sync(requests.get, pack_url)).text)
+            data = yaml.load((await _http.get(pack_url)).text)
         except Exception:
             logger.exception("Unable to decode %s", pack_url)
             return False
@@ -130,7 +129,7 @@ class Translator(BaseTranslator):
                 if utils.check_url(language):
                     try:
                         data = self._get_pack_raw(
-                            (await utils.run_sync(requests.get, language)).text,
+                            (await _http.get(language)).text,
                             language.split(".")[-1],
                         )
                     except Exception:
@@ -8,7 +8,6 @@
 import ast
 import asyncio
 import contextlib
-import copy
 import importlib
 import importlib.machinery
 import importlib.util
@@ -22,7 +21,6 @@ import typing
 from dataclasses import dataclass, field
 from importlib.abc import SourceLoader
 
-import requests
 from hikkatl.hints import EntityLike
 from hikkatl.tl.functions.account import UpdateNotifySettingsRequest
 from hikkatl.tl.types import (
@@ -33,7 +31,7 @@ from hikkatl.tl.types import (
     UserFull,
 )
 
-from . import version
+from . import _bytecode_cache, _context, _http, version
 from ._reference_finder import replace_all_refs
 from .inline.types import (
     BotInlineCall,
@@ -82,16 +80,18 @@ class StringLoader(SourceLoader):
     def __init__(self, data: str, origin: str):
         self.data = data.encode("utf-8") if isinstance(data, str) else data
         self.origin = origin
+        self._code = None
 
     def get_source(self, _=None) -> str:
         return self.data.decode("utf-8")
 
     def get_code(self, fullname: str) -> bytes:
-        return (
-            compile(source, self.origin, "exec", dont_inherit=True)
-            if (source := self.get_data(fullname))
-            else None
-        )
+        # Code is kept, so the module can be compiled in worker thread
+        # beforehand and executed later without compiling it again
+        if self._code is None and (source := self.get_data(fullname)):
+            self._code = _bytecode_cache.compile_cached(source, self.origin)
+
+        return self._code
 
     def get_filename(self, *args, **kwargs) -> str:
         return self.origin
@@ -172,45 +172,69 @@ class Module:
         await self.allmodules.commands[command](message)
         return message
 
+    def _get_handlers(
+        self,
+        kind: str,
+        getter: typing.Callable[["Module"], typing.Dict[str, Command]],
+    ) -> typing.Dict[str, Command]:
+        """
+        Returns handlers of certain kind, introspecting the module only once
+        :param kind: Kind of handlers
+        :param getter: Function, which introspects the module
+        :return: Copy of handlers table
+        """
+        handlers = self.__dict__.setdefault("_hikka_handlers", {})
+        if kind not in handlers:
+            handlers[kind] = getter(self)
+
+        return dict(handlers[kind])
+
+    def invalidate_handlers(self):
+        """
+        Drops cached handlers, so the module is introspected again on
+        the next access. Call it after adding or removing handlers at runtime
+        """
+        self.__dict__.pop("_hikka_handlers", None)
+
     @property
     def commands(self) -> typing.Dict[str, Command]:
         """List of commands that module supports"""
-        return get_commands(self)
+        return self._get_handlers("commands", get_commands)
 
     @property
     def hikka_commands(self) -> typing.Dict[str, Command]:
         """List of commands that module supports"""
-        return get_commands(self)
+        return self._get_handlers("commands", get_commands)
 
     @property
     def inline_handlers(self) -> typing.Dict[str, Command]:
         """List of inline handlers that module supports"""
-        return get_inline_handlers(self)
+        return self._get_handlers("inline_handlers", get_inline_handlers)
 
     @property
     def hikka_inline_handlers(self) -> typing.Dict[str, Command]:
         """List of inline handlers that module supports"""
-        return get_inline_handlers(self)
+        return self._get_handlers("inline_handlers", get_inline_handlers)
 
     @property
     def callback_handlers(self) -> typing.Dict[str, Command]:
         """List of callback handlers that module supports"""
-        return get_callback_handlers(self)
+        return self._get_handlers("callback_handlers", get_callback_handlers)
 
     @property
     def hikka_callback_handlers(self) -> typing.Dict[str, Command]:
         """List of callback handlers that module supports"""
-        return get_callback_handlers(self)
+        return self._get_handlers("callback_handlers", get_callback_handlers)
 
     @property
     def watchers(self) -> typing.Dict[str, Command]:
         """List of watchers that module supports"""
-        return get_watchers(self)
+        return self._get_handlers("watchers", get_watchers)
 
     @property
     def hikka_watchers(self) -> typing.Dict[str, Command]:
         """List of watchers that module supports"""
-        return get_watchers(self)
+        return self._get_handlers("watchers", get_watchers)
 
     @commands.setter
     def commands(self, _):
@@ -266,7 +290,7 @@ class Module:
         from . import utils
 
         with contextlib.suppress(AttributeError):
-            _hikka_client_id_logging_tag = copy.copy(self.client.tg_id)  # noqa: F841
+            _context.set_client_id(self.client.tg_id)
 
         if interval < 0.1:
             logger.warning(
@@ -480,7 +504,7 @@ class Module:
         if not utils.check_url(url):
             _raise(ValueError("Invalid url for library"))
 
-        code = await utils.run_sync(requests.get, url)
+        code = await _http.get(url)
         code.raise_for_status()
         code = code.text
 
@@ -1034,8 +1058,8 @@ class CacheRecordEntity:
         resolved_entity: EntityLike,
         exp: int,
     ):
-        self.entity = copy.deepcopy(resolved_entity)
-        self._hashable_entity = copy.deepcopy(hashable_entity)
+        self.entity = resolved_entity
+        self._hashable_entity = hashable_entity
         self._exp = round(time.time() + exp)
         self.ts = time.time()
 
@@ -1067,9 +1091,9 @@ class CacheRecordPerms:
         resolved_perms: EntityLike,
         exp: int,
     ):
-        self.perms = copy.deepcopy(resolved_perms)
-        self._hashable_entity = copy.deepcopy(hashable_entity)
-        self._hashable_user = copy.deepcopy(hashable_user)
+        self.perms = resolved_perms
+        self._hashable_entity = hashable_entity
+        self._hashable_user = hashable_user
         self._exp = round(time.time() + exp)
         self.ts = time.time()
 
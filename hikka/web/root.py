@@ -16,7 +16,6 @@ import string
 import time
 
 import aiohttp_jinja2
-import requests
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiohttp import web
 from hikkatl.errors import (
@@ -34,7 +33,7 @@ from hikkatl.tl.functions.auth import CheckPasswordRequest
 from hikkatl.tl.functions.contacts import UnblockRequest
 from hikkatl.utils import parse_phone
 
-from .. import database, main, utils
+from .. import _http, database, main, utils
 from .._internal import restart
 from ..tl_cache import CustomTelegramClient
 from ..version import __version__
@@ -507,12 +506,7 @@ class Web:
 
             self._ratelimit[ip] += [time.time()]
             try:
-                res = (
-                    await utils.run_sync(
-                        requests.get,
-                        f"https://freegeoip.app/json/{ip}",
-                    )
-                ).json()
+                res = (await _http.get(f"https://freegeoip.app/json/{ip}")).json()
                 cities += [
                     f"<i>{utils.get_lang_flag(res['country_code'])} {res['country_name']} {res['region_name']} {res['city']} {res['zip_code']}</i>"
                 ]
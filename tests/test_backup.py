@@ -0,0 +1,66 @@
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import asyncio
+
+from hikka._backup import BackupEngine, apply_increment, decode
+from hikka.database import Database, SQLiteStorage
+
+
+class FakeClient:
+    tg_id = 1
+
+
+def test_full_and_incremental_backups(tmp_path):
+    async def run():
+        storage = SQLiteStorage(tmp_path / "config-1.sqlite")
+        storage.migrate({"lazy": {"value": "stored"}, "a": {"value": 1}})
+
+        db = Database(FakeClient())
+        db._db_file = tmp_path / "config-1.json"
+        db._sqlite = storage
+        db.read()
+        db._full_dirty = False
+
+        db.set("a", "value", 2)
+        db.set("b", "value", 3)
+        db.set("c", "value", 4)
+
+        engine = BackupEngine(db)
+        full, digests = await engine.build()
+        backup = decode(full)
+
+        assert backup["type"] == "full"
+        assert backup["owners"] == {
+            "a": {"value": 2},
+            "b": {"value": 3},
+            "c": {"value": 4},
+            "lazy": {"value": "stored"},
+        }
+        assert digests.keys() == backup["owners"].keys()
+        # Lazy owner is read from storage without being loaded into memory
+        assert db.lazy_owners == {"lazy"}
+
+        db.set("a", "value", 5)
+        del db["c"]
+        db.save("c")
+
+        increment, _ = await engine.build({"message_id": 1, "digests": digests})
+        backup = decode(increment)
+
+        assert backup["type"] == "incremental"
+        assert backup["base"] == 1
+        assert backup["removed"] == ["c"]
+        assert backup["owners"] == {"a": {"value": 5}}
+        assert db.lazy_owners == {"lazy"}
+
+        db.load_all()
+        assert apply_increment(decode(full)["owners"], backup) == db
+
+        await db.force_save()
+        engine.close()
+
+    asyncio.run(run())
@@ -0,0 +1,66 @@
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import os
+
+import pytest
+
+from hikka import _bytecode_cache
+
+SOURCE = b"value = 42\n"
+
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(_bytecode_cache, "CACHE_DIR", str(tmp_path))
+    return tmp_path
+
+
+def records(path) -> set:
+    return {entry.name for entry in os.scandir(path) if entry.name.endswith(".bin")}
+
+
+def run(code) -> int:
+    namespace = {}
+    exec(code, namespace)
+    return namespace["value"]
+
+
+def test_hit_and_origin_miss(cache_dir, monkeypatch):
+    code = _bytecode_cache.compile_cached(SOURCE, "<module a>")
+    assert len(records(cache_dir)) == 1
+
+    def fail(*args, **kwargs):
+        raise AssertionError("Cached code was compiled again")
+
+    # Module-level name shadows builtin, so a cache hit must not reach it
+    monkeypatch.setattr(_bytecode_cache, "compile", fail, raising=False)
+    cached = _bytecode_cache.compile_cached(SOURCE, "<module a>")
+    assert cached == code
+    assert run(cached) == 42
+    monkeypatch.delattr(_bytecode_cache, "compile")
+
+    other = _bytecode_cache.compile_cached(SOURCE, "<module b>")
+    assert other.co_filename == "<module b>"
+    assert len(records(cache_dir)) == 2
+
+
+def test_prune_least_recently_used(cache_dir, monkeypatch):
+    monkeypatch.setattr(_bytecode_cache, "MAX_FILES", 2)
+
+    paths = []
+    for i, origin in enumerate(["<a>", "<b>"]):
+        _bytecode_cache.compile_cached(SOURCE, origin)
+        paths += [_bytecode_cache._get_path(_bytecode_cache._get_key(SOURCE, origin))]
+        os.utime(paths[-1], (1000 + i, 1000 + i))
+
+    # Hit refreshes mtime, so `<a>` becomes the most recently used record
+    _bytecode_cache.compile_cached(SOURCE, "<a>")
+    _bytecode_cache.compile_cached(SOURCE, "<c>")
+
+    assert len(records(cache_dir)) == 2
+    assert os.path.exists(paths[0])
+    assert not os.path.exists(paths[1])
@@ -0,0 +1,109 @@
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import asyncio
+import json
+
+from hikka.database import Database, RevisionJournal, SQLiteStorage
+
+
+class FakeClient:
+    tg_id = 1
+
+
+def snapshots_size(journal: RevisionJournal) -> int:
+    return sum(
+        {
+            id(snapshot): len(snapshot)
+            for revision in journal._revisions
+            for snapshot in revision.values()
+        }.values()
+    )
+
+
+def test_journal_limits():
+    journal = RevisionJournal(max_revisions=3, max_size=200)
+    db = {"big": {}, "small": {"value": 0}}
+
+    for i in range(10):
+        db["big"]["key"] = "x" * 60 + str(i)
+        db["small"]["value"] = i
+        journal.mark("big")
+        journal.mark("small")
+        journal.record(db)
+
+        assert len(journal) <= 3
+        assert journal.size == snapshots_size(journal)
+
+    # Each revision holds ~90 bytes, so only two of them fit
+    assert len(journal) == 2
+    assert journal.size <= 200
+    assert journal.get(1) == db
+    assert journal.get(2)["small"] == {"value": 8}
+
+
+def test_journal_shares_unchanged_owners():
+    journal = RevisionJournal()
+    db = {"a": {"value": 1}, "b": {"value": "x" * 100}}
+    journal.record(db)
+    size = journal.size
+
+    db["a"]["value"] = 2
+    journal.mark("a")
+    journal.record(db)
+
+    assert journal.size == size + len(json.dumps(db["a"]))
+    assert journal.get(2) == {"a": {"value": 1}, "b": db["b"]}
+
+    journal.drop(1)
+    assert journal.size == size
+    assert journal.get(1)["a"] == {"value": 1}
+
+
+def test_rollback_keeps_lazy_sqlite_owners(tmp_path):
+    async def run():
+        storage = SQLiteStorage(tmp_path / "config-1.sqlite")
+        storage.migrate({"a": {"value": 1}, "b": {"value": 2}})
+
+        db = Database(FakeClient())
+        db._db_file = tmp_path / "config-1.json"
+        db._sqlite = storage
+        db.read()
+        db._full_dirty = False
+
+        db.set("a", "value", 10)
+        # Owner `b` is loaded after the revision is recorded
+        assert db["b"] == {"value": 2}
+
+        db._next_revision_call = 0
+        db.set("a", "value", 20)
+
+        assert db.rollback(2)
+        assert db.get("a", "value") == 10
+        await db.force_save()
+
+        assert storage.owners() == {"a", "b"}
+        assert storage.load_owner("b") == {"value": 2}
+        assert db.get("b", "value") == 2
+
+    asyncio.run(run())
+
+
+def test_failed_json_write_is_retried(tmp_path):
+    async def run():
+        db = Database(FakeClient())
+        # Directory is missing, so the write fails
+        db._db_file = tmp_path / "data" / "config-1.json"
+        db._full_dirty = False
+
+        db.set("a", "value", 1)
+        assert not await db.force_save()
+
+        (tmp_path / "data").mkdir()
+        assert db.flush_sync()
+        assert json.loads(db._db_file.read_text()) == {"a": {"value": 1}}
+
+    asyncio.run(run())
@@ -0,0 +1,111 @@
+# ©️ Dan Gazizullin, 2021-2023
+# This file is a part of Hikka Userbot
+# 🌐 https://github.com/hikariatama/Hikka
+# You can redistribute it and/or modify it under the terms of the GNU AGPLv3
+# 🔑 https://www.gnu.org/licenses/agpl-3.0.html
+
+import asyncio
+
+import pytest
+from aiohttp import web
+from aiohttp.test_utils import TestServer
+
+from hikka import _http, utils
+from hikka._local_storage import RemoteStorage
+
+SOURCE = "# meta developer: @hikarimods\n"
+ETAG = '"v1"'
+LAST_MODIFIED = "Wed, 21 Oct 2015 07:28:00 GMT"
+
+
+class FakeClient:
+    tg_id = 1
+
+
+@pytest.fixture(autouse=True)
+def isolated_storage(tmp_path, monkeypatch):
+    # Local storage lives in the home directory
+    monkeypatch.setenv("HOME", str(tmp_path))
+    monkeypatch.setattr(utils, "get_git_hash", lambda: "test")
+
+
+def make_app(requests: list) -> web.Application:
+    async def module(request: web.Request) -> web.Response:
+        requests.append(dict(request.headers))
+        if (
+            request.headers.get("If-None-Match") == ETAG
+            or request.headers.get("If-Modified-Since") == LAST_MODIFIED
+        ):
+            return web.Response(status=304)
+
+        return web.Response(
+            text=SOURCE,
+            headers={"ETag": ETAG, "Last-Modified": LAST_MODIFIED},
+        )
+
+    app = web.Application()
+    app.router.add_get("/mods/test.py", module)
+    return app
+
+
+def test_revalidation():
+    async def run():
+        requests = []
+        async with TestServer(make_app(requests)) as server:
+            url = str(server.make_url("/mods/test.py"))
+            storage = RemoteStorage(FakeClient())
+
+            assert await storage.fetch(url) == SOURCE
+            assert "If-None-Match" not in requests[0]
+
+            # Cached copy is revalidated and server answers without body
+            assert await storage.fetch(url) == SOURCE
+            assert requests[1]["If-None-Match"] == ETAG
+            assert requests[1]["If-Modified-Since"] == LAST_MODIFIED
+
+            response = await _http.get(url, etag=ETAG)
+            assert response.not_modified and response.text == ""
+
+        await _http.close()
+
+    asyncio.run(run())
+
+
+def test_error_status():
+    async def run():
+        async with TestServer(make_app([])) as server:
+            url = str(server.make_url("/mods/missing.py"))
+            storage = RemoteStorage(FakeClient())
+
+            response = await _http.get(url)
+            assert response.status == 404 and not response.ok
+
+            # Module was never cached, so there is nothing to fall back to
+            with pytest.raises(_http.HTTPError) as e:
+                await storage.fetch(url)
+
+            assert e.value.response.status == 404
+
+        await _http.close()
+
+    asyncio.run(run())
+
+
+def test_fallback_to_cache():
+    async def run():
+        requests = []
+        server = TestServer(make_app(requests))
+        await server.start_server()
+        url = str(server.make_url("/mods/test.py"))
+        storage = RemoteStorage(FakeClient())
+
+        assert await storage.fetch(url) == SOURCE
+        await server.close()
+
+        # Server is not reachable anymore, so cached copy is used
+        assert await storage.fetch(url) == SOURCE
+        assert len(requests) == 1
+
+        await _http.close()
+
+    asyncio.run(run())